@@ -4,9 +4,9 @@ import threading
 
 from lru_cache.abstract_lru_cache import (
     Serializer,
-    AbstractLRUCache,
     ProxyCache,
     CacheError)
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
 
 LOGGER = logging.getLogger(__name__)
 
@@ -30,45 +30,23 @@ class TestSerializer(Serializer):
         return 4, obj
 
 
-class MemoryLRUCache(AbstractLRUCache):
-    def __init__(self, *a, **kw):
-        AbstractLRUCache.__init__(self, *a, **kw)
-
-    def load(self):
-        yield 0
-
-    def prepare(self):
-        self._d = {}
-
-    def finalize(self):
-        self._d = None
-
-    def read_cache(self, key):
-        return self._d[key]
-
-    def write_cache(self, key, value):
-        self._d[key] = value
-
-    def delete_cache(self, key):
-        self._d.pop(key, None)
-
-
 proxy_cache = ProxyCache()
 proxy_cache.set_serializer(TestSerializer())
 proxy_cache.set_call_func_when_failure(False)
 proxy_cache.set_key_func(lambda _, key, *a, **kw: key)
 
 for cache_id in range(CACHE_COUNT):
-    cache = MemoryLRUCache(
-        name="memory-cache-%d" % cache_id,
-        max_entry_count=10000,
-        max_size=10*1024*1024*1024,
-        max_inactive=3600,
-        expire_interval=10,
-        forced_expire_interval=2,
-        min_uses=1,
-        lock_age=2,
-        wait_count=4)
+    cache = MemoryLRUCacheBuilder() \
+        .with_name("memory-cache-%d" % cache_id) \
+        .with_max_entry_count(10000) \
+        .with_max_size(10*1024*1024*1024) \
+        .with_max_inactive(3600) \
+        .with_expire_interval(10) \
+        .with_forced_expire_interval(2) \
+        .with_min_uses(1) \
+        .with_lock_age(2) \
+        .with_wait_count(4) \
+        .build()
     cache.start()
     cache.wait_for_usable()
     proxy_cache.add_cache(cache)
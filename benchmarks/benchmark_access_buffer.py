@@ -0,0 +1,103 @@
+# coding: utf8
+
+"""
+和 benchmark.py 一样，100 个线程反复访问 20 个热点 key，
+比较命中时立即调整 LRU 队列与使用命中记录缓冲区时的吞吐量
+
+用法：python -m benchmarks.benchmark_access_buffer [loop_count] [thread_count]
+"""
+
+import logging
+import sys
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer, TimedLock
+from lru_cache.abstract_lru_cache import ProxyCache
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+THREAD_COUNT = 100
+LOOP_COUNT = 3000
+CACHE_COUNT = 5
+GROUP_COUNT = 20
+ACCESS_BUFFER_COUNT = 16
+ACCESS_BUFFER_SIZE = 128
+
+
+def build_proxy_cache(access_buffer_count):
+    proxy_cache = ProxyCache()
+    proxy_cache.set_serializer(TestSerializer())
+    proxy_cache.set_call_func_when_failure(False)
+    proxy_cache.set_key_func(lambda _, key, *a, **kw: key)
+    for cache_id in range(CACHE_COUNT):
+        cache = MemoryLRUCacheBuilder() \
+            .with_name("memory-cache-%d" % cache_id) \
+            .with_max_entry_count(10000) \
+            .with_max_size(10*1024*1024*1024) \
+            .with_max_inactive(3600) \
+            .with_lock_age(2) \
+            .with_wait_count(4) \
+            .with_access_buffer(access_buffer_count,
+                                ACCESS_BUFFER_SIZE) \
+            .build()
+        cache._lock = TimedLock()
+        cache.start()
+        cache.wait_for_usable()
+        proxy_cache.add_cache(cache)
+    return proxy_cache
+
+
+def benchmark(access_buffer_count, loop_count, thread_count):
+    proxy_cache = build_proxy_cache(access_buffer_count)
+
+    @proxy_cache.deco
+    def func(key):
+        return key
+
+    def target(key):
+        for _ in xrange(loop_count):
+            func(key)
+
+    try:
+        threads = [threading.Thread(target=target,
+                                    args=(ind % GROUP_COUNT, ))
+                   for ind in range(thread_count)]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time_used = time.time() - start_time
+        hold_time = sum(cache._lock.hold_time
+                        for cache in proxy_cache.caches)
+        hold_count = sum(cache._lock.hold_count
+                         for cache in proxy_cache.caches)
+        LOGGER.info(
+            "access buffers: %-2d lock hold time per acquire: %.2fus, "
+            "acquires per call: %.2f, throughput: %.0fr/s",
+            access_buffer_count,
+            hold_time / hold_count * 1e6,
+            float(hold_count) / (thread_count * loop_count),
+            thread_count * loop_count / time_used)
+    finally:
+        for cache in proxy_cache.caches:
+            cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    loop_count = LOOP_COUNT
+    thread_count = THREAD_COUNT
+    if len(sys.argv) > 1:
+        loop_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        thread_count = int(sys.argv[2])
+
+    for access_buffer_count in (0, ACCESS_BUFFER_COUNT):
+        benchmark(access_buffer_count, loop_count, thread_count)
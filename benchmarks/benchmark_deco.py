@@ -0,0 +1,137 @@
+# coding: utf8
+
+"""
+测量 ProxyCache.deco 每次调用的开销：只选择分片的开销，以及命中
+MemoryLRUCache 的整个调用的开销；比较 md5 取模的路由与 crc32 加一致性散列路由表。
+另外比较 FileLRUCache 生成缓存文件路径的开销
+
+用法：python -m benchmarks.benchmark_deco [call_count] [shard_count]
+"""
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.abstract_lru_cache import ProxyCache
+from lru_cache.file_lru_cache import FileLRUCache
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+CALL_COUNT = 200000
+SHARD_COUNT = 4
+KEY_COUNT = 1000
+
+
+class Md5ProxyCache(ProxyCache):
+    """使用 crc32 之前的路由方式"""
+    def _select_cache(self, func, *args, **kwargs):
+        key = self._key_func(func, *args, **kwargs)
+        if isinstance(key, unicode):
+            key = key.encode()
+        if isinstance(key, str):
+            key_md5 = hashlib.md5(key).hexdigest()
+            index = int(key_md5, 16) % len(self._caches)
+        elif isinstance(key, (int, long)):
+            index = key % len(self._caches)
+        else:
+            raise TypeError("str or int expected")
+        return key, self._caches[index], func
+
+
+class JoinPathCache(FileLRUCache):
+    """预先计算切片之前生成路径的方式"""
+    def _generate_path(self, key, only_dir_part=False):
+        dir_names = []
+        end = len(key)
+        for level in self._levels:
+            start = end - level
+            dir_names.append(key[start:end])
+            end = start
+        if not only_dir_part:
+            dir_names.append(key)
+        return os.path.join(self._base_path, *dir_names)
+
+
+def benchmark_deco(proxy_class, call_count, shard_count):
+    proxy = proxy_class()
+    for i in range(shard_count):
+        cache = MemoryLRUCacheBuilder() \
+            .with_name("benchmark-deco-%d" % i) \
+            .with_max_entry_count(KEY_COUNT * 2) \
+            .with_max_size(KEY_COUNT * 1024) \
+            .build()
+        cache.start()
+        cache.wait_for_usable()
+        proxy.add_cache(cache)
+    proxy.set_key_func(lambda func, key: key)
+    proxy.set_call_func_when_failure(True)
+    proxy.set_serializer(TestSerializer())
+    try:
+        keys = [hashlib.md5(str(i)).hexdigest() for i in xrange(KEY_COUNT)]
+        keys = (keys * (call_count // KEY_COUNT + 1))[:call_count]
+
+        def func(key):
+            return key
+
+        select_cache = proxy._select_cache
+        start_time = time.time()
+        for key in keys:
+            select_cache(func, key)
+        select_time = time.time() - start_time
+
+        wrapped = proxy.deco(func)
+        for key in keys[:KEY_COUNT]:
+            wrapped(key)
+        start_time = time.time()
+        for key in keys:
+            wrapped(key)
+        call_time = time.time() - start_time
+        LOGGER.info("%-13s %d shards, select shard: %.2fus per call, "
+                    "cache hit through deco: %.2fus per call",
+                    proxy_class.__name__,
+                    shard_count,
+                    select_time / call_count * 1e6,
+                    call_time / call_count * 1e6)
+    finally:
+        for cache in proxy.caches:
+            cache.stop()
+
+
+def benchmark_path(cache_class, call_count):
+    cache = cache_class(
+        tempfile.gettempdir(), "1:2", 1, 0,
+        "benchmark-path", KEY_COUNT, KEY_COUNT, 1, 3600, 1, 1, 3600, 1)
+    keys = [hashlib.md5(str(i)).hexdigest() for i in xrange(KEY_COUNT)]
+    keys = (keys * (call_count // KEY_COUNT + 1))[:call_count]
+    generate_path = cache._generate_path
+    start_time = time.time()
+    for key in keys:
+        generate_path(key)
+    time_used = time.time() - start_time
+    LOGGER.info("%-13s generate path: %.2fus per call",
+                cache_class.__name__,
+                time_used / call_count * 1e6)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    call_count = CALL_COUNT
+    shard_count = SHARD_COUNT
+    if len(sys.argv) > 1:
+        call_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        shard_count = int(sys.argv[2])
+
+    for proxy_class in (Md5ProxyCache, ProxyCache):
+        benchmark_deco(proxy_class, call_count, shard_count)
+    for cache_class in (JoinPathCache, FileLRUCache):
+        benchmark_path(cache_class, call_count)
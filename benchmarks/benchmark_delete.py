@@ -0,0 +1,127 @@
+# coding: utf8
+
+"""
+让 FileLRUCache 中的所有条目同时过期，比较管理线程逐个删除、
+整批同步删除与删除线程分批删除时，删除完所有文件的时间、锁的获取次数，
+以及期间另一个线程命中的延迟
+
+用法：python -m benchmarks.benchmark_delete [file_count] [base_path]
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer, TimedLock
+from lru_cache.file_lru_cache import FileLRUCache
+
+LOGGER = logging.getLogger(__name__)
+
+FILE_COUNT = 50000
+MAX_INACTIVE = 1
+DELETER_COUNTS = (0, 1, 4)
+
+
+class PerEntryDeleteCache(FileLRUCache):
+    """分批删除之前的删除方式：每个条目释放、获取一次锁"""
+    def _delete_unlinked(self, deleting_entries):
+        for entry in deleting_entries:
+            self._lock.release()
+            self._delete_caches([entry])
+            self._lock.acquire()
+            self._finish_deletes([entry])
+
+
+def benchmark(cache_class, deleter_count, base_path, file_count):
+    if os.path.isdir(base_path):
+        shutil.rmtree(base_path)
+    os.makedirs(base_path)
+    cache = cache_class(
+        base_path=base_path,
+        levels="1:2",
+        load_max_files=10000,
+        load_interval=0,
+        name="benchmark-delete-%d" % deleter_count,
+        max_entry_count=file_count + 1,
+        max_size=(file_count + 1) * 1024,
+        min_uses=1,
+        max_inactive=MAX_INACTIVE,
+        lock_age=0.4,
+        wait_count=5,
+        expire_interval=3600,
+        forced_expire_interval=1,
+        deleter_count=deleter_count)
+    cache.start()
+    cache.wait_for_usable()
+    try:
+        keys = [hashlib.md5(str(i)).hexdigest()
+                for i in xrange(file_count)]
+        for key in keys:
+            cache.write_cache(key, "x")
+        cache.add_metas((key, 1) for key in keys)
+        serializer = TestSerializer()
+        hot_key = hashlib.md5("hot").hexdigest()
+        cache.open(hot_key, serializer, False, lambda: hot_key)
+
+        lock = TimedLock()
+        cache._lock = lock
+        latencies = []
+        done = threading.Event()
+
+        def hit():
+            while not done.is_set():
+                start_time = time.time()
+                cache.open(hot_key, serializer, False, lambda: hot_key)
+                latencies.append(time.time() - start_time)
+                time.sleep(0.001)
+
+        time.sleep(MAX_INACTIVE + 0.1)
+        thread = threading.Thread(target=hit)
+        thread.start()
+        start_time = time.time()
+        cache._wakeup_manager()
+        while cache._current_entry_count > 1:
+            time.sleep(0.001)
+        time_used = time.time() - start_time
+        done.set()
+        thread.join()
+        latencies.sort()
+        LOGGER.info(
+            "%-19s deleters: %d, all deleted in %.3fs "
+            "(%.0f files/s), lock acquires: %d, "
+            "hit p99: %.1fus, max: %.1fus",
+            cache_class.__name__,
+            deleter_count,
+            time_used,
+            file_count / time_used,
+            lock.hold_count,
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+            latencies[-1] * 1e6)
+    finally:
+        cache.stop()
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    file_count = FILE_COUNT
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        base_path = sys.argv[2]
+    else:
+        base_path = os.path.join(tempfile.gettempdir(),
+                                 "lru-cache-benchmark-delete")
+
+    benchmark(PerEntryDeleteCache, 0, base_path, file_count)
+    for deleter_count in DELETER_COUNTS:
+        benchmark(FileLRUCache, deleter_count, base_path, file_count)
@@ -0,0 +1,90 @@
+# coding: utf8
+
+"""
+测量每个缓存条目的元数据占用的内存，以及命中一次缓存的延迟
+
+用法：python -m benchmarks.benchmark_entry [entry_count] [hit_count]
+
+内存通过 /proc/self/statm 读取常驻内存计算，只适用于 Linux
+"""
+
+import logging
+import os
+import random
+import sys
+import time
+
+from lru_cache.abstract_lru_cache import Serializer
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+ENTRY_COUNT = 1000000
+HIT_COUNT = 1000000
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class TestSerializer(Serializer):
+    def loads(self, data):
+        return data
+
+    def dumps(self, obj):
+        return 4, obj
+
+
+def rss():
+    with open("/proc/self/statm") as fd:
+        return int(fd.read().split()[1]) * PAGE_SIZE
+
+
+def func(key):
+    return key
+
+
+def benchmark(entry_count, hit_count):
+    cache = MemoryLRUCacheBuilder() \
+        .with_name("benchmark-entry") \
+        .with_max_entry_count(entry_count) \
+        .with_max_size(entry_count * 4) \
+        .build()
+    cache.start()
+    cache.wait_for_usable()
+    try:
+        keys = ["key-%d" % i for i in xrange(entry_count)]
+        for key in keys:
+            cache.write_cache(key, key)
+
+        before = rss()
+        for i in xrange(0, entry_count, 10000):
+            cache.add_metas((key, 4) for key in keys[i:i+10000])
+        memory_per_entry = float(rss() - before) / entry_count
+
+        serializer = TestSerializer()
+        hits = [random.choice(keys) for _ in xrange(hit_count)]
+        start_time = time.time()
+        for key in hits:
+            cache.open(key, serializer, False, func, key)
+        time_used = time.time() - start_time
+        LOGGER.info(
+            "%d entries, metadata memory per entry: %.1f bytes, "
+            "hit latency: %.2fus",
+            entry_count, memory_per_entry,
+            time_used / hit_count * 1e6)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    entry_count = ENTRY_COUNT
+    hit_count = HIT_COUNT
+    if len(sys.argv) > 1:
+        entry_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        hit_count = int(sys.argv[2])
+
+    benchmark(entry_count, hit_count)
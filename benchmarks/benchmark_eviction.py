@@ -0,0 +1,186 @@
+# coding: utf8
+
+"""
+比较不同淘汰策略下，命中时持有锁的时间、多线程命中的吞吐量，以及命中率
+
+用法：python -m benchmarks.benchmark_eviction [entry_count] [hit_count] [thread_count] \
+          [trace_file]
+
+命中率在服从 Zipf 分布的访问序列上测量，key 的总数是缓存容量的 10 倍；
+扫描序列在其中穿插了同样多的只访问一次的 key，用来比较不同的淘汰策略，
+以及 min_uses 与 TinyLFU 准入。指定 trace_file 时（每行一个 key），
+还会在这个真实的访问序列上比较各个淘汰策略的命中率
+"""
+
+import bisect
+import logging
+import random
+import sys
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer, TimedLock
+from lru_cache.eviction_policy import LRUPolicy, ClockPolicy, \
+    SLRUPolicy, TwoQueuePolicy, ARCPolicy
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+ENTRY_COUNT = 10000
+HIT_COUNT = 400000
+THREAD_COUNT = 4
+ZIPF_ALPHA = 0.9
+POLICIES = (LRUPolicy, ClockPolicy, SLRUPolicy, TwoQueuePolicy, ARCPolicy)
+
+
+def zipf_trace(key_count, length, alpha=ZIPF_ALPHA, seed=1):
+    rand = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for i in xrange(1, key_count + 1):
+        total = total + 1.0 / i ** alpha
+        cumulative.append(total)
+    # 打乱 key 的排名，避免热点 key 集中在一起
+    keys = ["key-%d" % i for i in xrange(key_count)]
+    rand.shuffle(keys)
+    return [keys[bisect.bisect_left(cumulative, rand.random() * total)]
+            for _ in xrange(length)]
+
+
+def scan_trace(trace, scan_length=100):
+    """每 scan_length 次 Zipf 访问之后，穿插 scan_length 个只访问一次的 key"""
+    mixed = []
+    for i in xrange(0, len(trace), scan_length):
+        mixed.extend(trace[i:i+scan_length])
+        mixed.extend("scan-%d" % j for j in xrange(i, i + scan_length))
+    return mixed
+
+
+def read_trace(trace_file):
+    with open(trace_file) as fd:
+        return [line.strip() for line in fd if line.strip()]
+
+
+def build_cache(policy, entry_count, min_uses=1, admission=False):
+    return MemoryLRUCacheBuilder() \
+        .with_name("benchmark-%s" % policy.__name__) \
+        .with_max_entry_count(entry_count) \
+        .with_max_size(entry_count * 4) \
+        .with_eviction_policy(policy) \
+        .with_min_uses(min_uses) \
+        .with_admission(admission) \
+        .build()
+
+
+def func(key):
+    return key
+
+
+def benchmark_hits(policy, entry_count, hit_count, thread_count):
+    cache = build_cache(policy, entry_count)
+    cache.start()
+    cache.wait_for_usable()
+    try:
+        keys = ["key-%d" % i for i in xrange(entry_count)]
+        for key in keys:
+            cache.write_cache(key, key)
+        cache.add_metas((key, 4) for key in keys)
+
+        serializer = TestSerializer()
+        lock = TimedLock()
+        cache._lock = lock
+        traces = [zipf_trace(entry_count, hit_count // thread_count,
+                             seed=i)
+                  for i in xrange(thread_count)]
+
+        def hit(trace):
+            for key in trace:
+                cache.open(key, serializer, False, func, key)
+
+        threads = [threading.Thread(target=hit, args=(trace, ))
+                   for trace in traces]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time_used = time.time() - start_time
+        LOGGER.info(
+            "%-12s %d threads, lock hold time per acquire: %.2fus, "
+            "hits: %.0f/s",
+            policy.__name__,
+            thread_count,
+            lock.hold_time / lock.hold_count * 1e6,
+            hit_count / time_used)
+    finally:
+        cache.stop()
+
+
+def benchmark_hit_ratio(policy, entry_count, trace,
+                        min_uses=1, admission=False):
+    cache = build_cache(policy, entry_count, min_uses, admission)
+    cache.start()
+    cache.wait_for_usable()
+    misses = [0]
+
+    def miss(key):
+        misses[0] = misses[0] + 1
+        return key
+
+    try:
+        serializer = TestSerializer()
+        start_time = time.time()
+        for key in trace:
+            cache.open(key, serializer, True, miss, key)
+        time_used = time.time() - start_time
+        LOGGER.info("%-12s min_uses: %d, admission: %-5s "
+                    "hit ratio: %.2f%%, %.2fus per access",
+                    policy.__name__,
+                    min_uses,
+                    admission,
+                    100.0 * (len(trace) - misses[0]) / len(trace),
+                    time_used / len(trace) * 1e6)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    entry_count = ENTRY_COUNT
+    hit_count = HIT_COUNT
+    thread_count = THREAD_COUNT
+    if len(sys.argv) > 1:
+        entry_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        hit_count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        thread_count = int(sys.argv[3])
+    trace_file = None
+    if len(sys.argv) > 4:
+        trace_file = sys.argv[4]
+
+    for policy in (LRUPolicy, ClockPolicy):
+        benchmark_hits(policy, entry_count, hit_count, thread_count)
+
+    trace = zipf_trace(entry_count * 10, hit_count)
+    for policy in POLICIES:
+        benchmark_hit_ratio(policy, entry_count, trace)
+    benchmark_hit_ratio(LRUPolicy, entry_count, trace, admission=True)
+
+    trace = scan_trace(trace)
+    LOGGER.info("with scans:")
+    for policy in POLICIES:
+        benchmark_hit_ratio(policy, entry_count, trace)
+    for min_uses, admission in ((2, False), (1, True)):
+        benchmark_hit_ratio(LRUPolicy, entry_count, trace,
+                            min_uses, admission)
+
+    if trace_file is not None:
+        trace = read_trace(trace_file)
+        LOGGER.info("%s:", trace_file)
+        for policy in POLICIES:
+            benchmark_hit_ratio(policy, entry_count, trace)
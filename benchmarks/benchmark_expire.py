@@ -0,0 +1,92 @@
+# coding: utf8
+
+"""
+让大量条目同时过期，比较一次性过期检查与分片过期检查时，
+清理完所有过期条目的时间，以及期间另一个线程命中的延迟
+
+用法：python -m benchmarks.benchmark_expire [entry_count]
+"""
+
+import logging
+import sys
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+ENTRY_COUNT = 200000
+MAX_INACTIVE = 1
+# (每片最多检查的条目数, 每片最多持续的秒数)，第一组相当于不分片
+SLICES = ((sys.maxint, 3600), (1000, 0.005), (100, 0.001))
+
+
+def benchmark(expire_slice, entry_count):
+    cache = MemoryLRUCacheBuilder() \
+        .with_name("benchmark-expire") \
+        .with_max_entry_count(entry_count + 1) \
+        .with_max_size((entry_count + 1) * 4) \
+        .with_max_inactive(MAX_INACTIVE) \
+        .with_expire_interval(3600) \
+        .with_expire_slice(*expire_slice) \
+        .build()
+    cache.start()
+    cache.wait_for_usable()
+    try:
+        keys = ["key-%d" % i for i in xrange(entry_count)]
+        for key in keys:
+            cache.write_cache(key, key)
+        cache.add_metas((key, 4) for key in keys)
+        serializer = TestSerializer()
+        cache.open("hot", serializer, False, lambda: "hot")
+        latencies = []
+        lags = []
+        done = threading.Event()
+
+        def hit():
+            while not done.is_set():
+                start_time = time.time()
+                cache.open("hot", serializer, False, lambda: "hot")
+                latencies.append(time.time() - start_time)
+                lags.append(cache.expire_lag)
+                time.sleep(0.0005)
+
+        time.sleep(MAX_INACTIVE + 0.1)
+        thread = threading.Thread(target=hit)
+        thread.start()
+        start_time = time.time()
+        cache._wakeup_manager()
+        while cache._current_entry_count > 1:
+            time.sleep(0.001)
+        time_used = time.time() - start_time
+        done.set()
+        thread.join()
+        latencies.sort()
+        LOGGER.info(
+            "slice: %-16s all expired in %.3fs, hits during sweep: %d, "
+            "hit p99: %.1fus, max: %.1fus, max expire lag: %.3fs",
+            "%s/%ss" % (expire_slice[0] if expire_slice[0] < sys.maxint
+                        else "inf", expire_slice[1]),
+            time_used,
+            len(latencies),
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+            latencies[-1] * 1e6,
+            max(lags))
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    entry_count = ENTRY_COUNT
+    if len(sys.argv) > 1:
+        entry_count = int(sys.argv[1])
+
+    for expire_slice in SLICES:
+        benchmark(expire_slice, entry_count)
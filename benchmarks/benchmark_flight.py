@@ -0,0 +1,107 @@
+# coding: utf8
+
+"""
+process_count 个 fork 出来的工作进程使用同一个缓存目录，同时请求同一批没有
+缓存的 key（后端每次调用 COST 秒）。比较不开启与开启进程间 single-flight 时：
+后端调用的总次数，以及每个进程完成请求的平均耗时
+
+用法：python -m benchmarks.benchmark_flight [process_count] [key_count]
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.file_lru_cache import FileLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+PROCESS_COUNT = 8
+KEY_COUNT = 50
+COST = 0.02
+
+
+def key_of(index):
+    return "%032x" % index
+
+
+def worker(base_path, process_flight, key_count, write_fd):
+    builder = FileLRUCacheBuilder() \
+        .with_name("benchmark-flight-%d" % os.getpid()) \
+        .with_base_path(base_path) \
+        .with_max_entry_count(key_count * 2) \
+        .with_max_size(key_count * 1024 * 1024)
+    if process_flight:
+        builder.with_process_flight()
+    cache = builder.build()
+    cache.start()
+    cache.wait_for_usable()
+    calls = []
+
+    def func(key):
+        calls.append(key)
+        time.sleep(COST)
+        return key
+
+    serializer = TestSerializer()
+    start_time = time.time()
+    for index in xrange(key_count):
+        key = key_of(index)
+        cache.open(key, serializer, True, func, key)
+    time_used = time.time() - start_time
+    cache.stop()
+    os.write(write_fd, "%f %d\n" % (time_used, len(calls)))
+
+
+def benchmark(process_flight, process_count, key_count):
+    base_path = tempfile.mkdtemp(prefix="lru-cache-benchmark-flight-")
+    try:
+        read_fd, write_fd = os.pipe()
+        pids = []
+        for _ in range(process_count):
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    os.close(read_fd)
+                    worker(base_path, process_flight, key_count, write_fd)
+                    code = 0
+                finally:
+                    os._exit(code)
+            pids.append(pid)
+        os.close(write_fd)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as fd:
+            results = [map(float, line.split()) for line in fd]
+        LOGGER.info(
+            "%-9s %d processes, %d cold keys, backend calls: %d, "
+            "time: %.1fms avg per process",
+            "flight" if process_flight else "separate",
+            process_count,
+            key_count,
+            sum(calls for _, calls in results),
+            sum(time_used for time_used, _ in results) / len(results) * 1e3)
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    process_count = PROCESS_COUNT
+    key_count = KEY_COUNT
+    if len(sys.argv) > 1:
+        process_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        key_count = int(sys.argv[2])
+
+    for process_flight in (False, True):
+        benchmark(process_flight, process_count, key_count)
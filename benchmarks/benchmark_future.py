@@ -0,0 +1,127 @@
+# coding: utf8
+
+"""
+模拟事件循环：一个线程发起 task_count 个并发调用，访问 FileLRUCache，
+回源计算需要 COST 秒。比较直接调用 deco 包装的函数（事件循环被阻塞），
+与调用 deco_future 包装的函数（立即返回 Future，在 executor 中执行）时，
+事件循环被阻塞的时间、全部完成的时间和回源次数
+
+用法：python -m benchmarks.benchmark_future [task_count] [key_count] [thread_count]
+"""
+
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.abstract_lru_cache import ProxyCache
+from lru_cache.file_lru_cache import FileLRUCacheBuilder
+from lru_cache.future import Executor
+
+LOGGER = logging.getLogger(__name__)
+
+TASK_COUNT = 10000
+KEY_COUNT = 1000
+THREAD_COUNT = 32
+SHARD_COUNT = 4
+COST = 0.01
+
+
+def build_proxy(base_path, key_count):
+    proxy = ProxyCache()
+    for i in range(SHARD_COUNT):
+        path = os.path.join(base_path, str(i))
+        os.makedirs(path)
+        cache = FileLRUCacheBuilder() \
+            .with_name("benchmark-future-%d" % i) \
+            .with_base_path(path) \
+            .with_max_entry_count(key_count) \
+            .with_max_size(key_count * 1024) \
+            .build()
+        cache.start()
+        cache.wait_for_usable()
+        proxy.add_cache(cache)
+    proxy.set_key_func(lambda func, key: key)
+    proxy.set_call_func_when_failure(True)
+    proxy.set_serializer(TestSerializer())
+    return proxy
+
+
+def benchmark(use_future, task_count, key_count, thread_count):
+    base_path = tempfile.mkdtemp(prefix="lru-cache-benchmark-future-")
+    proxy = build_proxy(base_path, key_count)
+    executor = Executor("benchmark-executor", thread_count)
+    executor.start()
+    proxy.set_executor(executor)
+    calls = []
+
+    def func(key):
+        calls.append(key)
+        time.sleep(COST)
+        return key
+
+    rand = random.Random(1)
+    keys = ["%032x" % rand.randint(0, key_count - 1)
+            for _ in xrange(task_count)]
+    try:
+        start_time = time.time()
+        if use_future:
+            wrapped = proxy.deco_future(func)
+            done = threading.Event()
+            remaining = [task_count]
+            lock = threading.Lock()
+
+            def on_done(future):
+                with lock:
+                    remaining[0] = remaining[0] - 1
+                    if remaining[0] == 0:
+                        done.set()
+
+            for key in keys:
+                wrapped(key).add_done_callback(on_done)
+            blocked = time.time() - start_time
+            done.wait()
+        else:
+            wrapped = proxy.deco(func)
+            for key in keys:
+                wrapped(key)
+            blocked = time.time() - start_time
+        time_used = time.time() - start_time
+        LOGGER.info(
+            "%-10s %d tasks, event loop blocked for %.3fs, "
+            "all done in %.3fs, backend calls: %d",
+            "deco_future" if use_future else "deco",
+            task_count,
+            blocked,
+            time_used,
+            len(calls))
+    finally:
+        executor.stop()
+        for cache in proxy.caches:
+            cache.stop()
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    task_count = TASK_COUNT
+    key_count = KEY_COUNT
+    thread_count = THREAD_COUNT
+    if len(sys.argv) > 1:
+        task_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        key_count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        thread_count = int(sys.argv[3])
+
+    for use_future in (False, True):
+        benchmark(use_future, task_count, key_count, thread_count)
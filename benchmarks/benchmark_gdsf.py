@@ -0,0 +1,135 @@
+# coding: utf8
+
+"""
+回放一个访问序列，每个 key 有各自的回源代价（秒）和大小（字节），
+比较不同淘汰策略的命中率、字节命中率，以及节省的后端计算时间
+
+用法：python -m benchmarks.benchmark_gdsf [key_count] [access_count] [cache_ratio]
+
+cache_ratio 是缓存容量占所有 key 总大小的比例。回源代价不真正等待，
+而是推进一个虚拟时钟，缓存测量到的代价就是虚拟时钟的增量。
+每次访问之后同步执行强制淘汰，代替管理线程
+"""
+
+import logging
+import random
+import sys
+
+from benchmarks.benchmark_eviction import zipf_trace
+from lru_cache.abstract_lru_cache import Serializer
+from lru_cache.eviction_policy import LRUPolicy, SLRUPolicy, \
+    ARCPolicy, GDSFPolicy
+from lru_cache.memory_lru_cache import MemoryLRUCache
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_COUNT = 20000
+ACCESS_COUNT = 200000
+CACHE_RATIO = 0.05
+POLICIES = (LRUPolicy, SLRUPolicy, ARCPolicy, GDSFPolicy)
+
+CLOCK = [0.0]
+
+
+class ReplayCache(MemoryLRUCache):
+    @staticmethod
+    def _now():
+        return CLOCK[0]
+
+
+class SizedSerializer(Serializer):
+    """只声明数据的大小，并不真正保存这么多数据"""
+    def __init__(self, sizes):
+        self._sizes = sizes
+
+    def loads(self, data):
+        return data
+
+    def dumps(self, obj):
+        return self._sizes[obj], obj
+
+
+def make_objects(key_count, seed=1):
+    """大小在 1KB 到 200MB 之间，代价在 5ms 到 30s 之间，都是对数均匀分布"""
+    rand = random.Random(seed)
+    sizes = {}
+    costs = {}
+    for i in xrange(key_count):
+        key = "key-%d" % i
+        sizes[key] = int(1024 * 200000 ** rand.random())
+        costs[key] = 0.005 * 6000 ** rand.random()
+    return sizes, costs
+
+
+def benchmark(policy, trace, sizes, costs, max_size):
+    cache = ReplayCache(
+        name="benchmark-%s" % policy.__name__,
+        max_entry_count=len(sizes),
+        max_size=max_size,
+        min_uses=1,
+        max_inactive=365 * 24 * 3600,
+        lock_age=1,
+        wait_count=1,
+        expire_interval=3600,
+        forced_expire_interval=3600,
+        eviction_policy=policy)
+    cache.start()
+    cache.wait_for_usable()
+    serializer = SizedSerializer(sizes)
+    spent = [0.0]
+
+    def func(key):
+        CLOCK[0] = CLOCK[0] + costs[key]
+        spent[0] = spent[0] + costs[key]
+        return key
+
+    try:
+        hits = 0
+        hit_bytes = 0
+        total_bytes = 0
+        total_cost = 0.0
+        for key in trace:
+            before = spent[0]
+            cache.open(key, serializer, True, func, key)
+            if spent[0] == before:
+                hits = hits + 1
+                hit_bytes = hit_bytes + sizes[key]
+            total_bytes = total_bytes + sizes[key]
+            total_cost = total_cost + costs[key]
+            while cache._current_size > max_size and \
+                    cache._forced_expire():
+                pass
+        LOGGER.info(
+            "%-11s hit ratio: %.2f%%, byte hit ratio: %.2f%%, "
+            "backend seconds saved: %.0f of %.0f (%.2f%%)",
+            policy.__name__,
+            100.0 * hits / len(trace),
+            100.0 * hit_bytes / total_bytes,
+            total_cost - spent[0],
+            total_cost,
+            100.0 * (total_cost - spent[0]) / total_cost)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    key_count = KEY_COUNT
+    access_count = ACCESS_COUNT
+    cache_ratio = CACHE_RATIO
+    if len(sys.argv) > 1:
+        key_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        access_count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        cache_ratio = float(sys.argv[3])
+
+    sizes, costs = make_objects(key_count)
+    trace = zipf_trace(key_count, access_count)
+    max_size = int(sum(sizes.itervalues()) * cache_ratio)
+    for policy in POLICIES:
+        benchmark(policy, trace, sizes, costs, max_size)
@@ -0,0 +1,115 @@
+# coding: utf8
+
+"""
+比较不同元数据索引下，每次命中时 AbstractLRUCache 持有锁的时间
+
+用法：python -m benchmarks.benchmark_index [entry_count] [hit_count]
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+
+from lru_cache.abstract_lru_cache import Serializer, ReturnCode
+from lru_cache.dict_map import DictMap
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+from lru_cache.skiplist_map import SkipListMap
+
+LOGGER = logging.getLogger(__name__)
+
+ENTRY_COUNT = 100000
+HIT_COUNT = 200000
+
+
+class TestSerializer(Serializer):
+    def loads(self, data):
+        return data
+
+    def dumps(self, obj):
+        return 4, obj
+
+
+class TimedLock(object):
+    """记录每次持有锁的时长"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0
+        self.hold_time = 0.0
+        self.hold_count = 0
+
+    def acquire(self, blocking=1):
+        got_it = self._lock.acquire(blocking)
+        if got_it:
+            self._acquired_at = time.time()
+        return got_it
+
+    def release(self):
+        self.hold_time = self.hold_time + \
+            time.time() - self._acquired_at
+        self.hold_count = self.hold_count + 1
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *a):
+        self.release()
+
+
+def benchmark(index_class, entry_count, hit_count):
+    cache = MemoryLRUCacheBuilder() \
+        .with_name("benchmark-%s" % index_class.__name__) \
+        .with_max_entry_count(entry_count) \
+        .with_max_size(entry_count * 4) \
+        .with_index(index_class) \
+        .build()
+    cache.start()
+    cache.wait_for_usable()
+    try:
+        keys = ["key-%d" % i for i in range(entry_count)]
+        start_time = time.time()
+        for key in keys:
+            cache.write_cache(key, key)
+            cache.add_meta(key, 4)
+        load_time = time.time() - start_time
+
+        hits = [random.choice(keys) for _ in range(hit_count)]
+        lock = TimedLock()
+        cache._lock = lock
+        start_time = time.time()
+        for key in hits:
+            rc, _ = cache._exists(key)
+            assert rc & ReturnCode.OK
+            # 归还 _exists 中增加的引用计数
+            with lock:
+                cache._map[key].decr_ref_count()
+        time_used = time.time() - start_time
+        LOGGER.info(
+            "%-12s load %d entries in %.3fs, "
+            "lock hold time per hit: %.2fus, hits: %.0f/s",
+            index_class.__name__,
+            entry_count,
+            load_time,
+            lock.hold_time / lock.hold_count * 1e6,
+            hit_count / time_used)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    entry_count = ENTRY_COUNT
+    hit_count = HIT_COUNT
+    if len(sys.argv) > 1:
+        entry_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        hit_count = int(sys.argv[2])
+
+    for index_class in (DictMap, SkipListMap):
+        benchmark(index_class, entry_count, hit_count)
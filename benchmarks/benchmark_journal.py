@@ -0,0 +1,97 @@
+# coding: utf8
+
+"""
+在合成的缓存目录上比较 FileLRUCache 遍历目录加载与从快照和日志恢复的启动时间，
+以及重启之后淘汰顺序的保留情况：重启前被访问过的 hot_ratio 的 key 中，
+有多少在重启后位于最后才会被淘汰的同样多的条目之中
+
+用法：python -m benchmarks.benchmark_journal [file_count] [hot_ratio] [base_path]
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from benchmarks.benchmark_load import make_tree
+from lru_cache.file_lru_cache import FileLRUCache, FileLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+FILE_COUNT = 200000
+HOT_RATIO = 0.1
+
+
+def start_cache(base_path, file_count, journal):
+    cache = FileLRUCacheBuilder() \
+        .with_name("benchmark-journal") \
+        .with_base_path(base_path) \
+        .with_max_entry_count(file_count * 2) \
+        .with_max_size(file_count * 1024) \
+        .with_max_inactive(3600) \
+        .with_expire_interval(3600) \
+        .with_load_interval(0) \
+        .with_journal(journal) \
+        .build()
+    start_time = time.time()
+    cache.start()
+    cache.wait_for_usable()
+    return cache, time.time() - start_time
+
+
+def hot_kept(cache, hot_keys):
+    with cache._lock:
+        records = cache._dump_metas()
+    records.sort(key=lambda record: record[3])
+    newest = set(record[0] for record in records[-len(hot_keys):])
+    return len(newest & hot_keys) * 100.0 / len(hot_keys)
+
+
+def benchmark(journal, base_path, file_count, hot_ratio):
+    shutil.rmtree(os.path.join(base_path, FileLRUCache.JOURNAL_NAME),
+                  ignore_errors=True)
+    hot_keys = set(hashlib.md5(str(i)).hexdigest()
+                   for i in xrange(int(file_count * hot_ratio)))
+    cache, walk_time = start_cache(base_path, file_count, journal)
+    try:
+        cache.get_many(list(hot_keys), TestSerializer())
+    finally:
+        cache.stop()
+
+    cache, restart_time = start_cache(base_path, file_count, journal)
+    try:
+        assert len(cache._map) == file_count
+        LOGGER.info("%-8s %d files, first start: %.3fs, restart: %.3fs, "
+                    "hot keys kept at the head after restart: %.1f%%",
+                    "journal" if journal else "walk",
+                    file_count, walk_time, restart_time,
+                    hot_kept(cache, hot_keys))
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    file_count = FILE_COUNT
+    hot_ratio = HOT_RATIO
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        hot_ratio = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        base_path = sys.argv[3]
+    else:
+        base_path = os.path.join(tempfile.gettempdir(),
+                                 "lru-cache-benchmark-journal")
+    make_tree(base_path, file_count)
+
+    for journal in (False, True):
+        benchmark(journal, base_path, file_count, hot_ratio)
@@ -0,0 +1,116 @@
+# coding: utf8
+
+"""
+在合成的缓存目录上测量 FileLRUCache 从启动到可用（LOADED）的时间，
+比较批量加载与逐个文件调用 add_meta 的加载方式，以及并行遍历目录的线程数
+
+用法：python -m benchmarks.benchmark_load [file_count] [base_path]
+"""
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from lru_cache.dict_map import DictMap
+from lru_cache.file_lru_cache import FileLRUCache
+from lru_cache.skiplist_map import SkipListMap
+
+LOGGER = logging.getLogger(__name__)
+
+FILE_COUNT = 1000000
+LEVELS = "1:2"
+
+
+class PerFileLoadCache(FileLRUCache):
+    """批量加载之前的加载方式：每个文件获取一次锁、调用一次 add_meta"""
+    def load(self):
+        count = 0
+        for file_path, name, size in \
+                self._walk(self._base_path, 1, len(self._levels)):
+            if not self.add_meta(name, size):
+                self.safe_remove_file(file_path)
+            count = count + 1
+            if count >= self._load_max_files:
+                yield self._load_interval
+                count = 0
+
+
+def make_tree(base_path, file_count):
+    # 标记文件放在缓存目录之外，否则会被 _walk 当作非法文件删除
+    marker = base_path.rstrip(os.sep) + ".count"
+    if os.path.isfile(marker):
+        with open(marker) as fd:
+            if int(fd.read()) == file_count:
+                return
+    LOGGER.info("creating %d files in %s", file_count, base_path)
+    start_time = time.time()
+    for i in xrange(file_count):
+        key = hashlib.md5(str(i)).hexdigest()
+        dir_part = os.path.join(base_path, key[-1], key[-3:-1])
+        if not os.path.isdir(dir_part):
+            os.makedirs(dir_part)
+        with open(os.path.join(dir_part, key), "wb") as fd:
+            fd.write("x")
+    LOGGER.info("%d files are created in %.3fs",
+                file_count, time.time() - start_time)
+    with open(marker, "wb") as fd:
+        fd.write(str(file_count))
+
+
+def benchmark(cache_class, index_class, base_path, file_count,
+              load_threads=1):
+    cache = cache_class(
+        base_path=base_path,
+        levels=LEVELS,
+        load_max_files=10000,
+        load_interval=0,
+        name="benchmark-%s" % cache_class.__name__,
+        # 低于高水位，加载之后不会被淘汰
+        max_entry_count=file_count * 2,
+        max_size=file_count * 2048,
+        min_uses=1,
+        max_inactive=3600,
+        lock_age=0.4,
+        wait_count=5,
+        expire_interval=3600,
+        forced_expire_interval=1,
+        index_class=index_class,
+        load_threads=load_threads)
+    start_time = time.time()
+    cache.start()
+    cache.wait_for_usable()
+    time_used = time.time() - start_time
+    try:
+        assert len(cache._map) == file_count
+        LOGGER.info("%-16s %-11s %d threads, time to usable: %.3fs "
+                    "(%.0f files/s)",
+                    cache_class.__name__, index_class.__name__,
+                    load_threads, time_used, file_count / time_used)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    file_count = FILE_COUNT
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        base_path = sys.argv[2]
+    else:
+        base_path = os.path.join(tempfile.gettempdir(),
+                                 "lru-cache-benchmark-load")
+    make_tree(base_path, file_count)
+
+    for cache_class in (FileLRUCache, PerFileLoadCache):
+        for index_class in (DictMap, SkipListMap):
+            benchmark(cache_class, index_class, base_path, file_count)
+    for load_threads in (2, 4, 8):
+        benchmark(FileLRUCache, DictMap, base_path, file_count, load_threads)
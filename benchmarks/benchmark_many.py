@@ -0,0 +1,120 @@
+# coding: utf8
+
+"""
+一次请求需要 fanout 个 key 时，比较逐个调用 deco 包装的函数与调用一次
+ProxyCache.open_many 的耗时：全部命中，以及全部未命中（后端按次计费，
+每次调用 COST 秒）两种情况。分别测量 MemoryLRUCache 和 FileLRUCache
+
+用法：python -m benchmarks.benchmark_many [request_count] [fanout]
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.abstract_lru_cache import ProxyCache
+from lru_cache.file_lru_cache import FileLRUCacheBuilder
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+REQUEST_COUNT = 20
+FANOUT = 500
+SHARD_COUNT = 4
+COST = 0.001
+
+
+def build_proxy(builder_class, base_path, key_count):
+    proxy = ProxyCache()
+    for i in range(SHARD_COUNT):
+        builder = builder_class() \
+            .with_name("benchmark-many-%d" % i) \
+            .with_max_entry_count(key_count * 2) \
+            .with_max_size(key_count * 1024)
+        if base_path is not None:
+            path = os.path.join(base_path, str(i))
+            os.makedirs(path)
+            builder.with_base_path(path)
+        cache = builder.build()
+        cache.start()
+        cache.wait_for_usable()
+        proxy.add_cache(cache)
+    proxy.set_key_func(lambda func, key: key)
+    proxy.set_call_func_when_failure(True)
+    proxy.set_serializer(TestSerializer())
+    return proxy
+
+
+def benchmark(builder_class, batched, request_count, fanout):
+    base_path = None
+    if builder_class is FileLRUCacheBuilder:
+        base_path = tempfile.mkdtemp(prefix="lru-cache-benchmark-many-")
+    key_count = request_count * fanout
+    proxy = build_proxy(builder_class, base_path, key_count)
+    calls = []
+
+    def func(key):
+        calls.append(1)
+        time.sleep(COST)
+        return key
+
+    def func_many(keys):
+        calls.append(len(keys))
+        time.sleep(COST)
+        return dict((key, key) for key in keys)
+
+    wrapped = proxy.deco(func)
+    requests = [[hashlib.md5("%d-%d" % (i, j)).hexdigest()
+                 for j in xrange(fanout)]
+                for i in xrange(request_count)]
+    try:
+        times = []
+        call_counts = []
+        # 第一轮全部未命中，第二轮全部命中
+        for _ in range(2):
+            del calls[:]
+            start_time = time.time()
+            for keys in requests:
+                if batched:
+                    proxy.open_many(keys, func_many)
+                else:
+                    for key in keys:
+                        wrapped(key)
+            times.append((time.time() - start_time) / request_count)
+            call_counts.append(float(len(calls)) / request_count)
+        LOGGER.info("%-21s %-9s fanout %d, miss: %.2fms per request "
+                    "(%.0f backend calls), hit: %.2fms per request",
+                    builder_class.__name__,
+                    "open_many" if batched else "deco",
+                    fanout,
+                    times[0] * 1e3,
+                    call_counts[0],
+                    times[1] * 1e3)
+    finally:
+        for cache in proxy.caches:
+            cache.stop()
+        if base_path is not None:
+            shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    request_count = REQUEST_COUNT
+    fanout = FANOUT
+    if len(sys.argv) > 1:
+        request_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        fanout = int(sys.argv[2])
+
+    for builder_class in (MemoryLRUCacheBuilder, FileLRUCacheBuilder):
+        for batched in (False, True):
+            benchmark(builder_class, batched, request_count, fanout)
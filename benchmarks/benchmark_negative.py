@@ -0,0 +1,105 @@
+# coding: utf8
+
+"""
+后端持续失败（每次调用 COST 秒之后抛出异常）时，比较不缓存失败、
+以及缓存失败并且指数退避时，后端被调用的次数和调用者拿到失败的延迟
+
+用法：python -m benchmarks.benchmark_negative [key_count] [duration] [thread_count]
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_COUNT = 100
+DURATION = 3
+THREAD_COUNT = 8
+COST = 0.01
+# (negative_ttl, negative_max_ttl)，第一组不缓存失败
+NEGATIVE_TTLS = ((None, None), (0.1, 1))
+
+
+class BackendError(Exception):
+    pass
+
+
+def benchmark(negative_ttls, key_count, duration, thread_count):
+    builder = MemoryLRUCacheBuilder() \
+        .with_name("benchmark-negative") \
+        .with_max_entry_count(key_count * 2) \
+        .with_max_size(key_count * 1024)
+    if negative_ttls[0] is not None:
+        builder.with_negative_cache(*negative_ttls)
+    cache = builder.build()
+    cache.start()
+    cache.wait_for_usable()
+    calls = [0]
+
+    def func(key):
+        calls[0] = calls[0] + 1
+        time.sleep(COST)
+        raise BackendError(key)
+
+    latencies = []
+    deadline = time.time() + duration
+
+    def target(seed):
+        rand = random.Random(seed)
+        serializer = TestSerializer()
+        times = []
+        while time.time() < deadline:
+            key = "key-%d" % rand.randint(0, key_count - 1)
+            start_time = time.time()
+            try:
+                cache.open(key, serializer, True, func, key)
+            except BackendError:
+                pass
+            times.append(time.time() - start_time)
+        latencies.extend(times)
+
+    try:
+        threads = [threading.Thread(target=target, args=(i, ))
+                   for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        LOGGER.info(
+            "negative ttl: %-9s requests: %d, backend calls: %d "
+            "(%.0f/s), p50: %.1fus, p99: %.1fus",
+            "%s/%s" % negative_ttls,
+            len(latencies),
+            calls[0],
+            calls[0] / duration,
+            latencies[len(latencies) // 2] * 1e6,
+            latencies[int(len(latencies) * 0.99)] * 1e6)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    key_count = KEY_COUNT
+    duration = DURATION
+    thread_count = THREAD_COUNT
+    if len(sys.argv) > 1:
+        key_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        duration = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        thread_count = int(sys.argv[3])
+
+    for negative_ttls in NEGATIVE_TTLS:
+        benchmark(negative_ttls, key_count, duration, thread_count)
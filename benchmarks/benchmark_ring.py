@@ -0,0 +1,125 @@
+# coding: utf8
+
+"""
+ProxyCache 从 shard_count 个分片增加到 shard_count + 1 个分片时，
+比较取模路由与一致性散列改变归属的 key 的比例；以及增加分片之后，
+一致性散列在惰性迁移与不迁移（冷启动）时的回源次数
+
+用法：python -m benchmarks.benchmark_ring [key_count] [shard_count]
+"""
+
+import hashlib
+import logging
+import sys
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.abstract_lru_cache import ProxyCache
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_COUNT = 20000
+SHARD_COUNT = 4
+
+
+class ModuloProxyCache(ProxyCache):
+    """对分片数取模的路由方式"""
+    def _select_cache(self, func, *args, **kwargs):
+        key = self._key_func(func, *args, **kwargs)
+        index = int(hashlib.md5(key).hexdigest(), 16) % len(self._caches)
+        return key, self._caches[index], func
+
+
+def build_cache(name, key_count):
+    cache = MemoryLRUCacheBuilder() \
+        .with_name(name) \
+        .with_max_entry_count(key_count * 2) \
+        .with_max_size(key_count * 1024) \
+        .build()
+    cache.start()
+    cache.wait_for_usable()
+    return cache
+
+
+def build_proxy(proxy_class, shard_count, key_count):
+    proxy = proxy_class()
+    for i in range(shard_count):
+        proxy.add_cache(build_cache("benchmark-ring-%d" % i, key_count))
+    proxy.set_key_func(lambda func, key: key)
+    proxy.set_call_func_when_failure(True)
+    proxy.set_serializer(TestSerializer())
+    return proxy
+
+
+def benchmark_moved(proxy_class, key_count, shard_count):
+    proxy = build_proxy(proxy_class, shard_count, key_count)
+    try:
+        keys = ["key-%d" % i for i in xrange(key_count)]
+
+        def func(key):
+            return key
+
+        owners = [proxy._select_cache(func, key)[1] for key in keys]
+        start_time = time.time()
+        proxy.add_cache(build_cache("benchmark-ring-new", key_count))
+        time_used = time.time() - start_time
+        moved = sum(1 for key, owner in zip(keys, owners)
+                    if proxy._select_cache(func, key)[1] is not owner)
+        LOGGER.info("%-16s %d -> %d shards, moved keys: %.1f%% "
+                    "(ideal %.1f%%), add_cache: %.1fms",
+                    proxy_class.__name__,
+                    shard_count,
+                    shard_count + 1,
+                    moved * 100.0 / key_count,
+                    100.0 / (shard_count + 1),
+                    time_used * 1e3)
+    finally:
+        for cache in proxy.caches:
+            cache.stop()
+
+
+def benchmark_migration(migrate, key_count, shard_count):
+    proxy = build_proxy(ProxyCache, shard_count, key_count)
+    calls = []
+    try:
+        def func(key):
+            calls.append(key)
+            return key
+
+        wrapped = proxy.deco(func)
+        keys = ["key-%d" % i for i in xrange(key_count)]
+        for key in keys:
+            wrapped(key)
+        del calls[:]
+        proxy.add_cache(build_cache("benchmark-ring-new", key_count))
+        if not migrate:
+            proxy.finish_migration()
+        for key in keys:
+            wrapped(key)
+        LOGGER.info("%-9s backend calls after adding a shard: %d of %d keys",
+                    "migrate" if migrate else "cold",
+                    len(calls),
+                    key_count)
+    finally:
+        for cache in proxy.caches:
+            cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    key_count = KEY_COUNT
+    shard_count = SHARD_COUNT
+    if len(sys.argv) > 1:
+        key_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        shard_count = int(sys.argv[2])
+
+    for proxy_class in (ModuloProxyCache, ProxyCache):
+        benchmark_moved(proxy_class, key_count, shard_count)
+    for migrate in (False, True):
+        benchmark_migration(migrate, key_count, shard_count)
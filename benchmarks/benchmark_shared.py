@@ -0,0 +1,140 @@
+# coding: utf8
+
+"""
+process_count 个 fork 出来的工作进程使用同一个缓存目录。比较每个进程各自加载、
+各自计算容量，与使用共享索引时：每个进程的启动时间、后端调用的次数，
+以及结束时缓存目录实际占用的空间与容量限制的比例
+
+用法：python -m benchmarks.benchmark_shared [process_count] [request_count] [key_count]
+"""
+
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.file_lru_cache import FileLRUCache, FileLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+PROCESS_COUNT = 8
+REQUEST_COUNT = 2000
+KEY_COUNT = 8000
+PRELOAD_COUNT = 2000
+VALUE_SIZE = 1024
+MAX_SIZE = 4 * 1024 * 1024
+
+
+def key_of(index):
+    return "%032x" % index
+
+
+def build_cache(base_path, shared):
+    builder = FileLRUCacheBuilder() \
+        .with_name("benchmark-shared-%d" % os.getpid()) \
+        .with_base_path(base_path) \
+        .with_max_entry_count(KEY_COUNT) \
+        .with_max_size(MAX_SIZE) \
+        .with_expire_interval(0.1)
+    if shared:
+        builder.with_shared_index()
+    return builder.build()
+
+
+def worker(base_path, shared, request_count, key_count, seed, write_fd):
+    start_time = time.time()
+    cache = build_cache(base_path, shared)
+    cache.start()
+    cache.wait_for_usable()
+    load_time = time.time() - start_time
+    calls = []
+
+    def func(key):
+        calls.append(key)
+        return "x" * VALUE_SIZE
+
+    rand = random.Random(seed)
+    serializer = TestSerializer()
+    for _ in xrange(request_count):
+        key = key_of(rand.randint(0, key_count - 1))
+        cache.open(key, serializer, True, func, key)
+    # 给管理进程一个淘汰周期
+    time.sleep(0.5)
+    cache.stop()
+    os.write(write_fd, "%f %d\n" % (load_time, len(calls)))
+
+
+def disk_usage(base_path):
+    total = 0
+    for directory, _, names in os.walk(base_path):
+        for name in names:
+            if name.startswith(FileLRUCache.SHARED_INDEX_NAME):
+                continue
+            total = total + os.path.getsize(os.path.join(directory, name))
+    return total
+
+
+def benchmark(shared, process_count, request_count, key_count):
+    base_path = tempfile.mkdtemp(prefix="lru-cache-benchmark-shared-")
+    try:
+        cache = build_cache(base_path, False)
+        cache.start()
+        cache.wait_for_usable()
+        for index in xrange(PRELOAD_COUNT):
+            cache.write_cache(key_of(index), "x" * VALUE_SIZE)
+        cache.stop()
+
+        read_fd, write_fd = os.pipe()
+        pids = []
+        for index in range(process_count):
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    os.close(read_fd)
+                    worker(base_path, shared, request_count,
+                           key_count, index, write_fd)
+                    code = 0
+                finally:
+                    os._exit(code)
+            pids.append(pid)
+        os.close(write_fd)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as fd:
+            results = [map(float, line.split()) for line in fd]
+        load_times = [load_time for load_time, _ in results]
+        LOGGER.info(
+            "%-9s %d processes, load: %.1fms avg, backend calls: %d, "
+            "disk usage: %.0f%% of max_size",
+            "shared" if shared else "separate",
+            process_count,
+            sum(load_times) / len(load_times) * 1e3,
+            sum(calls for _, calls in results),
+            disk_usage(base_path) * 100.0 / MAX_SIZE)
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    process_count = PROCESS_COUNT
+    request_count = REQUEST_COUNT
+    key_count = KEY_COUNT
+    if len(sys.argv) > 1:
+        process_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        request_count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        key_count = int(sys.argv[3])
+
+    for shared in (False, True):
+        benchmark(shared, process_count, request_count, key_count)
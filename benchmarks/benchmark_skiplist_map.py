@@ -0,0 +1,237 @@
+# coding: utf8
+
+"""
+比较 SkipListMap 与改写之前的实现（LegacySkipListMap）的内存占用和吞吐量
+
+用法：python -m benchmarks.benchmark_skiplist_map [element_count]
+
+注意：旧实现插入时从新节点所在的层开始查找，插入的代价是 O(n)，
+所以 element_count 不宜过大
+"""
+
+import logging
+import random
+import sys
+import time
+
+from lru_cache.skiplist_map import SkipListMap
+
+LOGGER = logging.getLogger(__name__)
+
+ELEMENT_COUNT = 10000
+
+
+class LegacyNode(object):
+    def __init__(self, key=None, next=None, down=None):
+        self._key = key
+        self._next = next
+        self._down = down
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def next(self):
+        return self._next
+
+    @next.setter
+    def next(self, next):
+        self._next = next
+
+    @property
+    def down(self):
+        return self._down
+
+    @down.setter
+    def down(self, down):
+        self._down = down
+
+
+class LegacyDataNode(object):
+    def __init__(self, key=None, value=None, next=None):
+        self._key = key
+        self._value = value
+        self._next = next
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    @property
+    def next(self):
+        return self._next
+
+    @next.setter
+    def next(self, next):
+        self._next = next
+
+
+class LegacySkipListMap(object):
+    """改写之前的 SkipListMap"""
+    def __init__(self):
+        self._heads = [LegacyDataNode()]
+        self._size = 0
+
+    def __setitem__(self, key, value):
+        k = 0
+        for level in range(1, len(self._heads)+1):
+            if random.random() < 0.75:
+                break
+            k = level
+        else:
+            if len(self._heads) == 32:
+                k = len(self._heads) - 1
+            else:
+                self._heads.append(
+                    LegacyNode(down=self._heads[k-1]))
+
+        node = self._heads[k]
+        prev_new_node = None
+        while True:
+            while node.next is not None and node.next.key < key:
+                node = node.next
+            if node.next is None or node.next.key > key:
+                is_zero_level = isinstance(node, LegacyDataNode)
+                if is_zero_level:
+                    new_node = LegacyDataNode(key, value)
+                else:
+                    new_node = LegacyNode(key)
+                new_node.next = node.next
+                node.next = new_node
+                if prev_new_node is not None:
+                    prev_new_node.down = new_node
+                prev_new_node = new_node
+                if is_zero_level:
+                    self._size = self._size + 1
+                    break
+                node = node.down
+            else:
+                node = node.next
+                if prev_new_node is not None:
+                    prev_new_node.down = node
+                while not isinstance(node, LegacyDataNode):
+                    node = node.down
+                node.value = value
+                break
+
+    def __getitem__(self, key):
+        node = self._heads[-1]
+        while True:
+            while node.next is not None and node.next.key < key:
+                node = node.next
+            if node.next is None or node.next.key > key:
+                if isinstance(node, LegacyDataNode):
+                    break
+                node = node.down
+                continue
+            node = node.next
+            while not isinstance(node, LegacyDataNode):
+                node = node.down
+            return node.value
+        raise KeyError(key)
+
+    def __delitem__(self, key):
+        exists = False
+        node = self._heads[-1]
+        while True:
+            while node.next is not None and node.next.key < key:
+                node = node.next
+            if node.next is not None and node.next.key == key:
+                exists = True
+                node.next = node.next.next
+            if isinstance(node, LegacyDataNode):
+                break
+            node = node.down
+        if exists:
+            self._size = self._size - 1
+            while len(self._heads) > 1:
+                if self._heads[-1].next is not None:
+                    break
+                self._heads.pop(-1)
+        else:
+            raise KeyError(key)
+
+    def __len__(self):
+        return self._size
+
+
+def legacy_memory(map_obj):
+    total = 0
+    for head in map_obj._heads:
+        node = head
+        while node is not None:
+            total = total + sys.getsizeof(node) + \
+                sys.getsizeof(node.__dict__)
+            node = node.next
+    return total
+
+
+def memory(map_obj):
+    total = 0
+    node = map_obj.head
+    while node is not None:
+        total = total + sys.getsizeof(node) + \
+            sys.getsizeof(node.nexts)
+        node = node.nexts[0]
+    return total
+
+
+def ops_per_second(func, keys):
+    start_time = time.time()
+    for key in keys:
+        func(key)
+    return len(keys) / (time.time() - start_time)
+
+
+def benchmark(name, map_obj, memory_func, element_count):
+    keys = ["key-%08d" % i for i in range(element_count)]
+    shuffled_keys = list(keys)
+    random.shuffle(shuffled_keys)
+
+    def set_item(key):
+        map_obj[key] = key
+
+    def get_item(key):
+        return map_obj[key]
+
+    def del_item(key):
+        del map_obj[key]
+
+    insert_rate = ops_per_second(set_item, shuffled_keys)
+    get_rate = ops_per_second(get_item, shuffled_keys)
+    bytes_per_key = float(memory_func(map_obj)) / element_count
+    delete_rate = ops_per_second(del_item, shuffled_keys)
+    sequential_insert_rate = ops_per_second(set_item, keys)
+    sequential_delete_rate = ops_per_second(del_item, keys)
+    LOGGER.info(
+        "%-18s %d keys, %.1f bytes/key, "
+        "random insert %.0f/s, get %.0f/s, delete %.0f/s, "
+        "sequential insert %.0f/s, delete %.0f/s",
+        name, element_count, bytes_per_key,
+        insert_rate, get_rate, delete_rate,
+        sequential_insert_rate, sequential_delete_rate)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    element_count = ELEMENT_COUNT
+    if len(sys.argv) > 1:
+        element_count = int(sys.argv[1])
+
+    benchmark("SkipListMap", SkipListMap(element_count),
+              memory, element_count)
+    benchmark("LegacySkipListMap", LegacySkipListMap(),
+              legacy_memory, element_count)
@@ -0,0 +1,105 @@
+# coding: utf8
+
+"""
+热点 key 设置了绝对过期时间，回源计算需要 COST 秒。比较只有 ttl、
+ttl 加上 stale-while-revalidate 窗口，以及提前刷新时，访问延迟和回源次数
+
+用法：python -m benchmarks.benchmark_ttl [key_count] [duration] [thread_count]
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_COUNT = 20
+DURATION = 5
+THREAD_COUNT = 4
+TTL = 0.5
+COST = 0.05
+# (stale-while-revalidate 窗口, 提前刷新的秒数)
+MODES = ((0, None), (1, None), (0, 0.25))
+
+
+def benchmark(mode, key_count, duration, thread_count):
+    window, refresh_ahead = mode
+    cache = MemoryLRUCacheBuilder() \
+        .with_name("benchmark-ttl") \
+        .with_max_entry_count(key_count * 2) \
+        .with_max_size(key_count * 1024) \
+        .with_ttl(TTL, window) \
+        .with_refreshers(4) \
+        .with_refresh_ahead(refresh_ahead) \
+        .build()
+    cache.start()
+    cache.wait_for_usable()
+    calls = [0]
+
+    def func(key):
+        calls[0] = calls[0] + 1
+        time.sleep(COST)
+        return key
+
+    latencies = []
+    deadline = time.time() + duration
+
+    def target(seed):
+        rand = random.Random(seed)
+        serializer = TestSerializer()
+        times = []
+        while time.time() < deadline:
+            key = "key-%d" % rand.randint(0, key_count - 1)
+            start_time = time.time()
+            cache.open(key, serializer, True, func, key)
+            times.append(time.time() - start_time)
+            time.sleep(0.001)
+        latencies.extend(times)
+
+    try:
+        threads = [threading.Thread(target=target, args=(i, ))
+                   for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        LOGGER.info(
+            "stale-while-revalidate: %ss, refresh ahead: %-4s "
+            "accesses: %d, backend calls: %d, "
+            "p99: %.1fus, max: %.1fus, accesses over %.0fms: %d",
+            window,
+            refresh_ahead,
+            len(latencies),
+            calls[0],
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+            latencies[-1] * 1e6,
+            COST * 1e3,
+            sum(1 for latency in latencies if latency >= COST))
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    key_count = KEY_COUNT
+    duration = DURATION
+    thread_count = THREAD_COUNT
+    if len(sys.argv) > 1:
+        key_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        duration = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        thread_count = int(sys.argv[3])
+
+    for mode in MODES:
+        benchmark(mode, key_count, duration, thread_count)
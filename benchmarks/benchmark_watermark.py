@@ -0,0 +1,98 @@
+# coding: utf8
+
+"""
+在大部分访问都不命中的负载下，比较请求线程自己执行强制淘汰的次数、
+吞吐量和延迟。高、低水位都是 1 时管理线程只在超过容量之后才淘汰，
+和使用水位之前的行为相同
+
+用法：python -m benchmarks.benchmark_watermark [entry_count] [access_count] [thread_count]
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+
+from benchmarks.benchmark_index import TestSerializer
+from lru_cache.memory_lru_cache import MemoryLRUCacheBuilder
+
+LOGGER = logging.getLogger(__name__)
+
+ENTRY_COUNT = 10000
+ACCESS_COUNT = 200000
+THREAD_COUNT = 8
+WATERMARKS = ((1, 1), (0.95, 0.9))
+
+
+def benchmark(watermarks, entry_count, access_count, thread_count):
+    cache = MemoryLRUCacheBuilder() \
+        .with_name("benchmark-watermark") \
+        .with_max_entry_count(entry_count) \
+        .with_max_size(entry_count * 4) \
+        .with_watermarks(*watermarks) \
+        .build()
+    forced_expire = cache._forced_expire
+    forced_count = [0]
+
+    def counted_forced_expire(*args):
+        forced_count[0] = forced_count[0] + 1
+        return forced_expire(*args)
+
+    cache._forced_expire = counted_forced_expire
+    cache.start()
+    cache.wait_for_usable()
+    latencies = []
+
+    def target(seed):
+        rand = random.Random(seed)
+        serializer = TestSerializer()
+        key_count = entry_count * 10
+        times = []
+        for _ in xrange(access_count // thread_count):
+            key = "key-%d" % rand.randint(0, key_count)
+            start_time = time.time()
+            cache.open(key, serializer, True, lambda: key)
+            times.append(time.time() - start_time)
+        latencies.extend(times)
+
+    try:
+        threads = [threading.Thread(target=target, args=(i, ))
+                   for i in range(thread_count)]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time_used = time.time() - start_time
+        latencies.sort()
+        LOGGER.info(
+            "watermarks: %-11s forced expires on request threads: %d, "
+            "throughput: %.0fr/s, p99: %.1fus, max: %.1fus",
+            "%s/%s" % watermarks,
+            forced_count[0],
+            len(latencies) / time_used,
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+            latencies[-1] * 1e6)
+    finally:
+        cache.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    entry_count = ENTRY_COUNT
+    access_count = ACCESS_COUNT
+    thread_count = THREAD_COUNT
+    if len(sys.argv) > 1:
+        entry_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        access_count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        thread_count = int(sys.argv[3])
+
+    for watermarks in WATERMARKS:
+        benchmark(watermarks, entry_count, access_count, thread_count)
@@ -100,6 +100,8 @@ class AbstractCache(object):
         self._status = CacheStatus()
         self._manager_thread = None
         self._condition = threading.Condition()
+        # 管理线程没有在等待时收到的唤醒请求，避免丢失
+        self._manager_wakeup = False
 
     @property
     def name(self):
@@ -157,8 +159,7 @@ class AbstractCache(object):
                     LOGGER.info("manager thread of " + 
                                 "%s exit" % self.name)
                     return False
-                with self._condition:
-                    self._condition.wait(wait_time)
+                self._manager_wait(wait_time)
         except:
             LOGGER.error(
                 "%s failed to load cache",
@@ -171,6 +172,17 @@ class AbstractCache(object):
         self._status.transfer_to_loaded()
         return True
 
+    def _manager_wait(self, wait_time):
+        with self._condition:
+            if not self._manager_wakeup:
+                self._condition.wait(wait_time)
+            self._manager_wakeup = False
+
+    def _wakeup_manager(self):
+        with self._condition:
+            self._manager_wakeup = True
+            self._condition.notify()
+
     @abc.abstractmethod
     def load(self):
         pass
@@ -195,8 +207,7 @@ class AbstractCache(object):
                     LOGGER.info("manager thread of " + 
                                 "%s exit" % self.name)
                     return
-                with self._condition:
-                    self._condition.wait(wait_time)
+                self._manager_wait(wait_time)
         except:
             LOGGER.error(
                 "%s failed to manage cache",
@@ -217,8 +228,7 @@ class AbstractCache(object):
         LOGGER.debug("begin to stop manager thread of %s",
                      self.name)
         if self._manager_thread is not None:
-            with self._condition:
-                self._condition.notify()
+            self._wakeup_manager()
             self._manager_thread.join(timeout)
             if self._manager_thread.isAlive():
                 LOGGER.error(
@@ -230,9 +240,13 @@ class AbstractCache(object):
                     self.name)
                 self._manager_thread = None
 
+        self._before_finalize()
         self.finalize()
         LOGGER.info("%s is stopped", self.name)
 
+    def _before_finalize(self):
+        pass
+
     @abc.abstractmethod
     def finalize(self):
         pass
@@ -5,17 +5,55 @@ import abc
 import threading
 import time
 import sys
-import hashlib
+import zlib
+import bisect
 import functools
+import heapq
+import itertools
+from collections import deque
 
 from .abstract_cache import AbstractCache
-from .skiplist_map import SkipListMap
-from .linked_queue import LinkedQueue
+from .dict_map import DictMap
+from .eviction_policy import LRUPolicy
+from .frequency_sketch import FrequencySketch
 from .entry import Entry
+from .worker_pool import WorkerPool
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _unique(keys):
+    """去掉重复的 key，保留第一次出现的顺序"""
+    seen = set()
+    result = []
+    for key in keys:
+        if key not in seen:
+            seen.add(key)
+            result.append(key)
+    return result
+
+
+def _call_one(func_many, key):
+    """用批量计算的函数计算一个 key"""
+    return func_many([key])[key]
+
+
+def _call_func_many(func_many, keys):
+    """
+    调用一次 func_many，返回 (key 到结果的 dict, exc_info, 平均每个 key 的耗时)
+    """
+    if not keys:
+        return {}, None, None
+    values = {}
+    exc_info = None
+    start_time = time.time()
+    try:
+        values = func_many(keys)
+    except:
+        exc_info = sys.exc_info()
+    return values, exc_info, (time.time() - start_time) / len(keys)
+
+
 class Serializer(object):
     __metaclass__ = abc.ABCMeta
 
@@ -29,18 +67,93 @@ class Serializer(object):
 
 
 class ProxyCache(object):
+    """
+    用一致性散列把 key 分配到各个 LRU Cache。每个 Cache 在环上有
+    VIRTUAL_NODE_COUNT 个虚拟节点；环被预先展开成一张路由表，
+    key 的 crc32 的高 16 位是路由表的下标。增加、删除 Cache 时只有
+    大约 1/N 的 key 改变归属，它们在新的 Cache 中未命中时，
+    先从上一张路由表中的 Cache 读取并迁移过来，而不是重新计算
+    """
+    VIRTUAL_NODE_COUNT = 160
+    ROUTE_TABLE_BITS = 16
+
     def __init__(self):
         self._caches = []
+        # (路由表, 上一张路由表)，整体替换，查找时不需要加锁
+        self._routes = ([], None)
+        # finish_migration 之前在路由表中出现过、现在不再在其中的 Cache，
+        # 清除缓存时也要清除它们，否则旧的结果会被迁移回来
+        self._previous_caches = []
+        # 增加、删除 Cache 时重建路由表
+        self._routes_lock = threading.Lock()
         self._key_func = None
         self._call_func_when_failure = None
         self._serializer = None
+        self._executor = None
 
     @property
     def caches(self):
         return self._caches
 
     def add_cache(self, cache):
-        self._caches.append(cache)
+        """
+        可以在运行时调用。改变归属的 key 从原来的 Cache 中惰性迁移
+        """
+        with self._routes_lock:
+            self._caches.append(cache)
+            self._rebuild_routes()
+
+    def remove_cache(self, cache):
+        """
+        可以在运行时调用。被删除的 Cache 在 finish_migration 之前
+        仍然为迁移提供读取，之后才可以停止它
+        """
+        with self._routes_lock:
+            self._caches.remove(cache)
+            self._rebuild_routes()
+
+    def finish_migration(self):
+        """
+        不再从上一张路由表中的 Cache 迁移数据
+        """
+        with self._routes_lock:
+            self._routes = (self._routes[0], None)
+            self._previous_caches = []
+
+    def _rebuild_routes(self):
+        """
+        调用时必须持有 _routes_lock
+        """
+        table = self._build_route_table(self._caches)
+        previous = self._routes[0] or None
+        previous_caches = [cache for cache in self._previous_caches
+                           if cache not in self._caches]
+        if previous is not None:
+            for cache in set(previous):
+                if cache not in self._caches and \
+                        cache not in previous_caches:
+                    previous_caches.append(cache)
+        self._previous_caches = previous_caches
+        self._routes = (table, previous)
+
+    @classmethod
+    def _build_route_table(cls, caches):
+        if not caches:
+            return []
+        points = []
+        for cache in caches:
+            for i in xrange(cls.VIRTUAL_NODE_COUNT):
+                point = zlib.crc32("%s#%d" % (cache.name, i)) & 0xffffffff
+                points.append((point, cache))
+        points.sort(key=lambda item: item[0])
+        hashes = [point for point, _ in points]
+        # 下标为 i 的表项属于环上第一个不小于 i << shift 的虚拟节点
+        shift = 32 - cls.ROUTE_TABLE_BITS
+        table = []
+        for i in xrange(1 << cls.ROUTE_TABLE_BITS):
+            index = bisect.bisect_left(hashes, i << shift)
+            table.append(points[index % len(points)][1])
+        return table
 
     def set_key_func(self, key_func):
         assert callable(key_func)
@@ -53,34 +166,251 @@ class ProxyCache(object):
         assert isinstance(serializer, Serializer)
         self._serializer = serializer
 
-    def deco(self, func):
+    def set_executor(self, executor):
+        """deco_future 使用的 future.Executor"""
+        self._executor = executor
+
+    def purge_prefix(self, prefix):
+        """
+        清除所有以 prefix 开头的缓存，返回被标记为删除的条目数
+        """
+        if isinstance(prefix, unicode):
+            prefix = prefix.encode()
+        with self._routes_lock:
+            caches = self._caches + self._previous_caches
+        count = 0
+        for cache in caches:
+            count = count + cache.purge_prefix(prefix)
+        return count
+
+    def purge(self, key):
+        """
+        清除 key 的缓存。迁移结束之前，同时清除上一张路由表中的 Cache，
+        返回 key 现在所属的 Cache 的返回码
+        """
+        key, hash_key = self._normalize_key(key)
+        table, previous = self._routes
+        if not table:
+            raise RuntimeError("empty cache")
+        index = self._route_index(hash_key)
+        rc = table[index].purge(key)
+        if previous is not None and previous[index] is not table[index]:
+            previous_rc = previous[index].purge(key)
+            if rc & ReturnCode.ERROR_KEY_NOT_EXISTS:
+                rc = previous_rc
+        return rc
+
+    def _check(self, need_key_func=True):
         if len(self._caches) == 0:
             raise RuntimeError("empty cache")
-        if self._key_func is None:
+        if need_key_func and self._key_func is None:
             raise RuntimeError("missing key_func")
         if self._call_func_when_failure is None:
             raise RuntimeError("missing call_func_when_failure")
         if self._serializer is None:
             raise RuntimeError("missing serializer")
 
+    def _select_cache(self, func, *args, **kwargs):
+        """
+        返回 (key, cache, loader)。key 的归属刚刚改变时，
+        loader 先从原来的 Cache 迁移数据，否则 loader 就是 func
+        """
+        key = self._key_func(func, *args, **kwargs)
+        if type(key) is str:
+            return self._route(key, key, func)
+        key, hash_key = self._normalize_key(key)
+        return self._route(key, hash_key, func)
+
+    @staticmethod
+    def _normalize_key(key):
+        """
+        返回 (key, 用来路由的字符串)
+        """
+        if isinstance(key, unicode):
+            key = key.encode()
+        elif isinstance(key, (int, long)):
+            return key, str(key)
+        elif not isinstance(key, str):
+            raise TypeError("str or int expected")
+        return key, key
+
+    def _route(self, key, hash_key, func):
+        table, previous = self._routes
+        index = self._route_index(hash_key)
+        cache = table[index]
+        if previous is None or previous[index] is cache:
+            return key, cache, func
+        return key, cache, self._migrating_loader(key, previous[index], func)
+
+    @classmethod
+    def _route_index(cls, hash_key):
+        # crc32 是 C 实现的非加密散列，只用来路由，不需要 md5
+        return (zlib.crc32(hash_key) >> (32 - cls.ROUTE_TABLE_BITS)) & \
+            ((1 << cls.ROUTE_TABLE_BITS) - 1)
+
+    def _migrating_loader(self, key, previous_cache, func):
+        serializer = self._serializer
+
+        def _load(*args, **kwargs):
+            try:
+                value = previous_cache.get(key, serializer)
+            except KeyError:
+                return func(*args, **kwargs)
+            # 已经迁移到新的 Cache，释放原来的 Cache 的空间
+            previous_cache.purge(key)
+            return value
+        return _load
+
+    def _group(self, keys):
+        """
+        按分片对 key 分组，返回 [(cache, previous_cache, keys)]。
+        previous_cache 是这组 key 在上一张路由表中的 Cache，没有改变归属时为 None
+        """
+        table, previous = self._routes
+        shift = 32 - self.ROUTE_TABLE_BITS
+        mask = (1 << self.ROUTE_TABLE_BITS) - 1
+        groups = {}
+        result = []
+        for key in keys:
+            key, hash_key = self._normalize_key(key)
+            index = (zlib.crc32(hash_key) >> shift) & mask
+            cache = table[index]
+            previous_cache = None
+            if previous is not None and previous[index] is not cache:
+                previous_cache = previous[index]
+            group = groups.get((cache, previous_cache))
+            if group is None:
+                group = []
+                groups[(cache, previous_cache)] = group
+                result.append((cache, previous_cache, group))
+            group.append(key)
+        return result
+
+    def get_many(self, keys):
+        """
+        读取一批 key 已经缓存的结果，不回源计算。每个分片只获取两次锁，
+        调用一次 read_cache_many。返回 key 到结果的 dict，没有缓存的 key 不在其中
+        """
+        self._check(False)
+        results = {}
+        for cache, previous_cache, group in self._group(keys):
+            found = cache.get_many(group, self._serializer)
+            results.update(found)
+            if previous_cache is not None and len(found) < len(group):
+                # 还没有迁移的 key 由原来的 Cache 提供读取
+                results.update(previous_cache.get_many(
+                    [key for key in group if key not in found],
+                    self._serializer))
+        return results
+
+    def put_many(self, items):
+        """
+        直接缓存一批结果，items 是 (key, 结果) 的序列。每个分片只获取两次锁，
+        调用一次 write_cache_many。返回写入的 key 的列表
+        """
+        self._check(False)
+        values = {}
+        for key, value in items:
+            values[self._normalize_key(key)[0]] = value
+        written = []
+        for cache, previous_cache, group in self._group(values):
+            written.extend(cache.put_many(
+                [(key, values[key]) for key in group], self._serializer))
+            if previous_cache is not None:
+                # 原来的 Cache 中的旧结果不能再被迁移过来
+                for key in group:
+                    previous_cache.purge(key)
+        return written
+
+    def open_many(self, keys, func_many):
+        """
+        批量版本的 deco：func_many(keys) 返回 key 到结果的 dict。
+        每个分片只获取一次锁查找整批 key，命中的缓存数据用一次 read_cache_many
+        读取；所有分片中需要计算的 key 只调用一次 func_many，结果按分片用一次
+        write_cache_many 写入。改变了归属的 key 先从原来的 Cache 迁移。
+        返回 key 到结果的 dict，计算失败的 key 不在其中
+        """
+        self._check(False)
+        serializer = self._serializer
+        batches = []
+        try:
+            for cache, previous_cache, group in self._group(keys):
+                batches.append((
+                    cache, previous_cache,
+                    cache.begin_many(group, serializer,
+                                     self._call_func_when_failure,
+                                     func_many)))
+        except:
+            exc_info = sys.exc_info()
+            for cache, _, batch in batches:
+                cache.abort_many(batch)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        values = {}
+        missing = []
+        for cache, previous_cache, batch in batches:
+            keys = batch.missing()
+            if previous_cache is not None and keys:
+                migrated = previous_cache.get_many(keys, serializer)
+                for key in migrated:
+                    previous_cache.purge(key)
+                values.update(migrated)
+                keys = [key for key in keys if key not in migrated]
+            missing.extend(keys)
+        computed, exc_info, cost = _call_func_many(func_many, missing)
+        values.update(computed)
+
+        results = {}
+        for cache, _, batch in batches:
+            write_exc_info = cache.end_many(batch, values, exc_info,
+                                            cost, func_many)
+            if exc_info is None:
+                exc_info = write_exc_info
+            results.update(batch.results)
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        func = functools.partial(_call_one, func_many)
+        for cache, previous_cache, batch in batches:
+            if previous_cache is None:
+                cache.open_waiting(batch, func)
+            else:
+                cache.open_waiting(
+                    batch,
+                    lambda key, previous_cache=previous_cache:
+                        self._migrating_loader(key, previous_cache,
+                                               func)(key))
+            results.update(batch.results)
+        return results
+
+    def deco(self, func):
+        self._check()
+
         @functools.wraps(func)
         def _inner(*args, **kwargs):
-            key = self._key_func(func, *args, **kwargs)
-            if isinstance(key, unicode):
-                key = key.encode()
-            if isinstance(key, str):
-                key_md5 = hashlib.md5(key).hexdigest()
-                index = int(key_md5, 16) % len(self._caches)
-            elif isinstance(key, (int, long)):
-                index = key % len(self._caches)
-            else:
-                raise TypeError("str or int expected")
-            cache = self._caches[index]
+            key, cache, loader = self._select_cache(func, *args, **kwargs)
             return cache.open(key, self._serializer,
-                              self._call_func_when_failure, func,
+                              self._call_func_when_failure, loader,
                               *args, **kwargs)
         return _inner
 
+    def deco_future(self, func):
+        """
+        deco 的非阻塞版本：被包装的函数立即返回 future.Future，
+        读取、写入缓存和回源计算都在 executor 中执行
+        """
+        self._check()
+        if self._executor is None:
+            raise RuntimeError("missing executor")
+
+        @functools.wraps(func)
+        def _inner(*args, **kwargs):
+            key, cache, loader = self._select_cache(func, *args, **kwargs)
+            return cache.open_future(self._executor, key, self._serializer,
+                                     self._call_func_when_failure, loader,
+                                     *args, **kwargs)
+        return _inner
+
 
 class ReturnCode(object):
     ERROR_ENTRY_UNUSABLE     = 0b1
@@ -91,6 +421,32 @@ class ReturnCode(object):
     ERROR_KEY_UPDATING       = 0b100000
     OK                       = 0b1000000
     RESPONSIBLE_FOR_UPDATING = 0b10000000
+    RESULT_HANDED_OFF        = 0b100000000
+    ERROR_NOT_ADMITTED       = 0b1000000000
+    RESPONSIBLE_FOR_REFRESHING = 0b10000000000
+    FAILURE_CACHED           = 0b100000000000
+
+
+class Batch(object):
+    """
+    open_many 在一个 LRU Cache 中的中间状态：查找并读取命中的 key 之后，
+    还需要计算的条目和 key，以及正在被其它线程计算、需要逐个等待的 key
+    """
+    __slots__ = ("serializer", "call_func_when_failure",
+                 "results", "updating", "computing", "waiting")
+
+    def __init__(self, serializer, call_func_when_failure):
+        self.serializer = serializer
+        self.call_func_when_failure = call_func_when_failure
+        self.results = {}
+        # 由这个批次负责计算并写入缓存的条目
+        self.updating = []
+        # 需要计算、但是不写入缓存的 key
+        self.computing = []
+        self.waiting = []
+
+    def missing(self):
+        return [entry.key for entry in self.updating] + self.computing
 
 
 class CacheError(Exception):
@@ -104,15 +460,35 @@ class CacheError(Exception):
 
 
 class AbstractLRUCache(AbstractCache):
+    # 刷新堆的元素个数超过条目数的两倍加上这个值时，无效的元素一定多于有效的元素，
+    # 重建刷新堆
+    REFRESH_HEAP_COMPACT_THRESHOLD = 64
+
     def __init__(self, name,
                  max_entry_count, max_size,
                  min_uses, max_inactive,
                  lock_age, wait_count,
-                 expire_interval, forced_expire_interval):
+                 expire_interval, forced_expire_interval,
+                 index_class=DictMap, purge_batch_size=1000,
+                 eviction_policy=LRUPolicy,
+                 access_buffer_count=0, access_buffer_size=128,
+                 admission=False,
+                 high_watermark=0.95, low_watermark=0.9,
+                 deleter_count=0, deleter_queue_size=10000,
+                 expire_slice_size=1000, expire_slice_time=0.005,
+                 ttl=None, stale_while_revalidate=0,
+                 refresher_count=1, refresher_queue_size=1000,
+                 refresh_ahead=None, refresh_age=None,
+                 refresh_min_uses=2,
+                 negative_ttl=None, negative_max_ttl=None,
+                 negative_result=None):
         AbstractCache.__init__(self, name)
         self._lock = threading.Lock()
-        self._map = SkipListMap()
-        self._queue = LinkedQueue()
+        # 元数据索引，默认使用散列表；需要有序遍历时可以使用 SkipListMap
+        self._map = index_class(expected_size=max_entry_count)
+        # 淘汰策略，默认是 LRU；读多写少时可以使用 ClockPolicy
+        self._policy = eviction_policy(
+            max_entry_count, max_inactive, self._now)
 
         self._max_entry_count = max_entry_count
         self._current_entry_count = 0
@@ -124,68 +500,338 @@ class AbstractLRUCache(AbstractCache):
         self._wait_count = wait_count
         self._expire_interval = expire_interval
         self._forced_expire_interval = forced_expire_interval
+        # 批量加载期间暂存的条目，加载结束时一次性建立索引
+        self._bulk_entries = None
+        # 已被标记为 DELETING、等待管理线程分批删除的条目
+        self._pending_deletes = deque()
+        self._purge_batch_size = purge_batch_size
+        # 分条的命中记录缓冲区。命中时只把条目追加到当前线程的缓冲区，
+        # 由管理线程或者缓冲区满时拿到锁的线程批量回放 policy.touch；
+        # 缓冲区满时丢弃最早的记录。access_buffer_count 为 0 时不使用缓冲区
+        self._access_buffer_size = access_buffer_size
+        self._access_buffers = [deque(maxlen=access_buffer_size)
+                                for _ in range(access_buffer_count)]
+        self._access_buffer_counter = itertools.count()
+        self._local = threading.local()
+        # TinyLFU 准入：在创建 Entry 之前，用访问频率决定是否缓存一个 key，
+        # 这时 min_uses 由 sketch 统计，不需要为没见过的 key 创建条目
+        self._sketch = None
+        if admission:
+            self._sketch = FrequencySketch(max_entry_count)
+        # 缓存大小或者条目数超过高水位时立即唤醒管理线程，
+        # 由它分批淘汰到低水位以下，请求线程几乎不需要自己淘汰
+        self._high_size = int(max_size * high_watermark)
+        self._high_entry_count = int(max_entry_count * high_watermark)
+        self._low_size = int(max_size * low_watermark)
+        self._low_entry_count = int(max_entry_count * low_watermark)
+        self._eviction_requested = False
+        # 超过高水位时开始淘汰，一直淘汰到低水位以下才停止；
+        # 介于两个水位之间时不淘汰，否则缓存的实际容量只有低水位
+        self._evicting = False
+        # 删除缓存数据的工作线程。deleter_count 为 0 时在调用者的线程中同步删除；
+        # 否则交给有界队列，由删除线程分批删除，每批只获取一次锁
+        self._deleter_count = deleter_count
+        self._deleter_queue_size = deleter_queue_size
+        self._deleters = None
+        # 已经交给删除线程、还没有删除完的条目的大小和个数。
+        # 淘汰和水位只计算其余的条目，避免重复淘汰
+        self._deleting_size = 0
+        self._deleting_entry_count = 0
+        # 过期检查分片执行，每片最多检查 expire_slice_size 个条目、
+        # 最多持续 expire_slice_time 秒，片与片之间释放锁
+        self._expire_slice_size = expire_slice_size
+        self._expire_slice_time = expire_slice_time
+        # 本轮过期检查中第一个被跳过的条目，再次遇到它时本轮结束
+        self._expire_sentinel = None
+        self._expire_lag = 0
+        # 绝对过期时间：ttl 是秒数，或者根据计算结果返回秒数的函数。
+        # 过期之后的 stale_while_revalidate 秒内，仍然返回旧的缓存数据，
+        # 同时由一个刷新线程在后台重新计算
+        self._ttl = ttl
+        self._stale_while_revalidate = stale_while_revalidate
+        self._refresher_count = refresher_count
+        self._refresher_queue_size = refresher_queue_size
+        self._refreshers = None
+        # 提前刷新：管理线程在热点条目到期之前 refresh_ahead 秒，
+        # 或者计算之后 refresh_age 秒，把它提交给刷新线程重新计算。
+        # 上次计算之后至少被访问了 refresh_min_uses 次的条目才是热点。
+        # 为此条目需要保留回源计算的函数和参数
+        self._refresh_ahead = refresh_ahead
+        self._refresh_age = refresh_age
+        self._refresh_min_uses = refresh_min_uses
+        self._refresh_heap = []
+        self._refresh_counter = itertools.count()
+        self._next_refresh_at = None
+        # 缓存回源失败：func 抛出异常，或者返回的结果使 negative_result
+        # 返回真时，在 negative_ttl 秒内直接把这个失败交给调用者，
+        # 不再调用 func；同一个 key 连续失败时 ttl 翻倍，最多 negative_max_ttl
+        self._negative_ttl = negative_ttl
+        self._negative_max_ttl = negative_max_ttl
+        self._negative_result = negative_result
+        # open_future 正在执行的调用，同一个 key 的并发调用共享一个 Future
+        self._futures = {}
+        self._futures_lock = threading.Lock()
 
     @staticmethod
     def _now():
         return time.time()
 
     def _is_full(self):
-        return self._current_size >= self._max_size or \
-            self._current_entry_count >= self._max_entry_count
+        return self._current_size - self._deleting_size >= \
+            self._max_size or \
+            self._current_entry_count - self._deleting_entry_count >= \
+            self._max_entry_count
+
+    def _is_above_high_watermark(self):
+        return self._current_size - self._deleting_size > \
+            self._high_size or \
+            self._current_entry_count - self._deleting_entry_count > \
+            self._high_entry_count
+
+    def _is_above_low_watermark(self):
+        return self._current_size - self._deleting_size > \
+            self._low_size or \
+            self._current_entry_count - self._deleting_entry_count > \
+            self._low_entry_count
+
+    def _check_high_watermark(self):
+        """
+        调用时必须持有锁。超过高水位时唤醒管理线程，直到它处理之前只唤醒一次
+        """
+        if not self._eviction_requested and \
+                self._is_above_high_watermark():
+            self._eviction_requested = True
+            self._wakeup_manager()
+
+    def _deadline(self, result):
+        """
+        计算结果的绝对过期时间，没有设置 ttl 时返回 None
+        """
+        ttl = self._ttl
+        if ttl is None:
+            return None
+        if callable(ttl):
+            ttl = ttl(result)
+            if ttl is None:
+                return None
+        return self._now() + ttl
 
     def add_meta(self, key, size):
+        """
+        添加一个条目的元数据，key 已经存在或者超出限额时返回 False
+        """
+        deadline = self._loaded_deadline()
+        with self._lock:
+            return self._insert_metas([(key, size)], deadline, []) == 1
+
+    def begin_bulk_load(self):
+        """
+        开始批量加载。此后 add_metas 添加的条目只进入 LRU 队列，
+        直到 end_bulk_load 时才按 key 排序、一次性建立索引
+        """
+        with self._lock:
+            if self._bulk_entries is None:
+                self._bulk_entries = []
+
+    def end_bulk_load(self):
+        with self._lock:
+            entries = self._bulk_entries
+            self._bulk_entries = None
+            if not entries:
+                return
+            self._bulk_insert(entries)
+
+    def _bulk_insert(self, entries):
+        count = len(self._map)
+        self._map.bulk_insert(
+            [(entry.key, entry) for entry in entries])
+        if len(self._map) - count == len(entries):
+            return
+        # 有重复的 key，后添加的覆盖先添加的，把被覆盖的条目从队列中移除
+        for entry in entries:
+            if self._map[entry.key] is not entry:
+                self._policy.remove(entry)
+                self._current_size = \
+                    self._current_size - entry.size
+                self._current_entry_count = \
+                    self._current_entry_count - 1
+
+    def _loaded_deadline(self, computed_at=None):
+        """
+        不知道加载的数据是什么时候计算的：固定的 ttl 从加载时（或者 computed_at）
+        开始计算，由计算结果决定的 ttl 视为已经到期
+        """
+        if self._ttl is None:
+            return None
+        if callable(self._ttl):
+            return self._now()
+        if computed_at is None:
+            computed_at = self._now()
+        return computed_at + self._ttl
+
+    def _find_meta(self, key):
+        """
+        调用时必须持有锁。本地没有 key 的元数据时调用，返回其它地方
+        （比如多个进程共享的索引）已经缓存的数据的大小，没有时返回 None
+        """
+        return None
+
+    def add_metas(self, items):
+        """
+        批量添加已缓存数据的元数据，items 是 (key, size) 的序列。
+        整批只获取一次锁，索引和 LRU 队列都批量构建。
+        返回因超出限额而没有被添加的 key 的列表
+        """
+        rejected = []
+        deadline = self._loaded_deadline()
         with self._lock:
-            if self._current_entry_count >= self._max_entry_count:
-                return False
-            if self._current_size + size > self._max_size:
-                return False
+            self._insert_metas(items, deadline, rejected)
+        return rejected
+
+    def _insert_metas(self, items, deadline, rejected):
+        """
+        必须在持有锁时调用。已经存在的 key 被跳过，超出限额的 key 追加到
+        rejected 中，返回实际添加的条目数
+        """
+        entries = []
+        for key, size in items:
+            if key in self._map:
+                continue
+            if self._current_entry_count >= self._max_entry_count or \
+                    self._current_size + size > self._max_size:
+                rejected.append(key)
+                continue
             entry = Entry(key)
             entry.size = size
-            entry.expire = self._now() + self._max_inactive
-            entry.mark_as_updating()
-            entry.set_updating_result(True)
-            node = self._queue.insert_to_head(entry)
-            self._map[key] = node
+            entry.deadline = deadline
+            entry.mark_as_updated()
+            entries.append(entry)
             self._current_size = self._current_size + size
             self._current_entry_count = \
                 self._current_entry_count + 1
-            return True
+        self._policy.insert_many(entries)
+        if self._bulk_entries is not None:
+            self._bulk_entries.extend(entries)
+        else:
+            self._bulk_insert(entries)
+        return len(entries)
+
+    def restore_metas(self, records):
+        """
+        恢复保存的元数据，records 是按最近一次访问的时间从早到晚排列的
+        (key, size, used_count, accessed_at, deadline, cost) 的序列，
+        恢复之后条目在淘汰策略中的先后顺序、过期时间都和保存时一样。
+        超出限额时先放弃最早访问的条目，返回没有被恢复的 key 的列表
+        """
+        rejected = []
+        with self._lock:
+            entries = []
+            expires = []
+            max_inactive = self._max_inactive
+            for key, size, used_count, accessed_at, deadline, cost in \
+                    reversed(records):
+                if key in self._map:
+                    continue
+                if self._current_entry_count >= self._max_entry_count or \
+                        self._current_size + size > self._max_size:
+                    rejected.append(key)
+                    continue
+                entry = Entry(key)
+                entry.size = size
+                entry.used_count = used_count
+                entry.cost = cost
+                entry.deadline = deadline
+                entry.mark_as_updated()
+                entries.append(entry)
+                expires.append(accessed_at + max_inactive)
+                self._current_size = self._current_size + size
+                self._current_entry_count = \
+                    self._current_entry_count + 1
+            # 最近访问的条目在前，插入后位于队列的头部；
+            # insert_many 按当前时间设置了过期时间，恢复成保存时的
+            self._policy.insert_many(entries)
+            for i in xrange(len(entries)):
+                entries[i].expire = expires[i]
+            if self._bulk_entries is not None:
+                self._bulk_entries.extend(entries)
+            else:
+                self._bulk_insert(entries)
+        return rejected
+
+    def _dump_metas(self):
+        """
+        调用时必须持有锁。返回所有可以使用的条目的
+        (key, size, used_count, accessed_at, deadline, cost)。
+        没有排序，调用者释放锁之后按 accessed_at 排序，再交给 restore_metas 恢复
+        """
+        self._drain_access_buffers()
+        max_inactive = self._max_inactive
+        return [(entry.key, entry.size, entry.used_count,
+                 entry.expire - max_inactive, entry.deadline, entry.cost)
+                for _, entry in self._map.iteritems()
+                if entry.is_usable()]
 
     def _read_result_from_cache(self, key,
                                 serializer, func,
                                 *args, **kwargs):
         cached_data = None
         should_purge = False
+        missed = False
         exc_info = None
         try:
             cached_data = self.read_cache(key)
         except KeyError:
-            LOGGER.error(
-                "meta of %s is " % key +
-                "in LRU cache, but cached data is missing, " +
-                "so purge it")
-            should_purge = True
+            if self._is_shared(key):
+                LOGGER.debug("cached data of %s is removed by "
+                             "another process", key)
+                missed = True
+            else:
+                LOGGER.error(
+                    "meta of %s is " % key +
+                    "in LRU cache, but cached data is missing, " +
+                    "so purge it")
+                should_purge = True
         except:
             exc_info = sys.exc_info()
 
         with self._lock:
-            node = self._map[key]
-            entry = node.data
+            entry = self._map[key]
             entry.decr_ref_count()
 
+            if missed and entry.is_usable():
+                self._expire_entry(entry)
             if should_purge:
                 entry.mark_as_deleting_if_necessary()
 
             if entry.is_deleting() and \
                     entry.ref_count == 0:
-                self._delete_node_and_cache(node)
+                self._delete_entry_and_cache(entry)
 
         if exc_info is not None:
             raise exc_info[0], exc_info[1], exc_info[2]
+        if missed:
+            # 和普通的未命中一样重新计算并写回缓存
+            return self._open(key, serializer, True, func, *args, **kwargs)
         if should_purge:
             return func(*args, **kwargs)
         return serializer.loads(cached_data)
 
+    def _is_shared(self, key):
+        """
+        缓存数据是否和其它进程共享、可能被其它进程删除。共享的缓存数据读取不到时
+        只是未命中，重新计算并写回，而不是错误
+        """
+        return False
+
+    def _expire_entry(self, entry):
+        """
+        调用时必须持有锁。条目的缓存数据不能再使用，回到 CREATED 等待重新计算
+        """
+        self._current_size = self._current_size - entry.size
+        entry.size = 0
+        entry.refreshing = False
+        entry.mark_as_expired()
+
     def _call_func_and_write_cache(
             self, key,
             serializer, func,
@@ -194,11 +840,21 @@ class AbstractLRUCache(AbstractCache):
         exc_info = None
         success = True
         size = None
+        negative = False
+        start_time = self._now()
         try:
             ret = func(*args, **kwargs)
         except:
             exc_info = sys.exc_info()
             success = False
+            negative = self._negative_ttl is not None
+        cost = self._now() - start_time
+
+        if success and self._negative_result is not None and \
+                self._negative_result(ret):
+            # 指定的失败结果，返回给调用者，但不写入缓存
+            success = False
+            negative = True
 
         if success:
             try:
@@ -209,17 +865,430 @@ class AbstractLRUCache(AbstractCache):
                 success = False
 
         with self._lock:
-            node = self._map[key]
-            entry = node.data
+            entry = self._map[key]
             entry.decr_ref_count()
-            entry.set_updating_result(success)
             if success:
-                entry.size = size
-                self._current_size = self._current_size + size
-        if success:
+                self._finish_update(entry, ret, size, cost,
+                                    (serializer, func, args, kwargs))
+            else:
+                # 在唤醒等待者之前记录失败，等待者直接拿到这个失败
+                if negative:
+                    self._cache_failure(entry, exc_info, ret)
+                entry.set_updating_result(False, ret)
+        if success or exc_info is None:
             return ret
         raise exc_info[0], exc_info[1], exc_info[2]
 
+    def _finish_update(self, entry, ret, size, cost, loader):
+        """
+        调用时必须持有锁。计算结果已经写入缓存，更新条目的元数据并唤醒等待者
+        """
+        entry.failure = None
+        entry.set_updating_result(True, ret)
+        entry.size = size
+        entry.cost = cost
+        entry.deadline = self._deadline(ret)
+        if loader is not None:
+            self._plan_refresh(entry, loader)
+        self._current_size = self._current_size + size
+        self._policy.update(entry)
+        self._check_high_watermark()
+
+    def _cache_failure(self, entry, exc_info, value):
+        """
+        调用时必须持有锁。连续失败的次数越多，失败被缓存的时间越长。
+        异常只保存类型和值，不保存 traceback，否则它引用的栈帧和局部变量
+        在失败过期之前都不会被释放
+        """
+        if exc_info is not None:
+            exc_info = exc_info[:2]
+        count = 1
+        if entry.failure is not None:
+            count = min(entry.failure[1] + 1, 32)
+        ttl = self._negative_ttl * 2 ** (count - 1)
+        if self._negative_max_ttl is not None:
+            ttl = min(ttl, self._negative_max_ttl)
+        entry.failure = (self._now() + ttl, count, exc_info, value)
+
+    def _cached_failure(self, entry):
+        """
+        调用时必须持有锁。返回还没有过期的失败，没有时返回 None
+        """
+        failure = entry.failure
+        if failure is not None and self._now() < failure[0]:
+            return failure
+        return None
+
+    def get(self, key, serializer):
+        """
+        只读取已经缓存的结果，不回源计算，也不创建条目。没有可以使用的缓存时
+        抛出 KeyError
+        """
+        with self._lock:
+            entry = self._map.get(key)
+            if entry is None or not entry.is_usable():
+                raise KeyError(key)
+            if entry.deadline is not None and self._now() >= \
+                    entry.deadline + self._stale_while_revalidate:
+                raise KeyError(key)
+            entry.incr_ref_count()
+        try:
+            data = self.read_cache(key)
+        finally:
+            with self._lock:
+                self._release_entry(entry)
+        return serializer.loads(data)
+
+    def read_cache_many(self, keys):
+        """
+        批量读取缓存数据，返回 key 到数据的 dict，缓存数据不存在的 key 不在其中。
+        子类可以覆盖它，用一次调用读取整批数据
+        """
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self.read_cache(key)
+            except KeyError:
+                pass
+        return result
+
+    def write_cache_many(self, items):
+        """
+        批量写入缓存数据，items 是 (key, data) 的列表。
+        子类可以覆盖它，用一次调用写入整批数据
+        """
+        for key, data in items:
+            self.write_cache(key, data)
+
+    def get_many(self, keys, serializer):
+        """
+        get 的批量版本，不回源计算，也不创建条目。整批只获取两次锁，
+        缓存数据用一次 read_cache_many 读取。
+        返回 key 到结果的 dict，没有可以使用的缓存的 key 不在其中
+        """
+        entries = []
+        with self._lock:
+            now = self._now()
+            for key in _unique(keys):
+                entry = self._map.get(key)
+                if entry is None or not entry.is_usable():
+                    continue
+                if entry.deadline is not None and now >= \
+                        entry.deadline + self._stale_while_revalidate:
+                    continue
+                entry.incr_ref_count()
+                if not self._access_buffers:
+                    self._policy.touch(entry)
+                entries.append(entry)
+        if not entries:
+            return {}
+        for entry in entries:
+            if self._access_buffers:
+                self._record_access(entry)
+        try:
+            cached = self.read_cache_many([entry.key for entry in entries])
+        finally:
+            with self._lock:
+                for entry in entries:
+                    self._release_entry(entry)
+        return dict((key, serializer.loads(data))
+                    for key, data in cached.iteritems())
+
+    def put_many(self, items, serializer):
+        """
+        不经过回源计算，直接缓存一批结果，items 是 (key, 结果) 的序列。
+        整批只获取两次锁，缓存数据用一次 write_cache_many 写入。
+        正在被其它线程计算或者刷新的 key、以及超出容量时的新 key 被跳过，
+        返回写入的 key 的列表
+        """
+        values = dict(items)
+        updating = []
+        replacing = []
+        with self._lock:
+            for key in _unique(key for key, _ in items):
+                entry = self._map.get(key)
+                if entry is None:
+                    if self._is_full():
+                        continue
+                    entry = Entry(key)
+                    entry.used_count = max(0, self._min_uses - 1)
+                    self._policy.insert(entry)
+                    self._map[key] = entry
+                    self._current_entry_count = \
+                        self._current_entry_count + 1
+                    self._check_high_watermark()
+                if entry.is_usable():
+                    # 和后台刷新一样原子地替换缓存数据
+                    if entry.refreshing:
+                        continue
+                    replacing.append(entry)
+                elif entry.mark_as_updating():
+                    updating.append(entry)
+                else:
+                    continue
+                entry.incr_ref_count()
+
+        entries = updating + replacing
+        sizes = {}
+        exc_info = None
+        try:
+            data_items = []
+            for entry in entries:
+                size, data = serializer.dumps(values[entry.key])
+                sizes[entry.key] = size
+                data_items.append((entry.key, data))
+            if data_items:
+                self.write_cache_many(data_items)
+        except:
+            exc_info = sys.exc_info()
+
+        with self._lock:
+            for entry in updating:
+                entry.decr_ref_count()
+                if exc_info is None:
+                    ret = values[entry.key]
+                    self._finish_update(entry, ret, sizes[entry.key],
+                                        None, None)
+                else:
+                    entry.set_updating_result(False)
+            for entry in replacing:
+                if exc_info is None and entry.is_usable():
+                    size = sizes[entry.key]
+                    self._current_size = \
+                        self._current_size + size - entry.size
+                    entry.size = size
+                    entry.failure = None
+                    entry.deadline = self._deadline(values[entry.key])
+                    self._policy.update(entry)
+                    self._check_high_watermark()
+                self._release_entry(entry)
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return [entry.key for entry in entries]
+
+    def open_many(self, keys, serializer,
+                  call_func_when_failure, func_many):
+        """
+        open 的批量版本。func_many(keys) 返回 key 到结果的 dict，
+        整批中需要计算的 key 只调用一次 func_many。查找整批 key 只获取一次锁，
+        命中的缓存数据用一次 read_cache_many 读取，计算结果用一次
+        write_cache_many 写入。
+        返回 key 到结果的 dict；func_many 没有返回结果的 key、缓存了异常的 key
+        不在其中，func_many 抛出的异常传给调用者
+        """
+        batch = self.begin_many(keys, serializer,
+                                call_func_when_failure, func_many)
+        values, exc_info, cost = _call_func_many(func_many, batch.missing())
+        write_exc_info = self.end_many(batch, values, exc_info,
+                                       cost, func_many)
+        if exc_info is None:
+            exc_info = write_exc_info
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self.open_waiting(batch, functools.partial(_call_one, func_many))
+        return batch.results
+
+    def begin_many(self, keys, serializer,
+                   call_func_when_failure, func_many):
+        """
+        open_many 的第一步：在一次加锁中查找整批 key，读取命中的缓存数据，
+        返回 Batch。batch.missing() 是需要计算的 key，计算之后必须调用 end_many。
+        不等待正在被其它线程计算的 key，否则两个批次可能互相等待
+        """
+        assert isinstance(serializer, Serializer)
+        batch = Batch(serializer, call_func_when_failure)
+        keys = _unique(keys)
+        if not self.is_usable():
+            LOGGER.debug("%s is not usable yet", self.name)
+            cached = self.read_cache_many(keys)
+            for key, data in cached.iteritems():
+                batch.results[key] = serializer.loads(data)
+            batch.computing = [key for key in keys if key not in cached]
+            return batch
+
+        reading = []
+        refreshing = []
+        accessed = []
+        errors = []
+        with self._lock:
+            for key in keys:
+                (rc, result), record = self._lookup(key, 0)
+                if record is not None:
+                    accessed.append(record)
+                if rc & ReturnCode.RESULT_HANDED_OFF:
+                    batch.results[key] = result
+                elif rc & ReturnCode.FAILURE_CACHED:
+                    if result[2] is None:
+                        batch.results[key] = result[3]
+                elif rc & ReturnCode.OK:
+                    reading.append(self._map[key])
+                    if rc & ReturnCode.RESPONSIBLE_FOR_REFRESHING:
+                        refreshing.append(key)
+                elif rc & ReturnCode.RESPONSIBLE_FOR_UPDATING:
+                    batch.updating.append(self._map[key])
+                elif rc & ReturnCode.ERROR_WAIT_COUNT_REACHED:
+                    batch.waiting.append(key)
+                elif rc & ReturnCode.ERROR_UNREACH_MIN_USES or \
+                        rc & ReturnCode.ERROR_NOT_ADMITTED or \
+                        rc & ReturnCode.ERROR_ENTRY_UNUSABLE or \
+                        call_func_when_failure:
+                    batch.computing.append(key)
+                else:
+                    errors.append(rc)
+            if errors:
+                for entry in reading:
+                    self._release_entry(entry)
+                for key in refreshing:
+                    entry = self._map[key]
+                    entry.refreshing = False
+                    self._release_entry(entry)
+                self._abandon_updates(batch.updating)
+                raise CacheError(code=errors[0])
+
+        for entry in accessed:
+            self._record_access(entry)
+        for key in refreshing:
+            self._submit_refresh(key, serializer,
+                                 functools.partial(_call_one, func_many),
+                                 (key, ), {})
+        if reading:
+            try:
+                batch.computing.extend(
+                    self._read_many(reading, serializer, batch.results,
+                                    batch.updating))
+            except:
+                self.abort_many(batch)
+                raise
+        return batch
+
+    def abort_many(self, batch):
+        """
+        放弃 begin_many 之后还没有计算的条目，唤醒等待者
+        """
+        with self._lock:
+            self._abandon_updates(batch.updating)
+
+    def _abandon_updates(self, entries):
+        """
+        调用时必须持有锁。放弃计算这些条目，唤醒等待者
+        """
+        for entry in entries:
+            entry.decr_ref_count()
+            entry.set_updating_result(False)
+
+    def _read_many(self, entries, serializer, results, updating):
+        """
+        用一次 read_cache_many 读取命中的条目，然后只获取一次锁释放它们的引用。
+        返回缓存数据丢失的 key。共享的缓存数据被其它进程删除的条目由这个批次
+        重新计算并写回，加入 updating，引用在 end_many 中释放
+        """
+        cached = {}
+        exc_info = None
+        try:
+            cached = self.read_cache_many([entry.key for entry in entries])
+        except:
+            exc_info = sys.exc_info()
+
+        missing = []
+        with self._lock:
+            for entry in entries:
+                lost = exc_info is None and entry.key not in cached
+                if lost and self._is_shared(entry.key):
+                    if entry.is_usable():
+                        self._expire_entry(entry)
+                    if entry.mark_as_updating():
+                        updating.append(entry)
+                        continue
+                    lost = False
+                    missing.append(entry.key)
+                entry.decr_ref_count()
+                if lost:
+                    LOGGER.error(
+                        "meta of %s is " % entry.key +
+                        "in LRU cache, but cached data is missing, " +
+                        "so purge it")
+                    missing.append(entry.key)
+                    entry.mark_as_deleting_if_necessary()
+                if entry.is_deleting() and \
+                        entry.ref_count == 0:
+                    self._delete_entry_and_cache(entry)
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        for key, data in cached.iteritems():
+            results[key] = serializer.loads(data)
+        return missing
+
+    def end_many(self, batch, values, exc_info, cost, func_many):
+        """
+        open_many 的第二步：values 是计算 batch.missing() 得到的结果，
+        exc_info 是计算时的异常。用一次 write_cache_many 写入计算结果，
+        然后只获取一次锁更新元数据。不抛出异常，返回写入缓存时的 exc_info
+        """
+        for key in batch.computing:
+            if key in values:
+                batch.results[key] = values[key]
+        if not batch.updating:
+            return None
+
+        sizes = {}
+        negative = set()
+        write_exc_info = None
+        if exc_info is None:
+            try:
+                data_items = []
+                for entry in batch.updating:
+                    key = entry.key
+                    if key not in values:
+                        continue
+                    ret = values[key]
+                    batch.results[key] = ret
+                    if self._negative_result is not None and \
+                            self._negative_result(ret):
+                        # 指定的失败结果，返回给调用者，但不写入缓存
+                        negative.add(key)
+                        continue
+                    size, data = batch.serializer.dumps(ret)
+                    sizes[key] = size
+                    data_items.append((key, data))
+                if data_items:
+                    self.write_cache_many(data_items)
+            except:
+                write_exc_info = sys.exc_info()
+                sizes = {}
+
+        with self._lock:
+            for entry in batch.updating:
+                key = entry.key
+                entry.decr_ref_count()
+                ret = values.get(key)
+                if key in sizes:
+                    self._finish_update(
+                        entry, ret, sizes[key], cost,
+                        (batch.serializer,
+                         functools.partial(_call_one, func_many),
+                         (key, ), {}))
+                    continue
+                if key in negative:
+                    self._cache_failure(entry, None, ret)
+                elif exc_info is not None and \
+                        self._negative_ttl is not None:
+                    self._cache_failure(entry, exc_info, None)
+                entry.set_updating_result(False, ret)
+        return write_exc_info
+
+    def open_waiting(self, batch, func):
+        """
+        open_many 的最后一步：逐个等待正在被其它线程计算的 key，
+        等待失败时用 func(key) 计算。失败的 key 不在结果中
+        """
+        for key in batch.waiting:
+            try:
+                batch.results[key] = self._open(
+                    key, batch.serializer,
+                    batch.call_func_when_failure, func, key)
+            except Exception:
+                LOGGER.debug("fail to open %s", key, exc_info=True)
+
     def open(self, key, serializer,
              call_func_when_failure, func,
              *args, **kwargs):
@@ -237,11 +1306,46 @@ class AbstractLRUCache(AbstractCache):
                           call_func_when_failure, func,
                           *args, **kwargs)
 
+    def open_future(self, executor, key, serializer,
+                    call_func_when_failure, func,
+                    *args, **kwargs):
+        """
+        open 的非阻塞版本，立即返回 future.Future，调用者（比如事件循环）
+        从不阻塞。同一个 key 的并发调用共享同一个 Future，只占用一个工作线程，
+        不会有线程阻塞在回源计算上；读取、写入缓存和回源计算都在 executor 中执行
+        """
+        with self._futures_lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future
+            future = executor.submit(self.open, key, serializer,
+                                     call_func_when_failure, func,
+                                     *args, **kwargs)
+            self._futures[key] = future
+        # 可能已经完成了，回调函数会立即执行，所以在释放锁之后注册
+        future.add_done_callback(
+            functools.partial(self._forget_future, key))
+        return future
+
+    def _forget_future(self, key, future):
+        with self._futures_lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
     def _open(self, key, serializer,
               call_func_when_failure, func,
               *args, **kwargs):
-        rc = self._exists(key)
+        rc, result = self._exists(key)
+        if rc & ReturnCode.RESULT_HANDED_OFF:
+            return result
+        if rc & ReturnCode.FAILURE_CACHED:
+            _, _, exc_info, value = result
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1]
+            return value
         if rc & ReturnCode.OK:
+            if rc & ReturnCode.RESPONSIBLE_FOR_REFRESHING:
+                self._submit_refresh(key, serializer, func, args, kwargs)
             return self._read_result_from_cache(
                         key,
                         serializer,
@@ -256,6 +1360,7 @@ class AbstractLRUCache(AbstractCache):
                         *args,
                         **kwargs)
         elif rc & ReturnCode.ERROR_UNREACH_MIN_USES or \
+                rc & ReturnCode.ERROR_NOT_ADMITTED or \
                 rc & ReturnCode.ERROR_ENTRY_UNUSABLE:
             return func(*args, **kwargs)
         else:
@@ -263,99 +1368,263 @@ class AbstractLRUCache(AbstractCache):
                 return func(*args, **kwargs)
             raise CacheError(code=rc)
 
-    def _key_exists(self, node):
-        entry = node.data
+    def _key_exists(self, entry, created=False, wait_count=None):
+        """
+        返回 (返回码, 结果)。返回码是 RESULT_HANDED_OFF 时，
+        结果是其它线程回源计算得到的、直接交给等待者的结果；
+        返回码是 FAILURE_CACHED 时，结果是缓存的回源失败。
+        created 表示条目是这次访问创建的，已经由 policy.insert 记录过了
+        """
         if entry.is_unusable():
-            return ReturnCode.ERROR_ENTRY_UNUSABLE
+            return ReturnCode.ERROR_ENTRY_UNUSABLE, None
 
-        now = self._now()
-        entry.incr_used_count()
-        entry.expire = now + self._max_inactive
-        self._queue.move_to_head(node)
+        entry.used_count = entry.used_count + 1
+        if not created and not self._access_buffers:
+            self._policy.touch(entry)
 
         if entry.used_count < self._min_uses:
-            return ReturnCode.ERROR_UNREACH_MIN_USES
+            return ReturnCode.ERROR_UNREACH_MIN_USES, None
+
+        if entry.failure is not None and entry.is_created():
+            failure = self._cached_failure(entry)
+            if failure is not None:
+                return ReturnCode.FAILURE_CACHED, failure
 
         entry.incr_ref_count()
 
         if entry.is_usable():
-            return ReturnCode.OK
+            deadline = entry.deadline
+            if deadline is None:
+                return ReturnCode.OK, None
+            now = self._now()
+            if now < deadline:
+                return ReturnCode.OK, None
+            if now < deadline + self._stale_while_revalidate and \
+                    self._refreshers is not None:
+                if entry.refreshing:
+                    return ReturnCode.OK, None
+                # 由当前线程提交后台刷新，刷新期间持有一个引用
+                entry.refreshing = True
+                entry.incr_ref_count()
+                return ReturnCode.OK | \
+                    ReturnCode.RESPONSIBLE_FOR_REFRESHING, None
+            # 超出了 stale-while-revalidate 窗口，旧的数据不能再使用
+            self._expire_entry(entry)
 
         if entry.mark_as_updating():
-            return ReturnCode.RESPONSIBLE_FOR_UPDATING
+            return ReturnCode.RESPONSIBLE_FOR_UPDATING, None
 
-        for _ in range(self._wait_count):
-            if entry.is_updating():
+        if wait_count is None:
+            wait_count = self._wait_count
+        for _ in range(wait_count):
+            flight = entry.flight
+            if flight is not None:
                 LOGGER.debug(
                     "%s is updating, " % str(entry.key) +
                     "wait for it is usable")
-                got_it = entry.wait_for_usable(
-                    self._lock,
-                    self._lock_age)
-                if got_it:
-                    return ReturnCode.OK
-                if entry.mark_as_updating():
-                    return ReturnCode.RESPONSIBLE_FOR_UPDATING
+                flight.wait(self._lock, self._lock_age)
+                if flight.done and flight.success:
+                    # 回源计算的结果直接交给等待者，不需要再读取缓存
+                    entry.decr_ref_count()
+                    if entry.is_deleting() and \
+                            entry.ref_count == 0:
+                        self._delete_entry_and_cache(entry)
+                    return ReturnCode.RESULT_HANDED_OFF, flight.value
+                if flight.done and entry.failure is not None:
+                    failure = self._cached_failure(entry)
+                    if failure is not None:
+                        self._release_entry(entry)
+                        return ReturnCode.FAILURE_CACHED, failure
+            if entry.is_usable():
+                return ReturnCode.OK, None
+            if entry.mark_as_updating():
+                return ReturnCode.RESPONSIBLE_FOR_UPDATING, None
         else:
             LOGGER.debug("wait count is reached for %s",
                          entry.key)
             entry.decr_ref_count()
             if entry.is_deleting():
                 if entry.ref_count == 0:
-                    self._delete_node_and_cache(node)
-                return ReturnCode.ERROR_ENTRY_UNUSABLE
-            return ReturnCode.ERROR_WAIT_COUNT_REACHED
+                    self._delete_entry_and_cache(entry)
+                return ReturnCode.ERROR_ENTRY_UNUSABLE, None
+            return ReturnCode.ERROR_WAIT_COUNT_REACHED, None
+
+    def _admit(self, key):
+        """
+        调用时必须持有锁。访问频率没有达到 min_uses 的 key 不被接纳；
+        缓存满时，只有比淘汰候选者访问频率更高的 key 才被接纳
+        """
+        frequency = self._sketch.frequency(key)
+        if frequency < self._min_uses:
+            return ReturnCode.ERROR_UNREACH_MIN_USES
+        if not self._is_full():
+            return ReturnCode.OK
+        victim = self._policy.victim()
+        if victim is None or \
+                frequency > self._sketch.frequency(victim.key):
+            return ReturnCode.OK
+        return ReturnCode.ERROR_NOT_ADMITTED
 
     def _exists(self, key):
-        self._lock.acquire()
+        with self._lock:
+            rc, accessed = self._lookup(key)
+        if accessed is not None:
+            self._record_access(accessed)
+        return rc
+
+    def _lookup(self, key, wait_count=None):
+        """
+        调用时必须持有锁，可能暂时释放锁。返回 (_key_exists 的返回值,
+        需要记录到访问缓冲区的条目)。wait_count 覆盖等待其它线程计算的次数
+        """
+        sketch = self._sketch
+        if sketch is not None:
+            sketch.increment(key)
+        created = False
         try:
-            node = self._map[key]
+            entry = self._map[key]
         except KeyError:
+            size = self._find_meta(key)
+            if sketch is not None and size is None:
+                rc = self._admit(key)
+                if not rc & ReturnCode.OK:
+                    return (rc, None), None
             if self._is_full():
                 self._lock.release()
                 self._forced_expire(20)
                 self._lock.acquire()
             if self._is_full():
+                return (ReturnCode.ERROR_CACHE_OVERFLOW, None), None
+            # 释放锁期间，其它线程可能已经创建了该条目
+            entry = self._map.get(key)
+            if entry is None:
+                entry = Entry(key)
+                if size is not None:
+                    # 数据已经缓存了，和加载的条目一样直接可以使用
+                    entry.size = size
+                    entry.deadline = self._loaded_deadline()
+                    entry.mark_as_updated()
+                    self._current_size = self._current_size + size
+                elif sketch is not None:
+                    # 已经由 sketch 确认达到了 min_uses
+                    entry.used_count = max(0, self._min_uses - 1)
+                self._policy.insert(entry)
+                self._map[key] = entry
+                created = True
+                self._current_entry_count = \
+                    self._current_entry_count + 1
+                self._check_high_watermark()
+        rc = self._key_exists(entry, created, wait_count)
+        if self._access_buffers and not created:
+            return rc, entry
+        return rc, None
+
+    def _record_access(self, entry):
+        buffer = getattr(self._local, "access_buffer", None)
+        if buffer is None:
+            index = next(self._access_buffer_counter) % \
+                len(self._access_buffers)
+            buffer = self._access_buffers[index]
+            self._local.access_buffer = buffer
+        buffer.append(entry)
+        # 缓冲区满了，并且能够立即拿到锁时，由当前线程回放
+        if len(buffer) >= self._access_buffer_size and \
+                self._lock.acquire(False):
+            try:
+                self._drain_access_buffers()
+            finally:
                 self._lock.release()
-                return ReturnCode.ERROR_CACHE_OVERFLOW
-            entry = Entry(key)
-            node = self._queue.insert_to_head(entry)
-            self._map[key] = node
-            self._current_entry_count = \
-                self._current_entry_count + 1
-        rc = self._key_exists(node)
-        self._lock.release()
-        return rc
+
+    def _drain_access_buffers(self):
+        """
+        调用时必须持有锁。回放所有缓冲区中的命中记录，
+        同一个条目只回放最后一次命中，热点 key 只需要调整一次队列
+        """
+        records = []
+        for buffer in self._access_buffers:
+            for _ in range(len(buffer)):
+                try:
+                    records.append(buffer.popleft())
+                except IndexError:
+                    break
+        if not records:
+            return
+        seen = set()
+        entries = []
+        for entry in reversed(records):
+            if entry in seen:
+                continue
+            seen.add(entry)
+            # 记录之后条目可能已经被删除了，或者正在被删除
+            if not entry.is_unusable():
+                entries.append(entry)
+        touch = self._policy.touch
+        for entry in reversed(entries):
+            touch(entry)
+
+    @property
+    def expire_lag(self):
+        """
+        过期检查落后的秒数，也就是下一片要检查的条目已经过期了多久
+        """
+        return self._expire_lag
 
     def _expire(self):
+        """
+        执行一片过期检查，返回是否还有过期的条目没有检查。
+        时间预算从获取锁之后开始计算，每一片至少检查一个过期的条目，
+        所以等待锁的时间再长，过期检查也总能向前推进
+        """
         self._lock.acquire()
+        deadline = time.time() + self._expire_slice_time
         try:
-            sentinel = None
+            self._drain_access_buffers()
+            sentinel = self._expire_sentinel
+            # 过期的条目先从淘汰策略中移除，攒够一批再删除缓存数据
+            entries = []
+            checked = 0
+            unfinished = False
             while True:
-                node = self._queue.peek_last()
-                if node is None:
+                if len(entries) >= self._purge_batch_size:
+                    self._delete_unlinked(entries)
+                    entries = []
+                entry = self._policy.oldest()
+                if entry is None:
                     break
-                if node is sentinel:
+                if entry is sentinel:
                     break
-                entry = node.data
                 now = self._now()
                 if entry.expire > now:
                     break
+                if checked > 0 and \
+                        (checked >= self._expire_slice_size or
+                         time.time() >= deadline):
+                    # 这一片用完了，下一片从队尾继续
+                    self._expire_lag = now - entry.expire
+                    unfinished = True
+                    break
+                checked = checked + 1
                 if entry.ref_count == 0:
                     LOGGER.debug("%s is expired", entry.key)
-                    self._delete_node_and_cache(node)
+                    if not self._unlink_entries([entry]):
+                        break
+                    entries.append(entry)
                     sentinel = None
                     continue
 
                 LOGGER.debug(
                     "%s is referenced "
-                    "by other threads, move it to the "
-                    "head of lru queue",
-                    entry)
-                entry.expire = now + self._max_inactive
-                self._queue.move_to_head(node)
+                    "by other threads, skip it",
+                    entry.key)
+                self._policy.skip(entry)
                 if sentinel is None:
-                    sentinel = node
+                    sentinel = entry
+            self._delete_unlinked(entries)
+            if not unfinished:
+                self._expire_lag = 0
+                sentinel = None
+            self._expire_sentinel = sentinel
+            return unfinished
         finally:
             self._lock.release()
 
@@ -363,22 +1632,21 @@ class AbstractLRUCache(AbstractCache):
         self._lock.acquire()
         sentinel = None
         try:
+            self._drain_access_buffers()
             while True:
-                node = self._queue.peek_last()
-                if node is None:
+                entry = self._policy.victim()
+                if entry is None:
                     break
-                if node is sentinel:
+                if entry is sentinel:
                     break
-                entry = node.data
                 if entry.ref_count == 0:
-                    self._delete_node_and_cache(node)
+                    self._delete_entry_and_cache(entry)
                     return True
 
-                entry.expire = self._now() + self._max_inactive
-                self._queue.move_to_head(node)
+                self._policy.skip(entry)
 
                 if sentinel is None:
-                    sentinel = node
+                    sentinel = entry
 
                 if tries <= 0:
                     continue
@@ -389,33 +1657,290 @@ class AbstractLRUCache(AbstractCache):
         finally:
             self._lock.release()
 
-    def _delete_node_and_cache(self, node):
-        entry = node.data
-        if entry.ref_count > 0:
-            LOGGER.error(
-                "the referenced count "
-                "of entry must be zero when "
-                "calling this method")
-            return
-        if not entry.mark_as_deleting_if_necessary():
-            LOGGER.error(
-                "current status can not "
-                "be transmitted to DELETING")
+    def _delete_entry_and_cache(self, entry):
+        self._delete_entries_and_caches([entry])
+
+    def _delete_entries_and_caches(self, entries):
+        """
+        调用时必须持有锁。删除缓存数据时会释放锁，所以整批条目只释放、获取一次锁
+        """
+        self._delete_unlinked(self._unlink_entries(entries))
+
+    def _unlink_entries(self, entries):
+        """
+        调用时必须持有锁。把条目标记为 DELETING 并从淘汰策略中移除，
+        返回需要删除缓存数据的条目
+        """
+        deleting_entries = []
+        for entry in entries:
+            if entry.ref_count > 0:
+                LOGGER.error(
+                    "the referenced count "
+                    "of entry must be zero when "
+                    "calling this method")
+                continue
+            if not entry.mark_as_deleting_if_necessary():
+                LOGGER.error(
+                    "current status can not "
+                    "be transmitted to DELETING")
+                continue
+            entry.incr_ref_count()
+            self._policy.remove(entry)
+            deleting_entries.append(entry)
+        return deleting_entries
+
+    def _delete_unlinked(self, deleting_entries):
+        """
+        调用时必须持有锁。删除 _unlink_entries 返回的条目的缓存数据和元数据
+        """
+        if not deleting_entries:
             return
-        entry.incr_ref_count()
+        # 包括还没有删除完的数据在内已经超出容量时同步删除，
+        # 等到缓存数据真正删除之后才继续，保证不超出容量
+        deleters = self._deleters
+        if deleters is not None and \
+                self._current_size <= self._max_size and \
+                self._current_entry_count <= self._max_entry_count:
+            for index, entry in enumerate(deleting_entries):
+                if not deleters.submit(entry):
+                    # 队列满了，剩下的条目同步删除，淘汰的速度受限于删除的速度
+                    deleting_entries = deleting_entries[index:]
+                    break
+                self._deleting_size = self._deleting_size + entry.size
+                self._deleting_entry_count = \
+                    self._deleting_entry_count + 1
+            else:
+                return
         self._lock.release()
+        self._delete_caches(deleting_entries)
+        self._lock.acquire()
+        self._finish_deletes(deleting_entries)
 
-        self.delete_cache(entry.key)
+    def _delete_caches(self, entries):
+        for entry in entries:
+            try:
+                self.delete_cache(entry.key)
+            except:
+                LOGGER.error(
+                    "fail to delete cache of %s",
+                    entry.key,
+                    exc_info=True)
 
-        self._lock.acquire()
+    def _finish_deletes(self, deleting_entries):
+        """
+        调用时必须持有锁。缓存数据删除之后，删除条目的元数据
+        """
+        for entry in deleting_entries:
+            entry.decr_ref_count()
+            entry.mark_as_deleted()
+            entry.loader = None
+            self._current_size = \
+                self._current_size - entry.size
+            self._current_entry_count = \
+                self._current_entry_count - 1
+            del self._map[entry.key]
+
+    def _delete_batch(self, entries):
+        """
+        在删除线程中执行：不持有锁删除一批缓存数据，然后只获取一次锁更新元数据
+        """
+        self._delete_caches(entries)
+        with self._lock:
+            for entry in entries:
+                self._deleting_size = self._deleting_size - entry.size
+                self._deleting_entry_count = \
+                    self._deleting_entry_count - 1
+            self._finish_deletes(entries)
+
+    def _submit_refresh(self, key, serializer, func, args, kwargs):
+        # 停止时 _before_finalize 把 _refreshers 置为 None 之后才停止它，
+        # 读到的刷新线程已经停止时 submit 返回 False
+        refreshers = self._refreshers
+        if refreshers is not None and refreshers.submit(
+                (key, serializer, func, args, kwargs)):
+            return
+        # 队列满了，或者已经停止，下一次访问再提交
+        with self._lock:
+            entry = self._map[key]
+            entry.refreshing = False
+            self._release_entry(entry)
+
+    def _release_entry(self, entry):
+        """
+        调用时必须持有锁。释放一个引用，条目正在等待删除时删除它
+        """
         entry.decr_ref_count()
-        entry.mark_as_deleted()
-        self._current_size = \
-            self._current_size - entry.size
-        self._current_entry_count = \
-            self._current_entry_count - 1
-        del self._map[entry.key]
-        self._queue.remove_node(node)
+        if entry.is_deleting() and entry.ref_count == 0:
+            self._delete_entry_and_cache(entry)
+
+    def _refresh_batch(self, jobs):
+        for job in jobs:
+            self._refresh(*job)
+
+    def _refresh(self, key, serializer, func, args, kwargs):
+        """
+        在刷新线程中执行：重新计算并写入缓存，然后替换条目的元数据。
+        写入缓存是原子的，读取的线程看到的要么是旧的数据、要么是新的数据
+        """
+        ret = None
+        size = None
+        success = True
+        start_time = self._now()
+        try:
+            ret = func(*args, **kwargs)
+            cost = self._now() - start_time
+            size, data = serializer.dumps(ret)
+            self.write_cache(key, data)
+        except:
+            LOGGER.error("fail to refresh %s", key, exc_info=True)
+            success = False
+
+        with self._lock:
+            entry = self._map[key]
+            # 刷新期间条目可能超出了 stale-while-revalidate 窗口，
+            # 已经由其它线程重新计算，这时丢弃刷新的结果
+            if success and entry.refreshing and entry.is_usable():
+                self._current_size = \
+                    self._current_size + size - entry.size
+                entry.size = size
+                entry.cost = cost
+                entry.deadline = self._deadline(ret)
+                self._plan_refresh(entry, (serializer, func, args, kwargs))
+                self._policy.update(entry)
+                self._check_high_watermark()
+            entry.refreshing = False
+            self._release_entry(entry)
+
+    def _is_refresh_ahead_enabled(self):
+        return self._refresh_ahead is not None or \
+            self._refresh_age is not None
+
+    def _plan_refresh(self, entry, loader):
+        """
+        调用时必须持有锁。条目重新计算之后，计算下一次提前刷新的时间
+        """
+        if not self._is_refresh_ahead_enabled():
+            return
+        refresh_at = None
+        if self._refresh_ahead is not None and entry.deadline is not None:
+            refresh_at = entry.deadline - self._refresh_ahead
+        if self._refresh_age is not None:
+            age_refresh_at = self._now() + self._refresh_age
+            if refresh_at is None or age_refresh_at < refresh_at:
+                refresh_at = age_refresh_at
+        if refresh_at is None:
+            entry.refresh_seq = None
+            entry.loader = None
+            return
+        # 之前的计划留在堆中，弹出时按序号识别为无效
+        entry.refresh_seq = next(self._refresh_counter)
+        entry.loader = loader + (entry.used_count, )
+        heapq.heappush(self._refresh_heap,
+                       (refresh_at, entry.refresh_seq, entry))
+        if len(self._refresh_heap) > 2 * len(self._map) + \
+                self.REFRESH_HEAP_COMPACT_THRESHOLD:
+            self._refresh_heap = [item for item in self._refresh_heap
+                                  if self._is_planned(item)]
+            heapq.heapify(self._refresh_heap)
+        # 比管理线程计划醒来的时间更早
+        if self._next_refresh_at is None or \
+                refresh_at < self._next_refresh_at:
+            self._next_refresh_at = refresh_at
+            self._wakeup_manager()
+
+    @staticmethod
+    def _is_planned(item):
+        """
+        刷新堆中的元素是否仍然有效：条目没有被重新计划，也没有被删除
+        """
+        _, seq, entry = item
+        return entry.refresh_seq == seq and entry.loader is not None and \
+            entry.is_usable()
+
+    def _refresh_hot_entries(self):
+        """
+        把到了刷新时间的热点条目提交给刷新线程，
+        返回到下一个刷新时间的秒数，没有需要刷新的条目时返回 None
+        """
+        jobs = []
+        with self._lock:
+            heap = self._refresh_heap
+            now = self._now()
+            while heap and heap[0][0] <= now:
+                item = heapq.heappop(heap)
+                entry = item[2]
+                # 条目已经被重新计算过、正在刷新，或者已经不可用
+                if not self._is_planned(item) or entry.refreshing:
+                    continue
+                serializer, func, args, kwargs, used_count = entry.loader
+                if entry.used_count - used_count < self._refresh_min_uses:
+                    # 不够热，让它正常过期
+                    entry.loader = None
+                    continue
+                entry.refreshing = True
+                entry.incr_ref_count()
+                jobs.append((entry.key, serializer, func, args, kwargs))
+            delay = None
+            if heap:
+                delay = heap[0][0] - now
+        for job in jobs:
+            self._submit_refresh(*job)
+        return delay
+
+    def _start_before_callback(self):
+        AbstractCache._start_before_callback(self)
+        if (self._ttl is not None and self._stale_while_revalidate > 0 or
+                self._is_refresh_ahead_enabled()) and \
+                self._refresher_count > 0:
+            self._refreshers = WorkerPool(
+                "refresher-of-%s" % self.name,
+                self._refresher_count,
+                self._refresher_queue_size,
+                1,
+                self._refresh_batch)
+        if self._deleter_count > 0:
+            self._deleters = WorkerPool(
+                "deleter-of-%s" % self.name,
+                self._deleter_count,
+                self._deleter_queue_size,
+                self._purge_batch_size,
+                self._delete_batch)
+
+    def _start_after_callback(self):
+        if self._refreshers is not None:
+            self._refreshers.start()
+        if self._deleters is not None:
+            self._deleters.start()
+        AbstractCache._start_after_callback(self)
+
+    def _before_finalize(self):
+        # 刷新完成时可能删除条目，所以先停止刷新线程
+        with self._lock:
+            refreshers = self._refreshers
+            self._refreshers = None
+        if refreshers is not None:
+            refreshers.stop()
+        # 删除完已经提交的条目之后再停止删除线程
+        with self._lock:
+            deleters = self._deleters
+            self._deleters = None
+        if deleters is not None:
+            deleters.stop()
+
+    def _delete_pending(self):
+        """
+        删除一批等待删除的条目，返回是否还有剩余
+        """
+        with self._lock:
+            entries = []
+            while self._pending_deletes and \
+                    len(entries) < self._purge_batch_size:
+                entry = self._pending_deletes.popleft()
+                # 可能已经被其它线程删除，或者又被引用了
+                if entry.is_deleting() and entry.ref_count == 0:
+                    entries.append(entry)
+            self._delete_entries_and_caches(entries)
+            return len(self._pending_deletes) > 0
 
     @abc.abstractmethod
     def delete_cache(self, key):
@@ -429,32 +1954,78 @@ class AbstractLRUCache(AbstractCache):
     def write_cache(self, key, data):
         pass
 
+    def _evict(self):
+        """
+        淘汰一批条目，直到低于低水位或者达到 purge_batch_size 个。
+        整批只获取一次锁，删除缓存数据时只释放、获取一次锁。
+        返回 (淘汰的条目数, 是否需要继续淘汰)
+        """
+        with self._lock:
+            self._drain_access_buffers()
+            if self._eviction_requested or self._is_above_high_watermark():
+                self._evicting = True
+            self._eviction_requested = False
+            if not self._evicting:
+                return 0, False
+            size = self._current_size - self._deleting_size
+            entry_count = \
+                self._current_entry_count - self._deleting_entry_count
+            entries = []
+            sentinel = None
+            while size > self._low_size or \
+                    entry_count > self._low_entry_count:
+                if len(entries) >= self._purge_batch_size:
+                    break
+                entry = self._policy.victim()
+                if entry is None or entry is sentinel:
+                    break
+                if entry.ref_count > 0:
+                    self._policy.skip(entry)
+                    if sentinel is None:
+                        sentinel = entry
+                    continue
+                # 从淘汰策略中移除之后，victim 才会返回下一个条目
+                if not self._unlink_entries([entry]):
+                    break
+                entries.append(entry)
+                size = size - entry.size
+                entry_count = entry_count - 1
+            self._delete_unlinked(entries)
+            self._evicting = self._is_above_low_watermark()
+            return len(entries), self._evicting
+
     def manage(self):
         while True:
-            self._expire()
+            while self._delete_pending():
+                yield 0
+            while self._expire():
+                yield 0
             while True:
-                self._lock.acquire()
-                if self._current_size > self._max_size:
-                    self._lock.release()
-                    success = self._forced_expire()
-                    if success:
-                        continue
-                    else:
-                        yield self._forced_expire_interval
-                        continue
+                evicted, evicting = self._evict()
+                if not evicting:
+                    break
+                if evicted > 0:
+                    yield 0
+                elif self._is_above_high_watermark():
+                    # 所有候选条目都正在被引用
+                    yield self._forced_expire_interval
                 else:
-                    self._lock.release()
                     break
-            yield self._expire_interval
+            wait_time = self._expire_interval
+            if self._is_refresh_ahead_enabled():
+                delay = self._refresh_hot_entries()
+                if delay is not None and delay < wait_time:
+                    wait_time = delay
+                self._next_refresh_at = self._now() + wait_time
+            yield wait_time
 
     def purge(self, key):
         with self._lock:
             try:
-                node = self._map[key]
+                entry = self._map[key]
             except KeyError:
                 return ReturnCode.ERROR_KEY_NOT_EXISTS
 
-            entry = node.data
             if entry.is_unusable():
                 return ReturnCode.OK
 
@@ -463,5 +2034,316 @@ class AbstractLRUCache(AbstractCache):
 
             entry.mark_as_deleting()
             if entry.ref_count == 0:
-                self._delete_node_and_cache(node)
+                self._delete_entry_and_cache(entry)
             return ReturnCode.OK
+
+    def purge_prefix(self, prefix):
+        """
+        把所有以 prefix 开头的条目标记为 DELETING，然后由管理线程在后台分批删除。
+        返回被标记的条目数。正在更新的条目不会被标记。
+        索引可以不持有锁遍历时（DictMap），在锁外收集匹配的条目，
+        每 purge_batch_size 个条目获取一次锁，标记之前确认条目没有被替换；
+        否则（SkipListMap）在持有锁时做一次有序的遍历
+        """
+        count = 0
+        if getattr(self._map, "SNAPSHOT_ITERATION", False):
+            matched = list(self._map.iter_prefix(prefix))
+            batch_size = self._purge_batch_size
+            for start in xrange(0, len(matched), batch_size):
+                with self._lock:
+                    for key, entry in matched[start:start+batch_size]:
+                        if self._map.get(key) is entry and \
+                                self._mark_for_purge(entry):
+                            count = count + 1
+        else:
+            with self._lock:
+                for _, entry in self._map.iter_prefix(prefix):
+                    if self._mark_for_purge(entry):
+                        count = count + 1
+        if count > 0:
+            self._wakeup_manager()
+        return count
+
+    def _mark_for_purge(self, entry):
+        """
+        调用时必须持有锁。返回条目是否被标记为 DELETING
+        """
+        if not entry.mark_as_deleting():
+            return False
+        if entry.ref_count == 0:
+            self._pending_deletes.append(entry)
+        return True
+
+
+class AbstractLRUCacheBuilder(object):
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self):
+        self._name = None
+        self._max_entry_count = None
+        self._max_size = None
+        self._min_uses = 1
+        self._max_inactive = 24 * 60 * 60
+        self._lock_age = 0.4
+        self._wait_count = 5
+        self._expire_interval = 10
+        self._forced_expire_interval = 1
+        self._index_class = DictMap
+        self._purge_batch_size = 1000
+        self._eviction_policy = LRUPolicy
+        self._access_buffer_count = 0
+        self._access_buffer_size = 128
+        self._admission = False
+        self._high_watermark = 0.95
+        self._low_watermark = 0.9
+        self._deleter_count = 0
+        self._deleter_queue_size = 10000
+        self._expire_slice_size = 1000
+        self._expire_slice_time = 0.005
+        self._ttl = None
+        self._stale_while_revalidate = 0
+        self._refresher_count = 1
+        self._refresher_queue_size = 1000
+        self._refresh_ahead = None
+        self._refresh_age = None
+        self._refresh_min_uses = 2
+        self._negative_ttl = None
+        self._negative_max_ttl = None
+        self._negative_result = None
+
+    def with_name(self, name):
+        self._name = name
+        return self
+
+    def with_max_entry_count(self, max_entry_count):
+        self._max_entry_count = max_entry_count
+        return self
+
+    def with_max_size(self, max_size):
+        self._max_size = max_size
+        return self
+
+    def with_min_uses(self, min_uses):
+        self._min_uses = min_uses
+        return self
+
+    def with_max_inactive(self, max_inactive):
+        self._max_inactive = max_inactive
+        return self
+
+    def with_lock_age(self, lock_age):
+        self._lock_age = lock_age
+        return self
+
+    def with_wait_count(self, wait_count):
+        self._wait_count = wait_count
+        return self
+
+    def with_expire_interval(self, expire_interval):
+        self._expire_interval = expire_interval
+        return self
+
+    def with_forced_expire_interval(
+            self,
+            forced_expire_interval):
+        self._forced_expire_interval = \
+            forced_expire_interval
+        return self
+
+    def with_index(self, index_class):
+        self._index_class = index_class
+        return self
+
+    def with_purge_batch_size(self, purge_batch_size):
+        self._purge_batch_size = purge_batch_size
+        return self
+
+    def with_eviction_policy(self, eviction_policy):
+        """eviction_policy 是 EvictionPolicy 的子类，比如 ClockPolicy"""
+        self._eviction_policy = eviction_policy
+        return self
+
+    def with_access_buffer(self, access_buffer_count,
+                           access_buffer_size=128):
+        """
+        命中时只记录到 access_buffer_count 个分条的缓冲区中，
+        不在请求路径上调整淘汰策略的队列
+        """
+        self._access_buffer_count = access_buffer_count
+        self._access_buffer_size = access_buffer_size
+        return self
+
+    def with_admission(self, admission=True):
+        """
+        开启 TinyLFU 准入，没有见过的 key 不再创建条目来统计 min_uses
+        """
+        self._admission = admission
+        return self
+
+    def with_watermarks(self, high_watermark, low_watermark):
+        """
+        高、低水位是 max_size 和 max_entry_count 的比例
+        """
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
+        return self
+
+    def with_deleters(self, deleter_count, deleter_queue_size=10000):
+        """
+        由 deleter_count 个删除线程分批删除缓存数据，
+        等待删除的条目最多 deleter_queue_size 个，超出时同步删除
+        """
+        self._deleter_count = deleter_count
+        self._deleter_queue_size = deleter_queue_size
+        return self
+
+    def with_expire_slice(self, expire_slice_size,
+                          expire_slice_time=0.005):
+        """
+        每片过期检查最多检查 expire_slice_size 个条目、
+        最多持续 expire_slice_time 秒
+        """
+        self._expire_slice_size = expire_slice_size
+        self._expire_slice_time = expire_slice_time
+        return self
+
+    def with_ttl(self, ttl, stale_while_revalidate=0):
+        """
+        ttl 是秒数，或者根据计算结果返回秒数（None 表示不过期）的函数。
+        过期之后的 stale_while_revalidate 秒内返回旧的数据，并在后台重新计算
+        """
+        self._ttl = ttl
+        self._stale_while_revalidate = stale_while_revalidate
+        return self
+
+    def with_refreshers(self, refresher_count, refresher_queue_size=1000):
+        self._refresher_count = refresher_count
+        self._refresher_queue_size = refresher_queue_size
+        return self
+
+    def with_refresh_ahead(self, refresh_ahead=None, refresh_age=None,
+                           refresh_min_uses=2):
+        """
+        在热点条目到期之前 refresh_ahead 秒，或者计算之后 refresh_age 秒，
+        由刷新线程提前重新计算。上次计算之后至少被访问了
+        refresh_min_uses 次的条目才是热点
+        """
+        self._refresh_ahead = refresh_ahead
+        self._refresh_age = refresh_age
+        self._refresh_min_uses = refresh_min_uses
+        return self
+
+    def with_negative_cache(self, negative_ttl, negative_max_ttl=None,
+                            negative_result=None):
+        """
+        缓存 func 抛出的异常，或者使 negative_result 返回真的结果，
+        negative_ttl 秒内不再调用 func。同一个 key 连续失败时 ttl 翻倍，
+        最多 negative_max_ttl 秒
+        """
+        self._negative_ttl = negative_ttl
+        self._negative_max_ttl = negative_max_ttl
+        self._negative_result = negative_result
+        return self
+
+    def _check(self):
+        if self._max_entry_count is None:
+            raise RuntimeError("missing max_entry_count")
+        if self._max_size is None:
+            raise RuntimeError("missing max_size")
+        if self._min_uses is None:
+            raise RuntimeError("missing min_uses")
+        if self._max_inactive is None:
+            raise RuntimeError("missing max_inactive")
+        if self._lock_age is None:
+            raise RuntimeError("missing lock_age")
+        if self._wait_count is None:
+            raise RuntimeError("missing wait_count")
+        if self._expire_interval is None:
+            raise RuntimeError("missing expire_interval")
+        if self._forced_expire_interval is None:
+            raise RuntimeError("missing forced_expire_interval")
+        if self._index_class is None:
+            raise RuntimeError("missing index_class")
+        if self._purge_batch_size is None:
+            raise RuntimeError("missing purge_batch_size")
+        if self._eviction_policy is None:
+            raise RuntimeError("missing eviction_policy")
+        if self._access_buffer_count is None:
+            raise RuntimeError("missing access_buffer_count")
+        if self._access_buffer_size is None:
+            raise RuntimeError("missing access_buffer_size")
+        if not 0 < self._low_watermark <= self._high_watermark <= 1:
+            raise RuntimeError("invalid watermarks")
+        if self._deleter_count is None or self._deleter_count < 0:
+            raise RuntimeError("invalid deleter_count")
+        if self._deleter_queue_size is None or \
+                self._deleter_queue_size <= 0:
+            raise RuntimeError("invalid deleter_queue_size")
+        if self._expire_slice_size is None or \
+                self._expire_slice_size <= 0:
+            raise RuntimeError("invalid expire_slice_size")
+        if self._expire_slice_time is None or \
+                self._expire_slice_time <= 0:
+            raise RuntimeError("invalid expire_slice_time")
+        if self._ttl is not None and not callable(self._ttl) and \
+                self._ttl <= 0:
+            raise RuntimeError("invalid ttl")
+        if self._stale_while_revalidate is None or \
+                self._stale_while_revalidate < 0:
+            raise RuntimeError("invalid stale_while_revalidate")
+        if self._refresher_count is None or self._refresher_count < 0:
+            raise RuntimeError("invalid refresher_count")
+        if self._refresher_queue_size is None or \
+                self._refresher_queue_size <= 0:
+            raise RuntimeError("invalid refresher_queue_size")
+        if self._refresh_ahead is not None and self._refresh_ahead < 0:
+            raise RuntimeError("invalid refresh_ahead")
+        if self._refresh_age is not None and self._refresh_age <= 0:
+            raise RuntimeError("invalid refresh_age")
+        if self._refresh_min_uses is None or self._refresh_min_uses < 0:
+            raise RuntimeError("invalid refresh_min_uses")
+        if self._negative_ttl is not None and self._negative_ttl <= 0:
+            raise RuntimeError("invalid negative_ttl")
+        if self._negative_ttl is None and \
+                (self._negative_max_ttl is not None or
+                 self._negative_result is not None):
+            raise RuntimeError("missing negative_ttl")
+
+    def _lru_cache_args(self):
+        return (self._name,
+                self._max_entry_count,
+                self._max_size,
+                self._min_uses,
+                self._max_inactive,
+                self._lock_age,
+                self._wait_count,
+                self._expire_interval,
+                self._forced_expire_interval)
+
+    def _lru_cache_kwargs(self):
+        return {"index_class": self._index_class,
+                "purge_batch_size": self._purge_batch_size,
+                "eviction_policy": self._eviction_policy,
+                "access_buffer_count": self._access_buffer_count,
+                "access_buffer_size": self._access_buffer_size,
+                "admission": self._admission,
+                "high_watermark": self._high_watermark,
+                "low_watermark": self._low_watermark,
+                "deleter_count": self._deleter_count,
+                "deleter_queue_size": self._deleter_queue_size,
+                "expire_slice_size": self._expire_slice_size,
+                "expire_slice_time": self._expire_slice_time,
+                "ttl": self._ttl,
+                "stale_while_revalidate": self._stale_while_revalidate,
+                "refresher_count": self._refresher_count,
+                "refresher_queue_size": self._refresher_queue_size,
+                "refresh_ahead": self._refresh_ahead,
+                "refresh_age": self._refresh_age,
+                "refresh_min_uses": self._refresh_min_uses,
+                "negative_ttl": self._negative_ttl,
+                "negative_max_ttl": self._negative_max_ttl,
+                "negative_result": self._negative_result}
+
+    @abc.abstractmethod
+    def build(self):
+        pass
@@ -0,0 +1,73 @@
+# coding: utf8
+
+
+class DictMap(dict):
+    """
+    基于散列表的映射，是 AbstractLRUCache 默认使用的元数据索引。
+    查找、插入、删除都是 O(1) 的，且都在 C 层完成，持锁时间最短
+    """
+    __slots__ = ()
+    # iter_prefix 遍历的是调用时的快照，可以在不持有缓存的锁时调用
+    SNAPSHOT_ITERATION = True
+
+    def __init__(self, expected_size=None):
+        # 散列表会自动扩容，不需要预估大小
+        dict.__init__(self)
+
+    def bulk_insert(self, items):
+        """批量插入 (key, value)，key 相同时后面的覆盖前面的"""
+        self.update(items)
+
+    def iter_range(self, lo=None, hi=None):
+        """
+        按顺序遍历 key 在 [lo, hi) 范围内的元素。散列表是无序的，
+        需要先过滤再排序，代价是 O(n log n)，频繁使用时应改用 SkipListMap
+        """
+        keys = [key for key in self
+                if (lo is None or not key < lo) and
+                (hi is None or key < hi)]
+        keys.sort()
+        for key in keys:
+            yield key, self[key]
+
+    def iter_prefix(self, prefix):
+        """
+        遍历 key 以 prefix 开头的元素，顺序不确定。
+        遍历的是 items() 的快照，复制在 C 层一次完成，其它线程同时修改也是安全的
+        """
+        for key, value in self.items():
+            if isinstance(key, str) and key.startswith(prefix):
+                yield key, value
+
+
+def test_dict_map():
+    m = DictMap()
+    assert len(m) == 0
+    m["a"] = 1
+    m["b"] = 2
+    assert m["a"] == 1 and m["b"] == 2 and len(m) == 2
+    m.bulk_insert([("ab", 3)])
+    assert list(m.iter_range("a", "b")) == [("a", 1), ("ab", 3)]
+    assert list(m.iter_range("ab")) == [("ab", 3), ("b", 2)]
+    assert sorted(m.iter_prefix("a")) == [("a", 1), ("ab", 3)]
+    matched = m.iter_prefix("a")
+    assert next(matched)[0].startswith("a")
+    # 快照之后的修改不影响遍历
+    m["ac"] = 4
+    assert len(list(matched)) == 1
+    del m["ac"]
+    del m["ab"]
+    del m["a"]
+    assert len(m) == 1
+    try:
+        m["a"]
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError expected")
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_dict_map()
@@ -1,7 +1,7 @@
 # coding: utf8
 
-import time
-import threading
+from .linked_queue import Node
+from .flight import Flight
 
 
 class EntryStatus(object):
@@ -12,56 +12,54 @@ class EntryStatus(object):
     DELETED  = 0b10000
 
 
-class Entry(object):
+class Entry(Node):
+    """
+    缓存条目的元数据。Entry 自己就是 LinkedQueue 的节点，
+    所有字段都保存在 __slots__ 中，热路径上没有 property 的开销
+    """
+    __slots__ = ("key", "ref_count", "used_count",
+                 "expire", "size", "_status", "flight",
+                 "policy_state", "cost", "deadline", "refreshing",
+                 "refresh_seq", "loader", "failure", "data_identity")
+
     def __init__(self, key=None):
-        self._key = key
-        self._ref_count = 0
-        self._used_count = 0
+        self.prev = None
+        self.next = None
+        self.key = key
+        self.ref_count = 0
+        self.used_count = 0
+        self.expire = 0
+        self.size = 0
         self._status = EntryStatus.CREATED
-        self._expire = 0
-        self._size = 0
-        self._waiters = []
-
-    @property
-    def key(self):
-        return self._key
-
-    @key.setter
-    def key(self, key):
-        self._key = key
+        # 正在进行的回源计算，只在 UPDATING 状态下存在
+        self.flight = None
+        # 淘汰策略使用的状态，比如 CLOCK 的访问位
+        self.policy_state = 0
+        # 最近一次回源计算的耗时（秒），加载的条目不知道代价，为 None
+        self.cost = None
+        # 绝对过期时间，超过之后只能在 stale-while-revalidate 窗口内使用，
+        # 为 None 时只按 max_inactive 过期
+        self.deadline = None
+        # 是否正在后台重新计算
+        self.refreshing = False
+        # 提前刷新计划在刷新堆中的序号，以及重新计算需要的 (serializer, func,
+        # args, kwargs, 上次计算时的 used_count)，只有开启了提前刷新的条目才有
+        self.refresh_seq = None
+        self.loader = None
+        # 缓存的回源失败：(过期时间, 连续失败次数, exc_info, 失败结果)
+        self.failure = None
+        # 这个进程最近写入或者读取的缓存数据的标识，比如缓存文件的
+        # (inode, mtime)，用来识别其它进程写入的缓存数据
+        self.data_identity = None
 
     def incr_ref_count(self):
-        self._ref_count = self._ref_count + 1
+        self.ref_count = self.ref_count + 1
 
     def decr_ref_count(self):
-        self._ref_count = max(0, self._ref_count - 1)
+        self.ref_count = max(0, self.ref_count - 1)
 
     def incr_used_count(self):
-        self._used_count = self._used_count + 1
-
-    @property
-    def ref_count(self):
-        return self._ref_count
-
-    @property
-    def used_count(self):
-        return self._used_count
-
-    @property
-    def expire(self):
-        return self._expire
-
-    @expire.setter
-    def expire(self, expire):
-        self._expire = expire
-
-    @property
-    def size(self):
-        return self._size
-
-    @size.setter
-    def size(self, size):
-        self._size = size
+        self.used_count = self.used_count + 1
 
     def mark_as_deleting(self):
         if self._status & EntryStatus.CREATED or \
@@ -81,58 +79,41 @@ class Entry(object):
             return True
         return False
 
+    def mark_as_updated(self):
+        """直接标记为 UPDATED，用于加载已经缓存的数据"""
+        if self._status & EntryStatus.CREATED:
+            self._status = EntryStatus.UPDATED
+            return True
+        return False
+
+    def mark_as_expired(self):
+        """超过了绝对过期时间，需要重新计算"""
+        if self._status & EntryStatus.UPDATED:
+            self._status = EntryStatus.CREATED
+            return True
+        return False
+
     def mark_as_updating(self):
         if self._status & EntryStatus.CREATED or \
                 self._status & EntryStatus.DELETED:
             self._status = EntryStatus.UPDATING
+            self.flight = Flight()
             return True
         return False
 
-    def set_updating_result(self, success):
+    def set_updating_result(self, success, value=None):
         if not self._status & EntryStatus.UPDATING:
             return False
         self._status = EntryStatus.CREATED
         if success:
             self._status = EntryStatus.UPDATED
-        # 唤醒所有等待更新完成的线程
-        while self._waiters:
-            waiter = self._waiters.pop(0)
-            waiter.release()
+        # 唤醒所有等待更新完成的线程，并把结果直接交给它们
+        flight = self.flight
+        self.flight = None
+        if flight is not None:
+            flight.finish(success, value)
         return True
 
-    def wait_for_usable(self, lock, timeout):
-        waiter = threading.Lock()
-        waiter.acquire()
-        self._waiters.append(waiter)
-        lock.release()
-
-        if timeout is None or timeout < 0:
-            waiter.acquire()
-            lock.acquire()
-            return self._status & EntryStatus.UPDATED \
-                and True or False
-
-        end_time = time.time() + timeout
-        delay = 0.0005  # 500 us -> initial delay of 1 ms
-        while True:
-            gotit = waiter.acquire(0)
-            if gotit:
-                break
-            remaining = end_time - time.time()
-            if remaining <= 0:
-                break
-            delay = min(delay * 2, remaining, .05)
-            time.sleep(delay)
-
-        lock.acquire()
-        if not gotit:
-            try:
-                self._waiters.remove(waiter)
-            except ValueError:
-                pass
-        return self._status & EntryStatus.UPDATED \
-            and True or False
-
     def is_created(self):
         return self._status & EntryStatus.CREATED
 
@@ -145,6 +126,9 @@ class Entry(object):
     def is_deleting(self):
         return self._status & EntryStatus.DELETING
 
+    def is_deleted(self):
+        return self._status & EntryStatus.DELETED
+
     def is_unusable(self):
         return self._status & EntryStatus.DELETING or \
             self._status & EntryStatus.DELETED
@@ -0,0 +1,627 @@
+# coding: utf8
+
+import abc
+import heapq
+import itertools
+from collections import OrderedDict
+
+from .linked_queue import LinkedQueue
+
+
+class EvictionPolicy(object):
+    """
+    淘汰策略，决定条目在队列中的位置，以及过期、强制淘汰时先检查哪个条目。
+    所有方法都必须在持有缓存的锁时调用
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, max_entry_count, max_inactive, now):
+        self._max_entry_count = max_entry_count
+        self._max_inactive = max_inactive
+        self._now = now
+
+    @abc.abstractmethod
+    def insert(self, entry):
+        """新建的条目"""
+        pass
+
+    @abc.abstractmethod
+    def insert_many(self, entries):
+        """批量加载的条目"""
+        pass
+
+    @abc.abstractmethod
+    def touch(self, entry):
+        """条目被访问"""
+        pass
+
+    @abc.abstractmethod
+    def remove(self, entry):
+        """条目被删除"""
+        pass
+
+    def update(self, entry):
+        """回源计算完成，条目的 size 和 cost 有了新的值"""
+        pass
+
+    @abc.abstractmethod
+    def skip(self, entry):
+        """
+        victim 或 oldest 返回的条目正在被其它线程引用，不能删除，
+        把它放到最后才会被检查的位置
+        """
+        pass
+
+    @abc.abstractmethod
+    def victim(self):
+        """强制淘汰时下一个要检查的条目，没有条目时返回 None"""
+        pass
+
+    @abc.abstractmethod
+    def oldest(self):
+        """过期检查时下一个要检查的条目，也就是 expire 最小的条目"""
+        pass
+
+    @abc.abstractproperty
+    def size(self):
+        pass
+
+
+class LRUPolicy(EvictionPolicy):
+    """
+    每次访问都把条目移动到队列的头部，并更新过期时间
+    """
+    def __init__(self, max_entry_count, max_inactive, now):
+        EvictionPolicy.__init__(self, max_entry_count, max_inactive, now)
+        self._queue = LinkedQueue()
+
+    def insert(self, entry):
+        entry.expire = self._now() + self._max_inactive
+        self._queue.insert_to_head(entry)
+
+    def insert_many(self, entries):
+        expire = self._now() + self._max_inactive
+        for entry in entries:
+            entry.expire = expire
+        self._queue.insert_many_to_head(entries)
+
+    def touch(self, entry):
+        entry.expire = self._now() + self._max_inactive
+        self._queue.move_to_head(entry)
+
+    def remove(self, entry):
+        self._queue.remove_node(entry)
+
+    def skip(self, entry):
+        self.touch(entry)
+
+    def victim(self):
+        return self._queue.peek_last()
+
+    def oldest(self):
+        return self._queue.peek_last()
+
+    @property
+    def size(self):
+        return self._queue.size
+
+
+class ClockPolicy(EvictionPolicy):
+    """
+    CLOCK（second-chance）。访问时只设置条目的访问位，不修改队列；
+    指针的移动由过期检查和强制淘汰完成：队尾条目的访问位被设置时，
+    清除访问位、更新过期时间，并把它移动到队列的头部（给它第二次机会）。
+    条目的 policy_state 就是访问位
+    """
+    def __init__(self, max_entry_count, max_inactive, now):
+        EvictionPolicy.__init__(self, max_entry_count, max_inactive, now)
+        self._queue = LinkedQueue()
+
+    def insert(self, entry):
+        entry.expire = self._now() + self._max_inactive
+        entry.policy_state = 0
+        self._queue.insert_to_head(entry)
+
+    def insert_many(self, entries):
+        expire = self._now() + self._max_inactive
+        for entry in entries:
+            entry.expire = expire
+            entry.policy_state = 0
+        self._queue.insert_many_to_head(entries)
+
+    def touch(self, entry):
+        entry.policy_state = 1
+
+    def remove(self, entry):
+        self._queue.remove_node(entry)
+
+    def skip(self, entry):
+        entry.policy_state = 0
+        entry.expire = self._now() + self._max_inactive
+        self._queue.move_to_head(entry)
+
+    def victim(self):
+        queue = self._queue
+        while True:
+            entry = queue.peek_last()
+            if entry is None or not entry.policy_state:
+                return entry
+            # 每个条目最多被跳过一次，所以最多遍历一遍队列
+            self.skip(entry)
+
+    def oldest(self):
+        return self.victim()
+
+    @property
+    def size(self):
+        return self._queue.size
+
+
+class _MultiQueuePolicy(EvictionPolicy):
+    """
+    条目分布在多个 LinkedQueue 中，条目的 policy_state 是它所在队列的下标。
+    新条目总是插入到队列的头部，所以每个队列的尾部都是该队列中最早过期的条目
+    """
+    QUEUE_COUNT = 2
+
+    def __init__(self, max_entry_count, max_inactive, now):
+        EvictionPolicy.__init__(self, max_entry_count, max_inactive, now)
+        self._queues = [LinkedQueue() for _ in range(self.QUEUE_COUNT)]
+
+    def _push(self, entry, index):
+        entry.expire = self._now() + self._max_inactive
+        entry.policy_state = index
+        self._queues[index].insert_to_head(entry)
+
+    def _move(self, entry, index):
+        self._queues[entry.policy_state].remove_node(entry)
+        self._push(entry, index)
+
+    def insert_many(self, entries):
+        expire = self._now() + self._max_inactive
+        for entry in entries:
+            entry.expire = expire
+            entry.policy_state = 0
+        self._queues[0].insert_many_to_head(entries)
+
+    def remove(self, entry):
+        self._queues[entry.policy_state].remove_node(entry)
+
+    def skip(self, entry):
+        entry.expire = self._now() + self._max_inactive
+        self._queues[entry.policy_state].move_to_head(entry)
+
+    def oldest(self):
+        oldest = None
+        for queue in self._queues:
+            entry = queue.peek_last()
+            if entry is not None and \
+                    (oldest is None or entry.expire < oldest.expire):
+                oldest = entry
+        return oldest
+
+    @property
+    def size(self):
+        return sum(queue.size for queue in self._queues)
+
+
+class SLRUPolicy(_MultiQueuePolicy):
+    """
+    分段 LRU。新条目进入试用段（probation），再次被访问时晋升到保护段
+    （protected）；保护段超过容量的 PROTECTED_RATIO 时，把它最久没有被访问的
+    条目降级回试用段。总是先淘汰试用段的条目，
+    所以只访问一次的扫描不会挤掉保护段中的热点。
+    降级的条目保留原来的过期时间，放在试用段中单独的队列里，
+    保证每个队列的尾部仍然是该队列中最早过期的条目
+    """
+    QUEUE_COUNT = 3
+    PROBATION = 0
+    PROTECTED = 1
+    DEMOTED = 2
+    PROTECTED_RATIO = 0.8
+
+    def __init__(self, max_entry_count, max_inactive, now):
+        _MultiQueuePolicy.__init__(
+            self, max_entry_count, max_inactive, now)
+        self._protected_capacity = \
+            max(1, int(max_entry_count * self.PROTECTED_RATIO))
+
+    def insert(self, entry):
+        self._push(entry, self.PROBATION)
+
+    def touch(self, entry):
+        if entry.policy_state == self.PROTECTED:
+            self.skip(entry)
+            return
+        self._move(entry, self.PROTECTED)
+        protected = self._queues[self.PROTECTED]
+        if protected.size > self._protected_capacity:
+            # 保护段的尾部是其中最早过期的条目，依次降级的条目的过期时间
+            # 不会减小，所以降级队列也按过期时间有序
+            demoted = protected.remove_last()
+            demoted.policy_state = self.DEMOTED
+            self._queues[self.DEMOTED].insert_to_head(demoted)
+
+    def victim(self):
+        for index in (self.PROBATION, self.DEMOTED, self.PROTECTED):
+            entry = self._queues[index].peek_last()
+            if entry is not None:
+                return entry
+        return None
+
+
+class TwoQueuePolicy(_MultiQueuePolicy):
+    """
+    2Q。新条目进入先进先出的 A1in，A1in 超过容量的 KIN_RATIO 时先从 A1in 淘汰，
+    被淘汰的 key 记录在只保存 key 的 A1out 中；A1out 中的 key 再次出现时，
+    说明它不是只访问一次的 key，直接进入 LRU 的 Am。
+    A1in 中的条目被访问时只更新过期时间，不改变位置
+    """
+    A1IN = 0
+    AM = 1
+    KIN_RATIO = 0.25
+    KOUT_RATIO = 0.5
+
+    def __init__(self, max_entry_count, max_inactive, now):
+        _MultiQueuePolicy.__init__(
+            self, max_entry_count, max_inactive, now)
+        self._kin = max(1, int(max_entry_count * self.KIN_RATIO))
+        self._kout = max(1, int(max_entry_count * self.KOUT_RATIO))
+        self._a1out = OrderedDict()
+
+    def insert(self, entry):
+        if entry.key in self._a1out:
+            del self._a1out[entry.key]
+            self._push(entry, self.AM)
+        else:
+            self._push(entry, self.A1IN)
+
+    def touch(self, entry):
+        if entry.policy_state == self.AM:
+            self.skip(entry)
+        else:
+            # A1in 不再按过期时间有序，它的过期检查可能会推迟，但不会提前
+            entry.expire = self._now() + self._max_inactive
+
+    def remove(self, entry):
+        _MultiQueuePolicy.remove(self, entry)
+        if entry.policy_state == self.A1IN:
+            self._a1out[entry.key] = None
+            if len(self._a1out) > self._kout:
+                self._a1out.popitem(last=False)
+
+    def victim(self):
+        a1in = self._queues[self.A1IN]
+        am = self._queues[self.AM]
+        if a1in.size > self._kin or am.size == 0:
+            return a1in.peek_last()
+        return am.peek_last()
+
+
+class ARCPolicy(_MultiQueuePolicy):
+    """
+    自适应替换缓存（ARC）。T1 保存只被访问过一次的条目，T2 保存被访问过
+    多次的条目；B1、B2 分别保存最近从 T1、T2 淘汰的 key（只保存 key）。
+    key 在 B1 中再次出现说明 T1 太小，增大 T1 的目标大小 p；
+    在 B2 中再次出现则减小 p。|T1| 超过 p 时从 T1 淘汰，否则从 T2 淘汰
+    """
+    T1 = 0
+    T2 = 1
+
+    def __init__(self, max_entry_count, max_inactive, now):
+        _MultiQueuePolicy.__init__(
+            self, max_entry_count, max_inactive, now)
+        self._p = 0
+        self._b1 = OrderedDict()
+        self._b2 = OrderedDict()
+
+    def insert(self, entry):
+        key = entry.key
+        c = self._max_entry_count
+        if key in self._b1:
+            delta = max(len(self._b2) // len(self._b1), 1)
+            self._p = min(c, self._p + delta)
+            del self._b1[key]
+            self._push(entry, self.T2)
+        elif key in self._b2:
+            delta = max(len(self._b1) // len(self._b2), 1)
+            self._p = max(0, self._p - delta)
+            del self._b2[key]
+            self._push(entry, self.T2)
+        else:
+            self._push(entry, self.T1)
+
+    def touch(self, entry):
+        if entry.policy_state == self.T2:
+            self.skip(entry)
+        else:
+            self._move(entry, self.T2)
+
+    def remove(self, entry):
+        _MultiQueuePolicy.remove(self, entry)
+        t1, t2 = self._queues
+        b1, b2 = self._b1, self._b2
+        c = self._max_entry_count
+        if entry.policy_state == self.T1:
+            b1[entry.key] = None
+            while b1 and t1.size + len(b1) > c:
+                b1.popitem(last=False)
+        else:
+            b2[entry.key] = None
+            while b2 and t1.size + t2.size + len(b1) + len(b2) > 2 * c:
+                b2.popitem(last=False)
+
+    def victim(self):
+        t1, t2 = self._queues
+        if t1.size > 0 and (t1.size > self._p or t2.size == 0):
+            return t1.peek_last()
+        return t2.peek_last()
+
+
+class GDSFPolicy(EvictionPolicy):
+    """
+    GreedyDual-Size-Frequency。条目的优先级是 L + 访问次数 * 代价 / 大小，
+    代价是回源计算的耗时，总是淘汰优先级最低的条目，
+    也就是每字节节省的后端计算时间最少的条目；L 是最近一次被淘汰的条目的优先级，
+    让很久没有被访问的条目逐渐被淘汰。
+    优先级保存在堆中，条目的 policy_state 是它在堆中的有效元素，
+    优先级变化时把旧的元素标记为无效（惰性删除）。
+    条目同时按访问顺序保存在一个 LinkedQueue 中，用于过期检查
+    """
+    # 堆中的无效元素超过有效元素的个数时重建堆
+    COMPACT_THRESHOLD = 64
+
+    def __init__(self, max_entry_count, max_inactive, now):
+        EvictionPolicy.__init__(self, max_entry_count, max_inactive, now)
+        self._queue = LinkedQueue()
+        self._heap = []
+        self._counter = itertools.count()
+        self._inflation = 0.0
+        self._max_priority = 0.0
+        self._victim_item = None
+        self._cost_sum = 0.0
+        self._cost_count = 0
+
+    def _priority(self, entry):
+        cost = entry.cost
+        if cost is None:
+            # 不知道代价的条目，按平均代价计算
+            if self._cost_count:
+                cost = self._cost_sum / self._cost_count
+            else:
+                cost = 1.0
+        return self._inflation + \
+            float(max(entry.used_count, 1)) * cost / max(entry.size, 1)
+
+    def _push(self, entry, priority):
+        item = entry.policy_state
+        if item:
+            item[2] = None
+        item = [priority, next(self._counter), entry]
+        entry.policy_state = item
+        heapq.heappush(self._heap, item)
+        if priority > self._max_priority:
+            self._max_priority = priority
+        if len(self._heap) > \
+                2 * self._queue.size + self.COMPACT_THRESHOLD:
+            self._heap = [item for item in self._heap
+                          if item[2] is not None]
+            heapq.heapify(self._heap)
+
+    def insert(self, entry):
+        entry.expire = self._now() + self._max_inactive
+        entry.policy_state = None
+        self._queue.insert_to_head(entry)
+        self._push(entry, self._priority(entry))
+
+    def insert_many(self, entries):
+        expire = self._now() + self._max_inactive
+        for entry in entries:
+            entry.expire = expire
+            entry.policy_state = None
+        self._queue.insert_many_to_head(entries)
+        for entry in entries:
+            self._push(entry, self._priority(entry))
+
+    def touch(self, entry):
+        entry.expire = self._now() + self._max_inactive
+        self._queue.move_to_head(entry)
+        self._push(entry, self._priority(entry))
+
+    def update(self, entry):
+        if entry.cost is not None:
+            self._cost_sum = self._cost_sum + entry.cost
+            self._cost_count = self._cost_count + 1
+        self._push(entry, self._priority(entry))
+
+    def remove(self, entry):
+        self._queue.remove_node(entry)
+        item = entry.policy_state
+        entry.policy_state = None
+        if not item:
+            return
+        item[2] = None
+        # 淘汰的是 victim 返回的条目时，把 L 提高到它的优先级
+        if item is self._victim_item:
+            self._victim_item = None
+            if item[0] > self._inflation:
+                self._inflation = item[0]
+
+    def skip(self, entry):
+        # 把被引用的条目放到最后才会被检查的位置
+        entry.expire = self._now() + self._max_inactive
+        self._queue.move_to_head(entry)
+        self._push(entry, self._max_priority)
+
+    def victim(self):
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        self._victim_item = heap[0]
+        return heap[0][2]
+
+    def oldest(self):
+        return self._queue.peek_last()
+
+    @property
+    def size(self):
+        return self._queue.size
+
+
+def test_eviction_policy():
+    from .entry import Entry
+
+    def keys(policy):
+        return [entry.key for entry in policy._queue.iter()]
+
+    now = lambda: 100
+    lru = LRUPolicy(10, 5, now)
+    entries = [Entry(i) for i in range(4)]
+    for entry in entries:
+        lru.insert(entry)
+    assert keys(lru) == [3, 2, 1, 0] and lru.size == 4
+    assert entries[0].expire == 105
+    lru.touch(entries[0])
+    assert lru.victim() is entries[1]
+    assert lru.oldest() is entries[1]
+    lru.remove(entries[1])
+    assert keys(lru) == [0, 3, 2] and lru.size == 3
+
+    clock = ClockPolicy(10, 5, now)
+    entries = [Entry(i) for i in range(4)]
+    clock.insert_many(entries)
+    assert keys(clock) == [0, 1, 2, 3]
+    # 访问不修改队列
+    clock.touch(entries[3])
+    clock.touch(entries[2])
+    assert keys(clock) == [0, 1, 2, 3]
+    # 被访问过的条目得到第二次机会
+    assert clock.victim() is entries[1]
+    assert keys(clock) == [2, 3, 0, 1]
+    assert entries[2].policy_state == 0
+    clock.remove(entries[1])
+    clock.skip(entries[0])
+    assert clock.victim() is entries[3]
+    # 所有条目都被访问过时，退化为 FIFO
+    for entry in entries:
+        clock.touch(entry)
+    assert clock.oldest() is entries[3]
+    assert clock.size == 3
+
+    def queue_keys(policy, index):
+        return [entry.key for entry in policy._queues[index].iter()]
+
+    # SLRU：再次访问的条目晋升到保护段，先淘汰试用段
+    slru = SLRUPolicy(4, 5, now)
+    entries = [Entry(i) for i in range(4)]
+    for entry in entries:
+        slru.insert(entry)
+    for entry in entries[:3]:
+        slru.touch(entry)
+    # 保护段的容量是 3
+    assert queue_keys(slru, SLRUPolicy.PROTECTED) == [2, 1, 0]
+    assert slru.victim() is entries[3]
+    slru.touch(entries[3])
+    assert queue_keys(slru, SLRUPolicy.PROTECTED) == [3, 2, 1]
+    assert slru.victim() is entries[0]
+    slru.remove(entries[0])
+    assert slru.victim() is entries[1] and slru.size == 3
+
+    # 降级的条目保留原来的过期时间，过期检查先检查它
+    clock_time = [100]
+    slru = SLRUPolicy(2, 5, lambda: clock_time[0])
+    entries = [Entry(i) for i in range(3)]
+    slru.insert(entries[0])
+    slru.touch(entries[0])
+    clock_time[0] = 101
+    slru.insert(entries[1])
+    slru.insert(entries[2])
+    # 保护段的容量是 1，entries[0] 被降级
+    slru.touch(entries[1])
+    assert entries[0].policy_state == SLRUPolicy.DEMOTED
+    assert slru.oldest() is entries[0] and entries[0].expire == 105
+    assert slru.victim() is entries[2]
+    slru.touch(entries[0])
+    assert slru.oldest() is entries[2] and slru.size == 3
+
+    # 2Q：从 A1in 淘汰的 key 再次出现时直接进入 Am
+    two_queue = TwoQueuePolicy(4, 5, now)
+    entries = [Entry(i) for i in range(3)]
+    for entry in entries:
+        two_queue.insert(entry)
+    two_queue.touch(entries[0])
+    assert queue_keys(two_queue, TwoQueuePolicy.A1IN) == [2, 1, 0]
+    assert two_queue.victim() is entries[0]
+    two_queue.remove(entries[0])
+    assert list(two_queue._a1out) == [0]
+    entry = Entry(0)
+    two_queue.insert(entry)
+    assert queue_keys(two_queue, TwoQueuePolicy.AM) == [0]
+    # A1in 没有超过 kin 时从 Am 淘汰
+    two_queue.remove(entries[1])
+    assert two_queue.victim() is entry
+
+    # ARC：B1 中的 key 再次出现时增大 T1 的目标大小
+    arc = ARCPolicy(2, 5, now)
+    entries = [Entry(i) for i in range(3)]
+    arc.insert(entries[0])
+    arc.insert(entries[1])
+    arc.touch(entries[1])
+    assert queue_keys(arc, ARCPolicy.T2) == [1]
+    assert arc.victim() is entries[0]
+    arc.remove(entries[0])
+    assert list(arc._b1) == [0]
+    entry = Entry(0)
+    arc.insert(entry)
+    assert arc._p == 1 and not arc._b1
+    assert queue_keys(arc, ARCPolicy.T2) == [0, 1]
+    assert arc.victim() is entries[1]
+    arc.remove(entries[1])
+    assert list(arc._b2) == [1]
+    # |T1| 没有超过 p 时从 T2 淘汰
+    arc.insert(entries[2])
+    assert arc.victim() is entry and arc.size == 2
+
+    # GDSF：淘汰每字节节省的计算时间最少的条目
+    gdsf = GDSFPolicy(10, 5, now)
+    entries = [Entry(i) for i in range(3)]
+    for entry, size, cost in zip(entries, (2048, 200 << 20, 1024),
+                                 (30, 0.005, 0.001)):
+        gdsf.insert(entry)
+        entry.size = size
+        entry.cost = cost
+        entry.used_count = 1
+        gdsf.update(entry)
+    assert gdsf.victim() is entries[1]
+    gdsf.remove(entries[1])
+    assert gdsf._inflation == 0.005 / (200 << 20)
+    # 访问次数增加，优先级随之提高
+    assert gdsf.victim() is entries[2]
+    entries[2].used_count = 100
+    gdsf.touch(entries[2])
+    assert gdsf.victim() is entries[2]
+    entries[2].used_count = 100000
+    gdsf.touch(entries[2])
+    assert gdsf.victim() is entries[0]
+    # 被引用的条目被跳过
+    gdsf.skip(entries[0])
+    assert gdsf.victim() is entries[2]
+    assert gdsf.oldest() is entries[2] and gdsf.size == 2
+    # 加载的条目按平均代价计算
+    loaded = Entry("loaded")
+    loaded.size = 1
+    gdsf.insert_many([loaded])
+    assert gdsf._priority(loaded) > gdsf._priority(entries[2])
+    # 无效元素太多时重建堆
+    for _ in range(200):
+        gdsf.touch(entries[0])
+    assert len(gdsf._heap) <= 2 * gdsf.size + \
+        GDSFPolicy.COMPACT_THRESHOLD + 1
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_eviction_policy()
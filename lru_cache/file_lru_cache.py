@@ -4,35 +4,147 @@ import logging
 import os.path
 import os
 import shutil
+import stat
+import threading
+import time
 import uuid
 import errno
-
-from .abstract_lru_cache import AbstractLRUCache
+from Queue import Queue, Empty, Full
+
+from .abstract_lru_cache import (
+    AbstractLRUCache,
+    AbstractLRUCacheBuilder,
+    ReturnCode)
+from .shared_index import SharedIndex
+from .lock_table import LockTable
+from .meta_journal import MetaJournal
+from .worker_pool import WorkerPool
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
 
 LOGGER = logging.getLogger(__name__)
 
+# _adopt_peer_result 没有使用其它进程写入的缓存文件
+_NOT_ADOPTED = object()
+
+# 一个第一层目录遍历完了
+_DIRECTORY_DONE = object()
+
+
+class _DirEntry(object):
+    """
+    没有 scandir（Python 2 需要安装 scandir 包）时的替代：
+    os.listdir 之后，每个路径最多调用一次 os.stat
+    """
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def _scan(directory):
+    """
+    返回目录中的条目，目录不存在时返回空列表。条目的类型来自 readdir，
+    只有需要文件大小时才调用 stat
+    """
+    try:
+        if _scandir is not None:
+            return list(_scandir(directory))
+        return [_DirEntry(directory, name)
+                for name in os.listdir(directory)]
+    except OSError as exc:
+        if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+            return []
+        raise
+
 
 class FileLRUCache(AbstractLRUCache):
+    # 共享索引在 base_path 中的文件名，加载时不会被当作不合法的文件删除
+    SHARED_INDEX_NAME = "shared-index"
+    FLIGHT_LOCKS_NAME = "flight-locks"
+    JOURNAL_NAME = "meta-journal"
+    # 其它进程正在加载共享索引时，检查它是否加载完成的间隔
+    SHARED_LOAD_POLL_INTERVAL = 0.1
+
     def __init__(self, base_path, levels,
                  load_max_files, load_interval,
                  *args, **kwargs):
+        shared_index_slots = kwargs.pop("shared_index_slots", None)
+        flight_lock_slots = kwargs.pop("flight_lock_slots", None)
+        snapshot_interval = kwargs.pop("snapshot_interval", None)
+        load_threads = kwargs.pop("load_threads", 1)
+        load_queue_size = kwargs.pop("load_queue_size", 8)
         AbstractLRUCache.__init__(self, *args, **kwargs)
         self._temp_file_prefix = "temp-file"
         self._base_path = base_path
+        # 多个进程共享的索引：持有管理租约的进程加载缓存、按共享的总大小淘汰缓存文件；
+        # 每个进程本地的元数据只是共享索引的视图，淘汰本地的元数据时不删除缓存文件
+        self._shared_index = None
+        self._reserved_paths = set()
+        self._shared_evicting = False
+        if shared_index_slots is not None:
+            self._shared_index = SharedIndex(
+                os.path.join(base_path, self.SHARED_INDEX_NAME),
+                shared_index_slots)
+            self._reserved_paths.update(self._shared_index.paths)
+        # 多个进程之间的 single-flight：未命中的 key 只由一个进程计算，
+        # 其它进程等它写入缓存文件之后直接读取
+        self._flight_locks = None
+        if flight_lock_slots is not None:
+            self._flight_locks = LockTable(
+                os.path.join(base_path, self.FLIGHT_LOCKS_NAME),
+                flight_lock_slots)
+            self._reserved_paths.add(self._flight_locks.path)
+        # 元数据的快照和日志：重启时从快照和日志恢复元数据（包括淘汰顺序、
+        # 访问次数和过期时间），快照不存在或者不一致时才遍历目录
+        self._journal = None
+        self._snapshot_interval = snapshot_interval
+        self._next_snapshot_at = None
+        if snapshot_interval is not None:
+            self._journal = MetaJournal(
+                os.path.join(base_path, self.JOURNAL_NAME))
+            self._reserved_paths.add(self._journal.path)
         self._levels = self._generate_levels(levels)
+        # 每一层目录名在 key 中的切片，以及以分隔符结尾的 base_path，
+        # 生成路径时不需要再计算下标、调用 os.path.join
+        self._level_slices = []
+        end = 0
+        for level in self._levels:
+            self._level_slices.append(slice(end - level, end or None))
+            end = end - level
+        self._path_prefix = os.path.join(base_path, "")
+        # 加载时每 load_interval 秒的 I/O 预算是 load_max_files 个文件，
+        # load_interval 为 0 时不限制
         self._load_max_files = load_max_files
         self._load_interval = load_interval
+        # 并行遍历第一层目录的线程数，以及等待添加元数据的批数
+        self._load_threads = load_threads
+        self._load_queue_size = load_queue_size
 
     def _generate_path(self, key, only_dir_part=False):
-        dir_names = []
-        end = len(key)
-        for level in self._levels:
-            start = end - level
-            dir_names.append(key[start:end])
-            end = start
+        dir_names = [key[level_slice] for level_slice in self._level_slices]
         if not only_dir_part:
             dir_names.append(key)
-        return os.path.join(self._base_path, *dir_names)
+        return self._path_prefix + os.sep.join(dir_names)
 
     @staticmethod
     def _generate_levels(levels):
@@ -71,28 +183,38 @@ class FileLRUCache(AbstractLRUCache):
                 return False
         return True
 
+    def _subdirectories(self, base_directory, level):
+        """
+        删除 base_directory 中的文件和名字不合法的目录，返回第 level 层的目录
+        """
+        directories = []
+        for entry in _scan(base_directory):
+            path = entry.path
+            if path in self._reserved_paths:
+                continue
+            if not entry.is_dir():
+                self.safe_remove_file(path)
+                continue
+            if not self.is_valid_dir_name(
+                    entry.name, self._levels[level-1]):
+                self.safe_remove_dir(path)
+                continue
+            directories.append(path)
+        return directories
+
     def _walk(self, base_directory, level, max_levels):
-        if not os.path.isdir(base_directory):
-            return
         if level < 1:
             raise RuntimeError("level must be more than 1")
         if level <= max_levels:
-            for name in os.listdir(base_directory):
-                path = os.path.join(base_directory, name)
-                if os.path.isfile(path):
-                    self.safe_remove_file(path)
-                    continue
-                if not self.is_valid_dir_name(
-                        name, self._levels[level-1]):
-                    self.safe_remove_dir(path)
-                    continue
+            for path in self._subdirectories(base_directory, level):
                 for file_path, name, size in \
                         self._walk(path, level+1, max_levels):
                     yield file_path, name, size
         elif level == max_levels + 1:
-            for name in os.listdir(base_directory):
-                path = os.path.join(base_directory, name)
-                if os.path.isdir(path):
+            for entry in _scan(base_directory):
+                name = entry.name
+                path = entry.path
+                if entry.is_dir():
                     self.safe_remove_dir(path)
                     continue
                 if name.startswith(self._temp_file_prefix):
@@ -102,32 +224,191 @@ class FileLRUCache(AbstractLRUCache):
                     self.safe_remove_file(path)
                     continue
                 try:
-                    size = os.stat(path).st_size
+                    size = entry.stat().st_size
                 except (IOError, OSError):
                     LOGGER.error("fail to stat %s", path, exc_info=True)
                     continue
                 yield path, name, size
 
+    def _walk_parallel(self):
+        """
+        在 load_threads 个线程中并行遍历第一层的目录，每 load_max_files 个文件
+        作为一批放入最多 load_queue_size 批的有界队列，按批返回。
+        队列满时遍历的线程等待，添加元数据的速度决定了遍历的速度
+        """
+        directories = self._subdirectories(self._base_path, 1)
+        if not directories:
+            return
+        results = Queue(self._load_queue_size)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def walk(paths):
+            for path in paths:
+                if stopped.is_set():
+                    return
+                try:
+                    batch = []
+                    for item in self._walk(path, 2, len(self._levels)):
+                        if stopped.is_set():
+                            return
+                        batch.append(item)
+                        if len(batch) >= self._load_max_files:
+                            if not put(batch):
+                                return
+                            batch = []
+                    if batch:
+                        put(batch)
+                except:
+                    LOGGER.error("fail to walk %s", path, exc_info=True)
+                finally:
+                    put(_DIRECTORY_DONE)
+
+        pool = WorkerPool("loader-of-%s" % self.name,
+                          min(self._load_threads, len(directories)),
+                          len(directories), 1, walk)
+        for path in directories:
+            pool.submit(path)
+        pool.start()
+        try:
+            remaining = len(directories)
+            while remaining > 0:
+                batch = results.get()
+                if batch is _DIRECTORY_DONE:
+                    remaining = remaining - 1
+                else:
+                    yield batch
+        finally:
+            stopped.set()
+            # 提前结束时，让阻塞在队列上的线程退出
+            while True:
+                try:
+                    results.get_nowait()
+                except Empty:
+                    break
+            pool.stop()
+
+    def _load_wait_time(self, start_time, loaded):
+        """
+        按照每 load_interval 秒 load_max_files 个文件的 I/O 预算，
+        已经加载了 loaded 个文件时还需要等待的时间
+        """
+        if self._load_interval <= 0:
+            return 0
+        expected = float(loaded) * self._load_interval / \
+            self._load_max_files
+        return max(0, start_time + expected - time.time())
+
+    def _add_metas(self, batch):
+        rejected = self.add_metas(
+            (name, size) for _, name, size in batch)
+        LOGGER.debug("add meta for %d files",
+                     len(batch) - len(rejected))
+        rejected = set(rejected)
+        if self._shared_index is not None:
+            rejected.update(self._shared_index.put_many(
+                [(name, size) for _, name, size in batch
+                 if name not in rejected]))
+        if rejected:
+            for file_path, name, _ in batch:
+                if name in rejected:
+                    LOGGER.debug("fail to add meta for %s", name)
+                    self.safe_remove_file(file_path)
+
     def load(self):
         """
-        加载缓存。该过程中会清理临时文件和不合法的目录、文件
+        加载缓存。该过程中会清理临时文件和不合法的目录、文件。
+        多个线程并行遍历第一层的目录，每 load_max_files 个文件作为一批添加元数据，
+        加载的速度不超过 I/O 预算，全部加载完后再建立索引。
+        使用共享索引时，只有拿到管理租约的进程加载，其它进程按需从共享索引中查找；
+        其它进程等到共享索引加载完成之后才可以使用，否则加载时会删除它们正在写入的
+        临时文件。管理进程在加载完成之前退出时，由等待的进程接替加载。
+        使用元数据日志时，先从快照和日志恢复，失败时才遍历目录
         """
-        count = 0
-        for file_path, name, size in \
-                self._walk(self._base_path, 1, len(self._levels)):
-            if self.add_meta(name, size):
-                LOGGER.debug("add meta for %s", name)
+        if self._journal is not None:
+            if not self._journal.acquire_lease():
+                LOGGER.info("journal in %s is used by another process",
+                            self._base_path)
+                self._journal = None
             else:
-                LOGGER.debug("fail to add meta for %s", name)
-                self.safe_remove_file(file_path)
-            count = count + 1
-            if count >= self._load_max_files:
-                LOGGER.debug(
-                    "load_max_files reached, "
-                    "wait for %fs",
-                    self._load_interval)
-                yield self._load_interval
-                count = 0
+                records = self._journal.read(self._journal_tag())
+                self._journal.start()
+                if records is not None:
+                    self._restore(records)
+                    return
+                LOGGER.info("snapshot of %s is missing or inconsistent, "
+                            "walk %s", self.name, self._base_path)
+        if self._shared_index is not None:
+            while not self._shared_index.acquire_lease():
+                if self._shared_index.is_loaded():
+                    LOGGER.info("%s uses the shared index loaded by "
+                                "another process", self.name)
+                    return
+                yield self.SHARED_LOAD_POLL_INTERVAL
+            if self._shared_index.is_loaded():
+                # 之前的管理进程已经加载完成，索引由所有进程维护
+                return
+            self._shared_index.clear()
+        self.begin_bulk_load()
+        batches = self._walk_parallel()
+        try:
+            start_time = time.time()
+            loaded = 0
+            for batch in batches:
+                self._add_metas(batch)
+                loaded = loaded + len(batch)
+                wait_time = self._load_wait_time(start_time, loaded)
+                if wait_time > 0:
+                    LOGGER.debug("%d files are loaded, wait for %fs "
+                                 "to keep the I/O budget", loaded, wait_time)
+                yield wait_time
+        finally:
+            batches.close()
+            self.end_bulk_load()
+        if self._shared_index is not None:
+            self._shared_index.set_loaded()
+        if self._journal is not None:
+            self._save_snapshot()
+
+    def _journal_tag(self):
+        # 快照只对相同的目录层次有效
+        return ":".join(map(str, self._levels))
+
+    def _restore(self, records):
+        rejected = self.restore_metas(records)
+        for key in rejected:
+            LOGGER.debug("fail to restore meta for %s", key)
+            self.safe_remove_file(self._generate_path(key))
+        LOGGER.info("restore meta for %d files of %s",
+                    len(records) - len(rejected), self.name)
+        # 之前的快照和日志仍然有效，下一次保存快照时再合并
+        self._next_snapshot_at = time.time() + self._snapshot_interval
+
+    def _save_snapshot(self):
+        """
+        收集元数据和切换日志在同一次持有锁时完成，写快照时不持有锁
+        """
+        with self._lock:
+            records = self._dump_metas()
+            generation = self._journal.rotate()
+        records.sort(key=lambda record: record[3])
+        self._journal.save(generation, self._journal_tag(), records)
+        self._next_snapshot_at = time.time() + self._snapshot_interval
+        LOGGER.debug("save snapshot of %d files for %s",
+                     len(records), self.name)
+
+    def _journal_put(self, items):
+        if self._journal is not None:
+            now = time.time()
+            self._journal.put_many(items, now, self._loaded_deadline(now))
 
     def write_cache(self, key, data):
         if not self._is_valid_key(key):
@@ -154,6 +435,8 @@ class FileLRUCache(AbstractLRUCache):
             fd.write(data)
         LOGGER.debug("rename %s to %s" % (temp_path, path))
         os.rename(temp_path, path)
+        self._share([(key, len(data))])
+        self._journal_put([(key, len(data))])
 
     def read_cache(self, key):
         if not self._is_valid_key(key):
@@ -164,17 +447,76 @@ class FileLRUCache(AbstractLRUCache):
         LOGGER.debug("read cache for %s" % key)
         path = self._generate_path(key)
         if not os.path.isfile(path):
-            LOGGER.error("%s is not file" % path)
+            if self._shared_index is None:
+                LOGGER.error("%s is not file" % path)
+            self._unshare(key)
             raise KeyError(key)
         if not os.access(path, os.R_OK):
             LOGGER.error("permission denied for %s" % path)
             raise KeyError(key)
         try:
             with open(path) as fd:
-                return fd.read()
+                data = fd.read()
         except (IOError, OSError):
             LOGGER.error("fail to read %s", path, exc_info=True)
-        raise KeyError(key)
+            raise KeyError(key)
+        if self._shared_index is not None:
+            self._shared_index.touch_many([key])
+        return data
+
+    def read_cache_many(self, keys):
+        """
+        不预先检查文件是否存在、是否可读，每个 key 只打开一次文件
+        """
+        result = {}
+        for key in keys:
+            if not self._is_valid_key(key):
+                LOGGER.error("invalid key %s" % key)
+                continue
+            path = self._generate_path(key)
+            try:
+                with open(path) as fd:
+                    result[key] = fd.read()
+            except (IOError, OSError) as exc:
+                if exc.errno != errno.ENOENT:
+                    LOGGER.error("fail to read %s", path, exc_info=True)
+                else:
+                    self._unshare(key)
+        if self._shared_index is not None and result:
+            self._shared_index.touch_many(result.keys())
+        return result
+
+    def write_cache_many(self, items):
+        """
+        同一个目录中的文件只创建一次目录
+        """
+        for key, _ in items:
+            if not self._is_valid_key(key):
+                message = "invalid key %s" % key
+                LOGGER.error(message)
+                raise RuntimeError(message)
+
+        dir_parts = set()
+        for key, data in items:
+            dir_part = self._generate_path(key, True)
+            if dir_part not in dir_parts:
+                try:
+                    os.makedirs(dir_part)
+                except OSError as exc:
+                    if exc.errno != errno.EEXIST:
+                        raise
+                dir_parts.add(dir_part)
+            temp_path = os.path.join(
+                dir_part,
+                "%s-%s-%s" % (self._temp_file_prefix,
+                              key,
+                              uuid.uuid1().hex))
+            with open(temp_path, "wb") as fd:
+                fd.write(data)
+            os.rename(temp_path, os.path.join(dir_part, key))
+        sizes = [(key, len(data)) for key, data in items]
+        self._share(sizes)
+        self._journal_put(sizes)
 
     def delete_cache(self, key):
         if not self._is_valid_key(key):
@@ -182,15 +524,18 @@ class FileLRUCache(AbstractLRUCache):
             return
 
         LOGGER.debug("delete cache for %s" % key)
+        self._unshare(key)
+        if self._journal is not None:
+            self._journal.remove(key)
         path = self._generate_path(key)
-        if not os.path.isfile(path):
-            LOGGER.error("%s is not file" % path)
-            return
-        if not os.access(path, os.W_OK):
-            LOGGER.error("permission denied for %s" % path)
-            return
-
-        self.safe_remove_file(path)
+        # 直接删除，由错误码区分文件不存在，每个条目只需要一次系统调用
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                LOGGER.error("%s is not file" % path)
+            else:
+                LOGGER.error("fail to remove %s", path, exc_info=True)
 
     def _is_valid_key(self, key):
         if isinstance(key, unicode):
@@ -204,34 +549,210 @@ class FileLRUCache(AbstractLRUCache):
             return False
         if len(key) < sum(self._levels):
             return False
+        if self._shared_index is not None and \
+                len(key) > SharedIndex.KEY_SIZE:
+            return False
         return True
 
+    def _share(self, items):
+        """
+        把写入的缓存文件加入共享索引。共享索引满了时删除这些文件，写入失败
+        """
+        if self._shared_index is None:
+            return
+        rejected = self._shared_index.put_many(items)
+        if rejected:
+            for key in rejected:
+                self.safe_remove_file(self._generate_path(key))
+            raise RuntimeError("shared index is full")
+
+    def _unshare(self, key):
+        if self._shared_index is not None:
+            self._shared_index.remove(key)
+
+    def _is_shared(self, key):
+        # 共享索引的管理进程按共享的总大小淘汰缓存文件，
+        # 其它进程本地的元数据中仍然有这些 key
+        return self._shared_index is not None
+
+    def _find_meta(self, key):
+        if self._shared_index is None or not self._is_valid_key(key):
+            return None
+        return self._shared_index.get(key)
+
+    def _call_func_and_write_cache(
+            self, key,
+            serializer, func,
+            *args, **kwargs):
+        if self._flight_locks is None or not self._is_valid_key(key):
+            return AbstractLRUCache._call_func_and_write_cache(
+                self, key, serializer, func, *args, **kwargs)
+        path = self._generate_path(key)
+        slot = self._flight_locks.acquire(
+            key, self._lock_age * self._wait_count)
+        try:
+            if slot is not None:
+                ret = self._adopt_peer_result(key, serializer, path)
+                if ret is not _NOT_ADOPTED:
+                    return ret
+            ret = AbstractLRUCache._call_func_and_write_cache(
+                self, key, serializer, func, *args, **kwargs)
+        finally:
+            if slot is not None:
+                self._flight_locks.release(slot)
+        # 记录自己写入的文件，过期之后重新计算时不会被当作其它进程的结果
+        identity = self._file_identity(path)
+        with self._lock:
+            entry = self._map.get(key)
+            if entry is not None and entry.is_usable():
+                entry.data_identity = identity
+        return ret
+
+    @staticmethod
+    def _file_identity(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime
+
+    def _adopt_peer_result(self, key, serializer, path):
+        """
+        缓存文件不是这个进程最近写入或者读取的那个（inode 或者 mtime 不同），
+        说明是其它进程写入的，没有按 ttl 过期时直接使用，不再计算。
+        否则返回 _NOT_ADOPTED。过期时间从文件的 mtime 开始计算；
+        条目的大小和写入时一样由 serializer 计算，日志中记录文件的大小
+        """
+        identity = self._file_identity(path)
+        if identity is None:
+            return _NOT_ADOPTED
+        with self._lock:
+            if identity == self._map[key].data_identity:
+                return _NOT_ADOPTED
+        try:
+            with open(path) as fd:
+                data = fd.read()
+            ret = serializer.loads(data)
+            size = serializer.dumps(ret)[0]
+        except:
+            LOGGER.error("fail to read %s written by another process",
+                         path, exc_info=True)
+            return _NOT_ADOPTED
+        deadline = self._deadline(ret)
+        if deadline is not None:
+            deadline = deadline - (self._now() - identity[1])
+            if deadline <= self._now():
+                return _NOT_ADOPTED
+        with self._lock:
+            entry = self._map[key]
+            entry.decr_ref_count()
+            self._finish_update(entry, ret, size, None, None)
+            entry.deadline = deadline
+            entry.data_identity = identity
+        self._journal_put([(key, len(data))])
+        return ret
+
+    def _delete_caches(self, entries):
+        # 使用共享索引时，本地的元数据被淘汰、过期时只是从视图中移除，
+        # 缓存文件由管理进程按共享的总大小淘汰
+        if self._shared_index is None:
+            AbstractLRUCache._delete_caches(self, entries)
+
+    def purge(self, key):
+        rc = AbstractLRUCache.purge(self, key)
+        if self._shared_index is None or \
+                rc & ReturnCode.ERROR_KEY_UPDATING:
+            return rc
+        if rc & ReturnCode.ERROR_KEY_NOT_EXISTS and \
+                self._find_meta(key) is None:
+            return rc
+        self.delete_cache(key)
+        return ReturnCode.OK
+
+    def purge_prefix(self, prefix):
+        count = AbstractLRUCache.purge_prefix(self, prefix)
+        if self._shared_index is None:
+            return count
+        # 其它进程缓存的文件不在本地的元数据中
+        keys = self._shared_index.keys_with_prefix(prefix)
+        for key in keys:
+            self.delete_cache(key)
+        return max(count, len(keys))
+
+    def manage(self):
+        for wait_time in AbstractLRUCache.manage(self):
+            if wait_time and self._shared_index is not None and \
+                    self._shared_index.acquire_lease():
+                while self._evict_shared():
+                    yield 0
+            if wait_time and self._journal is not None and \
+                    time.time() >= self._next_snapshot_at:
+                self._save_snapshot()
+            yield wait_time
+
+    def _evict_shared(self):
+        """
+        只在持有管理租约的进程中执行：共享的总大小或者条目数超过高水位之后，
+        每次用 CLOCK 淘汰 purge_batch_size 个缓存文件，直到低于低水位。
+        返回是否需要继续淘汰
+        """
+        size, count = self._shared_index.totals()
+        above_low_watermark = size > self._low_size or \
+            count > self._low_entry_count
+        if not self._shared_evicting and \
+                size <= self._high_size and \
+                count <= self._high_entry_count:
+            return False
+        self._shared_evicting = above_low_watermark
+        if not above_low_watermark:
+            return False
+        evicted = self._shared_index.evict(self._purge_batch_size)
+        for key, _ in evicted:
+            try:
+                os.remove(self._generate_path(key))
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    LOGGER.error("fail to remove cache of %s", key,
+                                 exc_info=True)
+        LOGGER.debug("evict %d files by the shared index", len(evicted))
+        return len(evicted) > 0
+
     def prepare(self):
         LOGGER.debug("preparing FileLRUCache")
+        if self._shared_index is not None:
+            self._shared_index.open()
+        if self._flight_locks is not None:
+            self._flight_locks.open()
 
     def finalize(self):
+        if self._journal is not None:
+            # 加载完成之后才有完整的元数据，正常停止时保存最后的快照
+            if self._next_snapshot_at is not None:
+                try:
+                    self._save_snapshot()
+                except:
+                    LOGGER.error("fail to save snapshot of %s", self.name,
+                                 exc_info=True)
+            self._journal.close()
+        if self._shared_index is not None:
+            self._shared_index.close()
+        if self._flight_locks is not None:
+            self._flight_locks.close()
         LOGGER.debug("FileLRUCache is finalized")
 
 
-class FileLRUCacheBuilder(object):
+class FileLRUCacheBuilder(AbstractLRUCacheBuilder):
     def __init__(self):
-        self._name = None
+        AbstractLRUCacheBuilder.__init__(self)
         self._base_path = None
         self._levels = "1:2"
         self._load_max_files = 10000
         self._load_interval = 0.01
-        self._max_entry_count = None
-        self._max_size = None
-        self._min_uses = 1
-        self._max_inactive = 24 * 60 * 60
-        self._lock_age = 0.4
-        self._wait_count = 5
-        self._expire_interval = 10
-        self._forced_expire_interval = 1
-
-    def with_name(self, name):
-        self._name = name
-        return self
+        self._shared_index_slots = None
+        self._flight_lock_slots = None
+        self._snapshot_interval = None
+        self._load_threads = 1
+        self._load_queue_size = 8
 
     def with_base_path(self, base_path):
         self._base_path = base_path
@@ -249,39 +770,57 @@ class FileLRUCacheBuilder(object):
         self._load_interval = load_interval
         return self
 
-    def with_max_entry_count(self, max_entry_count):
-        self._max_entry_count = max_entry_count
-        return self
-
-    def with_max_size(self, max_size):
-        self._max_size = max_size
-        return self
-
-    def with_min_uses(self, min_uses):
-        self._min_uses = min_uses
-        return self
-
-    def with_max_inactive(self, max_inactive):
-        self._max_inactive = max_inactive
+    def with_load_budget(self, max_files, interval):
+        """
+        加载时的 I/O 预算：每 interval 秒最多遍历 max_files 个文件，
+        interval 为 0 时尽快加载。max_files 同时是添加元数据的批大小
+        """
+        self._load_max_files = max_files
+        self._load_interval = interval
         return self
 
-    def with_lock_age(self, lock_age):
-        self._lock_age = lock_age
+    def with_load_threads(self, load_threads, load_queue_size=8):
+        """
+        加载时用 load_threads 个线程并行遍历第一层的目录，
+        最多 load_queue_size 批文件等待添加元数据
+        """
+        self._load_threads = load_threads
+        self._load_queue_size = load_queue_size
         return self
 
-    def with_wait_count(self, wait_count):
-        self._wait_count = wait_count
+    def with_shared_index(self, shared_index=True, slot_count=None):
+        """
+        同一个 base_path 上的多个进程（比如 pre-fork 的工作进程）共享一个索引、
+        一个容量限制和一个淘汰缓存文件的管理进程。必须在 fork 之后 start。
+        slot_count 是共享索引的槽位数，默认是 max_entry_count 的两倍
+        """
+        self._shared_index_slots = None
+        if shared_index:
+            self._shared_index_slots = slot_count or 0
         return self
 
-    def with_expire_interval(self, expire_interval):
-        self._expire_interval = expire_interval
+    def with_process_flight(self, process_flight=True, slot_count=4096):
+        """
+        同一个 base_path 上的多个进程之间的 single-flight：key 散列到
+        base_path/flight-locks 中 slot_count 个字节锁中的一个，未命中时只有
+        拿到锁的进程计算，其它进程最多等待 lock_age * wait_count 秒，
+        然后直接读取它写入的缓存文件。必须在 fork 之后 start
+        """
+        self._flight_lock_slots = None
+        if process_flight:
+            self._flight_lock_slots = slot_count
         return self
 
-    def with_forced_expire_interval(
-            self,
-            forced_expire_interval):
-        self._forced_expire_interval = \
-            forced_expire_interval
+    def with_journal(self, journal=True, snapshot_interval=300):
+        """
+        把元数据的快照和写入、删除缓存文件的日志保存在 base_path/meta-journal 中，
+        每 snapshot_interval 秒以及正常停止时保存一次快照。
+        重启时从快照和日志恢复元数据，不需要遍历目录。
+        同一个 base_path 只能有一个进程写日志，不能和共享索引一起使用
+        """
+        self._snapshot_interval = None
+        if journal:
+            self._snapshot_interval = snapshot_interval
         return self
 
     def build(self):
@@ -293,34 +832,28 @@ class FileLRUCacheBuilder(object):
             raise RuntimeError("missing load_max_files")
         if self._load_interval is None:
             raise RuntimeError("missing load_interval")
-        if self._max_entry_count is None:
-            raise RuntimeError("missing max_entry_count")
-        if self._max_size is None:
-            raise RuntimeError("missing max_size")
-        if self._min_uses is None:
-            raise RuntimeError("missing min_uses")
-        if self._max_inactive is None:
-            raise RuntimeError("missing max_inactive")
-        if self._lock_age is None:
-            raise RuntimeError("missing lock_age")
-        if self._wait_count is None:
-            raise RuntimeError("missing wait_count")
-        if self._expire_interval is None:
-            raise RuntimeError("missing expire_interval")
-        if self._forced_expire_interval is None:
-            raise RuntimeError("missing forced_expire_interval")
-
+        if self._load_threads < 1 or self._load_queue_size < 1:
+            raise RuntimeError(
+                "load_threads and load_queue_size must be positive")
+        if self._snapshot_interval is not None and \
+                self._shared_index_slots is not None:
+            raise RuntimeError("journal can not be used with shared index")
+        self._check()
+
+        kwargs = self._lru_cache_kwargs()
+        if self._shared_index_slots is not None:
+            kwargs["shared_index_slots"] = \
+                self._shared_index_slots or self._max_entry_count * 2
+        if self._flight_lock_slots is not None:
+            kwargs["flight_lock_slots"] = self._flight_lock_slots
+        if self._snapshot_interval is not None:
+            kwargs["snapshot_interval"] = self._snapshot_interval
+        kwargs["load_threads"] = self._load_threads
+        kwargs["load_queue_size"] = self._load_queue_size
         return FileLRUCache(
             self._base_path,
             self._levels,
             self._load_max_files,
             self._load_interval,
-            self._name,
-            self._max_entry_count,
-            self._max_size,
-            self._min_uses,
-            self._max_inactive,
-            self._lock_age,
-            self._wait_count,
-            self._expire_interval,
-            self._forced_expire_interval)
+            *self._lru_cache_args(),
+            **kwargs)
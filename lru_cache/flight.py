@@ -0,0 +1,171 @@
+# coding: utf8
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class Waiter(object):
+    """
+    一个等待者。wait 阻塞在一把锁上（不轮询），notify 立即唤醒它。
+    notify 可能被调用多次（比如结果就绪和超时同时发生），只有第一次有效
+    """
+    __slots__ = ("_lock", "woken")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lock.acquire()
+        self.woken = False
+
+    def wait(self):
+        self._lock.acquire()
+        self.woken = True
+
+    def notify(self):
+        try:
+            self._lock.release()
+        except threading.ThreadError:
+            pass
+
+
+class WaiterTimer(object):
+    """
+    到期时唤醒还在等待的 Waiter，所有等待者共用一个守护线程。
+    Python 2 的带超时的 Condition.wait 是靠 sleep 轮询实现的，
+    这样等待者只需要不带超时地阻塞，结果就绪时能够立即被唤醒
+    """
+    # 有未到期的等待者时，定时线程的最大睡眠时间
+    MAX_SLEEP = 0.005
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = threading.Lock()
+        self._wakeup.acquire()
+        self._thread = None
+
+    def schedule(self, deadline, waiter):
+        with self._lock:
+            heapq.heappush(self._heap,
+                           (deadline, next(self._counter), waiter))
+            # fork 之后子进程中的定时线程已经不存在了
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._main,
+                    name="waiter-timer")
+                self._thread.setDaemon(True)
+                self._thread.start()
+        try:
+            self._wakeup.release()
+        except threading.ThreadError:
+            pass
+
+    def _main(self):
+        while True:
+            with self._lock:
+                heap = self._heap
+                now = time.time()
+                while heap and (heap[0][0] <= now or heap[0][2].woken):
+                    _, _, waiter = heapq.heappop(heap)
+                    if not waiter.woken:
+                        waiter.notify()
+                timeout = None
+                if heap:
+                    timeout = heap[0][0] - now
+            if timeout is None:
+                self._wakeup.acquire()
+            else:
+                time.sleep(min(timeout, self.MAX_SLEEP))
+
+
+TIMER = WaiterTimer()
+
+
+class Flight(object):
+    """
+    一次回源计算（single-flight）。等待计算完成的线程在 finish 时立即被唤醒，
+    并直接拿到计算结果，不需要再从存储介质中读取、反序列化。
+    所有方法都必须在持有缓存的锁时调用
+    """
+    __slots__ = ("_waiters", "done", "success", "value")
+
+    def __init__(self):
+        self._waiters = []
+        self.done = False
+        self.success = False
+        self.value = None
+
+    def wait(self, lock, timeout):
+        """
+        等待期间释放 lock，返回计算是否已经完成。timeout 为 None 或负数时不限时
+        """
+        if self.done:
+            return True
+        waiter = Waiter()
+        self._waiters.append(waiter)
+        if timeout is not None and timeout >= 0:
+            TIMER.schedule(time.time() + timeout, waiter)
+        lock.release()
+        try:
+            waiter.wait()
+        finally:
+            lock.acquire()
+        if not self.done:
+            self._waiters.remove(waiter)
+        return self.done
+
+    def finish(self, success, value=None):
+        self.done = True
+        self.success = success
+        self.value = value
+        waiters = self._waiters
+        self._waiters = []
+        for waiter in waiters:
+            waiter.notify()
+
+
+def test_flight():
+    lock = threading.Lock()
+    results = []
+
+    def wait(flight, timeout):
+        with lock:
+            start_time = time.time()
+            done = flight.wait(lock, timeout)
+            results.append((done, flight.value,
+                            time.time() - start_time))
+
+    # 结果就绪时立即唤醒所有等待者
+    flight = Flight()
+    threads = [threading.Thread(target=wait, args=(flight, 5))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    with lock:
+        flight.finish(True, "value")
+    for thread in threads:
+        thread.join()
+    assert len(results) == 10
+    for done, value, time_used in results:
+        assert done and value == "value"
+        assert time_used < 0.2, time_used
+
+    # 超时
+    del results[:]
+    flight = Flight()
+    wait(flight, 0.05)
+    done, value, time_used = results[0]
+    assert not done and value is None
+    assert 0.05 <= time_used < 0.1, time_used
+    with lock:
+        flight.finish(False)
+        assert flight.wait(lock, 0)
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_flight()
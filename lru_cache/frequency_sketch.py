@@ -0,0 +1,119 @@
+# coding: utf8
+
+# 计数器减半的转换表
+_HALF = bytes(bytearray(i >> 1 for i in range(256)))
+
+
+class FrequencySketch(object):
+    """
+    TinyLFU 使用的访问频率估计：一个计数器最大为 15 的 count-min sketch，
+    前面加上一个布隆过滤器（doorkeeper）。key 第一次出现时只记录在
+    doorkeeper 中，再次出现才增加 sketch 中的计数，只访问一次的 key
+    不会占用计数器。每记录 sample_factor 倍于计数器宽度次的访问，所有计数器
+    减半、doorkeeper 清空，让频率随时间衰减。
+    占用的内存只和 capacity 有关，和出现过的 key 的个数无关
+    """
+    DEPTH = 4
+    MAX_COUNT = 15
+    # 容量很小时计数器冲突太多，宽度至少是 MIN_WIDTH
+    MIN_WIDTH = 256
+
+    def __init__(self, capacity, sample_factor=10):
+        width = self.MIN_WIDTH
+        while width < capacity:
+            width = width << 1
+        self._mask = width - 1
+        self._table = bytearray(self.DEPTH * width)
+        # doorkeeper 共有 width * 8 位
+        self._doorkeeper = bytearray(width)
+        self._doorkeeper_mask = width * 8 - 1
+        self._sample_size = sample_factor * width
+        self._additions = 0
+
+    @staticmethod
+    def _hash(key):
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return h, (h >> 32) | 1
+
+    def _indexes(self, h, h2):
+        mask = self._mask
+        width = mask + 1
+        return [row * width + ((h + row * h2) & mask)
+                for row in range(self.DEPTH)]
+
+    def _doorkeeper_bits(self, h, h2):
+        mask = self._doorkeeper_mask
+        return (h >> 7) & mask, ((h >> 7) + h2) & mask
+
+    def increment(self, key):
+        h, h2 = self._hash(key)
+        doorkeeper = self._doorkeeper
+        found = True
+        for bit in self._doorkeeper_bits(h, h2):
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not doorkeeper[byte] & mask:
+                doorkeeper[byte] = doorkeeper[byte] | mask
+                found = False
+        if found:
+            # 保守更新：只增加最小的计数器
+            table = self._table
+            indexes = self._indexes(h, h2)
+            count = min(table[index] for index in indexes)
+            if count < self.MAX_COUNT:
+                for index in indexes:
+                    if table[index] == count:
+                        table[index] = count + 1
+        self._additions = self._additions + 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def frequency(self, key):
+        h, h2 = self._hash(key)
+        table = self._table
+        count = min(table[index] for index in self._indexes(h, h2))
+        doorkeeper = self._doorkeeper
+        for bit in self._doorkeeper_bits(h, h2):
+            if not doorkeeper[bit >> 3] & (1 << (bit & 7)):
+                return count
+        return count + 1
+
+    def _reset(self):
+        self._table = bytearray(bytes(self._table).translate(_HALF))
+        self._doorkeeper = bytearray(len(self._doorkeeper))
+        self._additions = self._additions // 2
+
+
+def test_frequency_sketch():
+    sketch = FrequencySketch(64)
+    assert sketch.frequency("a") == 0
+    sketch.increment("a")
+    assert sketch.frequency("a") == 1
+    for _ in range(5):
+        sketch.increment("a")
+    assert sketch.frequency("a") == 6
+    for _ in range(100):
+        sketch.increment("a")
+    assert sketch.frequency("a") == 1 + FrequencySketch.MAX_COUNT
+    for i in range(10):
+        sketch.increment(i)
+    assert sketch.frequency("b") <= 1
+    assert sketch.frequency(3) >= 1
+
+    # 衰减
+    sketch = FrequencySketch(4, sample_factor=1)
+    for _ in range(7):
+        sketch.increment("a")
+    assert sketch.frequency("a") == 7
+    # 第 MIN_WIDTH 次访问时计数器减半，doorkeeper 被清空
+    for i in range(FrequencySketch.MIN_WIDTH - 7):
+        sketch.increment("b")
+    assert sketch.frequency("a") == 3
+    assert sketch.frequency("b") == FrequencySketch.MAX_COUNT // 2
+    sketch.increment("a")
+    assert sketch.frequency("a") == 4
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_frequency_sketch()
@@ -0,0 +1,156 @@
+# coding: utf8
+
+import logging
+import sys
+import threading
+
+from .worker_pool import WorkerPool
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Future(object):
+    """
+    一个异步计算的结果。完成时按注册的顺序调用回调函数，
+    回调函数在完成计算的线程中执行；已经完成时，注册的回调函数立即执行
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def add_done_callback(self, callback):
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        self._invoke(callback)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exc_info):
+        """exc_info 是 sys.exc_info() 的返回值，保留原来的调用栈"""
+        self._finish(None, exc_info)
+
+    def _finish(self, result, exc_info):
+        with self._condition:
+            if self._done:
+                raise RuntimeError("future is already done")
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._condition.notify_all()
+        for callback in callbacks:
+            self._invoke(callback)
+
+    def _invoke(self, callback):
+        try:
+            callback(self)
+        except:
+            LOGGER.error("fail to invoke callback of future",
+                         exc_info=True)
+
+    def exception(self):
+        """完成之后返回 exc_info，成功时返回 None"""
+        return self._exc_info
+
+    def result(self, timeout=None):
+        """
+        阻塞直到完成。事件循环中应该使用 add_done_callback，而不是调用这个方法
+        """
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise RuntimeError("timeout")
+        if self._exc_info is not None:
+            exc_info = self._exc_info
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return self._result
+
+
+class Executor(object):
+    """
+    在一组工作线程中执行函数，submit 立即返回 Future。
+    等待执行的任务最多 queue_size 个，超出时 Future 以 RuntimeError 结束
+    """
+    def __init__(self, name, thread_count, queue_size=100000):
+        self._pool = WorkerPool(name, thread_count, queue_size,
+                                1, self._run_batch)
+
+    def start(self):
+        self._pool.start()
+
+    def stop(self, timeout=None):
+        self._pool.stop(timeout)
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        if not self._pool.submit((future, func, args, kwargs)):
+            try:
+                raise RuntimeError("%s is busy or stopped" %
+                                   self._pool.name)
+            except RuntimeError:
+                future.set_exception(sys.exc_info())
+        return future
+
+    @staticmethod
+    def _run_batch(tasks):
+        for future, func, args, kwargs in tasks:
+            try:
+                result = func(*args, **kwargs)
+            except:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+def test_future():
+    import time
+
+    executor = Executor("test-executor", 2, 10)
+    executor.start()
+    try:
+        # 回调函数在完成时执行，已经完成时立即执行
+        calls = []
+        future = executor.submit(lambda: time.sleep(0.05) or 1)
+        future.add_done_callback(lambda f: calls.append(f.result()))
+        assert not future.done()
+        assert future.result(1) == 1
+        future.add_done_callback(lambda f: calls.append(f.result() + 1))
+        assert calls == [1, 2]
+
+        # 异常保留原来的调用栈
+        def fail():
+            raise ValueError("failed")
+
+        future = executor.submit(fail)
+        try:
+            future.result(1)
+        except ValueError as e:
+            assert str(e) == "failed"
+        else:
+            assert False
+        assert future.exception()[0] is ValueError
+    finally:
+        executor.stop()
+
+    # 队列满了，不等待
+    executor = Executor("full-executor", 1, 1)
+    executor.submit(lambda: None)
+    future = executor.submit(lambda: None)
+    assert future.done() and future.exception()[0] is RuntimeError
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_future()
@@ -2,37 +2,15 @@
 
 
 class Node(object):
-    def __init__(self,
-                 data=None,
-                 prev=None,
-                 next=None):
-        self._data = data
-        self._prev = prev
-        self._next = next
-
-    @property
-    def data(self):
-        return self._data
-
-    @data.setter
-    def data(self, data):
-        self._data = data
-
-    @property
-    def prev(self):
-        return self._prev
-
-    @prev.setter
-    def prev(self, prev):
-        self._prev = prev
-
-    @property
-    def next(self):
-        return self._next
+    """
+    侵入式链表的节点。放入 LinkedQueue 的对象继承该类，
+    自己携带 prev、next 指针，不需要再额外包装一个节点对象
+    """
+    __slots__ = ("prev", "next")
 
-    @next.setter
-    def next(self, next):
-        self._next = next
+    def __init__(self):
+        self.prev = None
+        self.next = None
 
 
 class LinkedQueue(object):
@@ -45,35 +23,56 @@ class LinkedQueue(object):
         self._head.next = self._head
         self._size = 0
 
-    def insert_to_head(self, data):
-        inserted_node = Node(data)
-        head_next = self._head.next
-        self._head.next = inserted_node
-        head_next.prev = inserted_node
-        inserted_node.prev = self._head
-        inserted_node.next = head_next
+    def insert_to_head(self, node):
+        head = self._head
+        head_next = head.next
+        head.next = node
+        head_next.prev = node
+        node.prev = head
+        node.next = head_next
         self._size = self._size + 1
-        return inserted_node
-
-    def insert_to_last(self, data):
-        inserted_node = Node(data)
-        current_last = self._head.prev
-        current_last.next = inserted_node
-        self._head.prev = inserted_node
-        inserted_node.prev = current_last
-        inserted_node.next = self._head
+        return node
+
+    def insert_many_to_head(self, nodes):
+        """
+        把一批节点按顺序插入到队列的头部，整批只拼接一次链表
+        """
+        if not nodes:
+            return nodes
+        head = self._head
+        head_next = head.next
+        prev = head
+        for node in nodes:
+            prev.next = node
+            node.prev = prev
+            prev = node
+        prev.next = head_next
+        head_next.prev = prev
+        self._size = self._size + len(nodes)
+        return nodes
+
+    def insert_to_last(self, node):
+        head = self._head
+        current_last = head.prev
+        current_last.next = node
+        head.prev = node
+        node.prev = current_last
+        node.next = head
         self._size = self._size + 1
-        return inserted_node
+        return node
 
     def move_to_head(self, node):
+        head = self._head
         node_prev = node.prev
+        if node_prev is head:
+            return
         node_next = node.next
         node_prev.next = node_next
         node_next.prev = node_prev
-        head_next = self._head.next
+        head_next = head.next
         head_next.prev = node
-        self._head.next = node
-        node.prev = self._head
+        head.next = node
+        node.prev = head
         node.next = head_next
 
     def peek_last(self):
@@ -83,12 +82,13 @@ class LinkedQueue(object):
         return head_prev
 
     def remove_last(self):
-        last = self._head.prev
-        if last is self._head:
+        head = self._head
+        last = head.prev
+        if last is head:
             return None
         last_prev = last.prev
-        last_prev.next = self._head
-        self._head.prev = last_prev
+        last_prev.next = head
+        head.prev = last_prev
         self._size = self._size - 1
         last.prev = None
         last.next = None
@@ -101,6 +101,7 @@ class LinkedQueue(object):
         node_next.prev = node_prev
         node.prev = None
         node.next = None
+        self._size = self._size - 1
 
     def get_prev_node(self, node):
         node_prev = node.prev
@@ -109,10 +110,12 @@ class LinkedQueue(object):
         return node_prev
 
     def iter(self):
-        node = self._head
-        while node.next is not self._head:
-            yield node.next.data
-            node = node.next
+        head = self._head
+        node = head.next
+        while node is not head:
+            next_node = node.next
+            yield node
+            node = next_node
 
     @property
     def size(self):
@@ -120,23 +123,41 @@ class LinkedQueue(object):
 
 
 def test_linked_queue():
+    class DataNode(Node):
+        __slots__ = ("data", )
+
+        def __init__(self, data):
+            Node.__init__(self)
+            self.data = data
+
+    def datas(lq):
+        return [node.data for node in lq.iter()]
+
     lq = LinkedQueue()
-    assert list(lq.iter()) == [] and lq.size == 0
-    lq.insert_to_head(1)
-    assert list(lq.iter()) == [1] and lq.size == 1
-    lq.insert_to_last(2)
-    assert list(lq.iter()) == [1, 2] and lq.size == 2
-    lq.insert_to_head(3)
-    assert list(lq.iter()) == [3, 1, 2] and lq.size == 3
+    assert datas(lq) == [] and lq.size == 0
+    lq.insert_to_head(DataNode(1))
+    assert datas(lq) == [1] and lq.size == 1
+    lq.insert_to_last(DataNode(2))
+    assert datas(lq) == [1, 2] and lq.size == 2
+    lq.insert_to_head(DataNode(3))
+    assert datas(lq) == [3, 1, 2] and lq.size == 3
+
+    nodes = lq.insert_many_to_head([DataNode(4), DataNode(5)])
+    assert datas(lq) == [4, 5, 3, 1, 2] and lq.size == 5
+    lq.remove_node(nodes[0])
+    lq.remove_node(nodes[1])
+    assert lq.insert_many_to_head([]) == []
 
     last = lq.peek_last()
     assert last.data == 2
     lq.move_to_head(last)
-    assert list(lq.iter()) == [2, 3, 1]
+    assert datas(lq) == [2, 3, 1]
     lq.move_to_head(lq.peek_last())
-    assert list(lq.iter()) == [1, 2, 3]
+    assert datas(lq) == [1, 2, 3]
     lq.move_to_head(lq.peek_last())
-    assert list(lq.iter()) == [3, 1, 2]
+    assert datas(lq) == [3, 1, 2]
+    lq.move_to_head(lq.get_prev_node(lq.peek_last()).prev)
+    assert datas(lq) == [3, 1, 2]
 
     assert lq.peek_last().data == 2
     assert lq.remove_last().data == 2
@@ -0,0 +1,142 @@
+# coding: utf8
+
+import errno
+import fcntl
+import logging
+import os
+import threading
+import time
+import zlib
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LockTable(object):
+    """
+    多个进程之间的一组互斥锁：key 散列到文件中的一个字节，用 lockf 锁住这个字节。
+    lockf 的记录锁属于进程，同一个进程的线程之间不互斥，所以每个槽位还有一把
+    线程锁；同一个线程可以重入同一个槽位。持有锁的进程退出时，内核释放它的锁
+    """
+    # 轮询等待锁的最长间隔（秒）
+    MAX_POLL_INTERVAL = 0.05
+
+    def __init__(self, path, slot_count):
+        self._path = path
+        self._slot_count = slot_count
+        self._fd = None
+        self._locks = [threading.RLock() for _ in xrange(slot_count)]
+        self._depths = [0] * slot_count
+
+    @property
+    def path(self):
+        return self._path
+
+    def open(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0644)
+
+    def close(self):
+        # 关闭文件会释放这个进程在文件上的所有记录锁
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def acquire(self, key, timeout):
+        """
+        获取 key 所在槽位的锁，返回槽位号；其它进程持有锁超过 timeout 秒时返回 None，
+        这时调用者不持有锁，也不需要调用 release
+        """
+        slot = (zlib.crc32(key) & 0xffffffff) % self._slot_count
+        lock = self._locks[slot]
+        deadline = time.time() + timeout
+        interval = 0.001
+        while True:
+            # 线程锁和记录锁都不等待地获取，才能控制等待的时间
+            if lock.acquire(False):
+                if self._depths[slot] > 0:
+                    self._depths[slot] = self._depths[slot] + 1
+                    return slot
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB,
+                                1, slot)
+                except IOError as exc:
+                    lock.release()
+                    if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                else:
+                    self._depths[slot] = 1
+                    return slot
+            if time.time() >= deadline:
+                LOGGER.debug("timeout while waiting for slot %d of %s",
+                             slot, self._path)
+                return None
+            time.sleep(interval)
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    def release(self, slot):
+        self._depths[slot] = self._depths[slot] - 1
+        try:
+            if self._depths[slot] == 0:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+        finally:
+            self._locks[slot].release()
+
+
+def test_lock_table():
+    import shutil
+    import tempfile
+
+    base_path = tempfile.mkdtemp(prefix="test-lock-table-")
+    path = os.path.join(base_path, "locks")
+    try:
+        table = LockTable(path, 16)
+        table.open()
+
+        # 同一个线程可以重入
+        slot = table.acquire("a", 1)
+        assert table.acquire("a", 1) == slot
+        table.release(slot)
+
+        # 其它进程拿不到这个槽位，直到这个进程释放
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                child = LockTable(path, 16)
+                child.open()
+                if child.acquire("a", 0.05) is None:
+                    os.write(write_fd, "x")
+                    slot = child.acquire("a", 5)
+                    if slot is not None:
+                        child.release(slot)
+                        code = 0
+            finally:
+                os._exit(code)
+        os.read(read_fd, 1)
+        time.sleep(0.05)
+        table.release(slot)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+
+        # 同一个进程中的其它线程等待
+        slot = table.acquire("b", 1)
+        acquired = []
+
+        def target():
+            other = table.acquire("b", 0.05)
+            acquired.append(other)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        table.release(slot)
+        assert acquired == [None]
+        table.close()
+    finally:
+        shutil.rmtree(base_path)
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_lock_table()
@@ -0,0 +1,735 @@
+# coding: utf8
+
+import logging
+
+from .abstract_lru_cache import (
+    AbstractLRUCache,
+    AbstractLRUCacheBuilder)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MemoryLRUCache(AbstractLRUCache):
+    """
+    把缓存数据保存在内存字典中的 LRU Cache，主要用于测试和基准测试
+    """
+    def __init__(self, *args, **kwargs):
+        AbstractLRUCache.__init__(self, *args, **kwargs)
+        self._data = {}
+
+    def load(self):
+        yield 0
+
+    def prepare(self):
+        LOGGER.debug("preparing MemoryLRUCache")
+        self._data = {}
+
+    def finalize(self):
+        self._data = {}
+        LOGGER.debug("MemoryLRUCache is finalized")
+
+    def read_cache(self, key):
+        return self._data[key]
+
+    def write_cache(self, key, data):
+        self._data[key] = data
+
+    def read_cache_many(self, keys):
+        data = self._data
+        return dict((key, data[key]) for key in keys if key in data)
+
+    def write_cache_many(self, items):
+        self._data.update(items)
+
+    def delete_cache(self, key):
+        self._data.pop(key, None)
+
+
+class MemoryLRUCacheBuilder(AbstractLRUCacheBuilder):
+    def build(self):
+        self._check()
+        return MemoryLRUCache(
+            *self._lru_cache_args(),
+            **self._lru_cache_kwargs())
+
+
+def test_memory_lru_cache():
+    import threading
+    import time
+    from .abstract_lru_cache import Serializer, ReturnCode
+    from .skiplist_map import SkipListMap
+    from .dict_map import DictMap
+    from .eviction_policy import ClockPolicy, SLRUPolicy, \
+        TwoQueuePolicy, ARCPolicy, GDSFPolicy
+
+    class TestSerializer(Serializer):
+        def loads(self, data):
+            return data
+
+        def dumps(self, obj):
+            return len(obj), obj
+
+    calls = []
+
+    def func(key):
+        calls.append(key)
+        return key * 2
+
+    for index_class, eviction_policy, access_buffer in (
+            (None, None, None),
+            (SkipListMap, None, None),
+            (None, ClockPolicy, None),
+            (None, SLRUPolicy, None),
+            (None, TwoQueuePolicy, None),
+            (None, ARCPolicy, None),
+            (None, GDSFPolicy, None),
+            (None, None, 2)):
+        builder = MemoryLRUCacheBuilder() \
+            .with_max_entry_count(100) \
+            .with_max_size(1024)
+        if index_class is not None:
+            builder.with_index(index_class)
+        if eviction_policy is not None:
+            builder.with_eviction_policy(eviction_policy)
+        if access_buffer is not None:
+            builder.with_access_buffer(access_buffer, 4)
+        cache = builder.build()
+        cache.start()
+        assert cache.wait_for_usable(1)
+        try:
+            del calls[:]
+            serializer = TestSerializer()
+            for _ in range(3):
+                assert cache.open("ab", serializer, False,
+                                  func, "ab") == "abab"
+            assert calls == ["ab"]
+            assert cache.purge("ab") & ReturnCode.OK
+            assert cache.purge("ab") & ReturnCode.ERROR_KEY_NOT_EXISTS
+            assert cache.open("ab", serializer, False,
+                              func, "ab") == "abab"
+            assert calls == ["ab", "ab"]
+
+            # 批量加载
+            count = cache._current_entry_count
+            cache.begin_bulk_load()
+            assert cache.add_metas([("m1", 1), ("m2", 1)]) == []
+            assert cache.add_metas([("m1", 2)]) == []
+            assert cache.add_metas([("m3", 2000)]) == ["m3"]
+            cache.end_bulk_load()
+            assert cache._current_entry_count == count + 2
+            assert cache._map["m1"].size == 2
+            assert not cache.add_meta("m1", 1)
+            assert not cache.add_meta("m3", 2000)
+            assert cache.add_meta("m4", 1)
+            assert cache.purge_prefix("m") == 3
+
+            # 按前缀批量清除
+            for key in ("t1a", "t1b", "t2a"):
+                cache.open(key, serializer, False, func, key)
+            assert cache.purge_prefix("t1") == 2
+            for _ in range(100):
+                if "t1a" not in cache._data and \
+                        "t1b" not in cache._data:
+                    break
+                time.sleep(0.01)
+            assert sorted(cache._data) == ["ab", "t2a"]
+            assert cache.purge_prefix("t1") == 0
+
+            # 并发回源：只计算一次，结果直接交给等待者
+            del calls[:]
+            reads = []
+            read_cache = cache.read_cache
+            cache.read_cache = lambda key: reads.append(key) or \
+                read_cache(key)
+            results = []
+
+            def slow_func(key):
+                calls.append(key)
+                time.sleep(0.1)
+                return key * 2
+
+            def open_slow():
+                start_time = time.time()
+                results.append((cache.open("sf", serializer, False,
+                                           slow_func, "sf"),
+                                time.time() - start_time))
+
+            threads = [threading.Thread(target=open_slow)
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert calls == ["sf"] and reads == []
+            for result, time_used in results:
+                assert result == "sfsf" and time_used < 0.15, time_used
+            del cache.read_cache
+
+            # 命中记录先进入缓冲区，缓冲区满或者管理线程运行时才回放
+            if access_buffer is not None:
+                with cache._lock:
+                    cache._drain_access_buffers()
+                    assert cache._policy.victim().key == "ab"
+                cache.open("ab", serializer, False, func, "ab")
+                with cache._lock:
+                    assert cache._policy.victim().key == "ab"
+                    cache._drain_access_buffers()
+                    assert cache._policy.victim().key != "ab"
+                for _ in range(4):
+                    cache.open("t2a", serializer, False, func, "t2a")
+                assert sum(len(buffer)
+                           for buffer in cache._access_buffers) == 0
+        finally:
+            cache.stop()
+
+    # TinyLFU 准入：扫描式的访问不会挤掉热点 key，也不会创建条目
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(4) \
+        .with_max_size(1024) \
+        .with_watermarks(1, 1) \
+        .with_admission() \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        hot_keys = ["h1", "h2", "h3", "h4"]
+        for _ in range(3):
+            for key in hot_keys:
+                cache.open(key, serializer, False, func, key)
+        del calls[:]
+        for i in range(100):
+            key = "s%d" % i
+            assert cache.open(key, serializer, False,
+                              func, key) == key * 2
+        assert len(calls) == 100
+        assert sorted(cache._map) == hot_keys
+        rc, _ = cache._exists("s0")
+        assert rc & ReturnCode.ERROR_NOT_ADMITTED
+        del calls[:]
+        for key in hot_keys:
+            cache.open(key, serializer, False, func, key)
+        assert calls == []
+    finally:
+        cache.stop()
+
+    # DictMap 在锁外收集匹配的条目，收集之后被替换的条目不会被标记
+    hooks = []
+
+    class HookedMap(DictMap):
+        __slots__ = ()
+
+        def iter_prefix(self, prefix):
+            matched = list(DictMap.iter_prefix(self, prefix))
+            while hooks:
+                hooks.pop()()
+            return iter(matched)
+
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_index(HookedMap) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        for key in ("r1", "r2"):
+            cache.open(key, serializer, False, func, key)
+        old = cache._map["r1"]
+
+        def replace_r1():
+            assert cache.purge("r1") & ReturnCode.OK
+            cache.open("r1", serializer, False, func, "r1")
+
+        hooks.append(replace_r1)
+        assert cache.purge_prefix("r") == 1
+        assert cache._map["r1"] is not old
+        assert not cache._map["r1"].is_deleting()
+        assert cache._map["r2"].is_deleting()
+    finally:
+        cache.stop()
+
+    # 超过高水位时立即唤醒管理线程，分批淘汰到低水位
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_watermarks(0.5, 0.2) \
+        .with_purge_batch_size(10) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        for i in range(51):
+            key = "w%d" % i
+            cache.open(key, serializer, False, func, key)
+        for _ in range(100):
+            if cache._current_entry_count <= 20:
+                break
+            time.sleep(0.01)
+        assert cache._current_entry_count == 20
+        # 最近使用的条目被保留
+        assert "w50" in cache._map and "w0" not in cache._map
+        # 介于两个水位之间时不淘汰
+        for i in range(51, 81):
+            key = "w%d" % i
+            cache.open(key, serializer, False, func, key)
+        assert cache._evict() == (0, False)
+        assert cache._current_entry_count == 50
+        cache.open("w81", serializer, False, func, "w81")
+        for _ in range(100):
+            if cache._current_entry_count <= 20:
+                break
+            time.sleep(0.01)
+        assert cache._current_entry_count == 20
+    finally:
+        cache.stop()
+
+    # 删除线程分批删除缓存数据，停止时删除完已经提交的条目
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_deleters(2, 100) \
+        .with_purge_batch_size(10) \
+        .build()
+    batches = []
+    delete_batch = cache._delete_batch
+
+    def recorded_delete_batch(entries):
+        batches.append(len(entries))
+        time.sleep(0.01)
+        delete_batch(entries)
+
+    cache._delete_batch = recorded_delete_batch
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        for i in range(50):
+            key = "d%d" % i
+            cache.open(key, serializer, False, func, key)
+        for i in range(50):
+            assert cache.purge("d%d" % i) == ReturnCode.OK
+        # 提交之后立即返回，元数据由删除线程整批更新
+        with cache._lock:
+            assert cache._current_entry_count == \
+                cache._deleting_entry_count
+    finally:
+        cache.stop()
+    assert sum(batches) == 50 and max(batches) > 1
+    assert cache._deleting_entry_count == 0
+    assert cache._deleting_size == 0
+    assert len(cache._map) == cache._current_entry_count == 0
+
+    # 过期检查分片执行，每片最多检查 expire_slice_size 个条目
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_max_inactive(0.05) \
+        .with_expire_slice(10) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        for i in range(35):
+            key = "e%d" % i
+            cache.open(key, serializer, False, func, key)
+        time.sleep(0.1)
+        counts = []
+        while cache._expire():
+            counts.append(cache._current_entry_count)
+            assert cache.expire_lag > 0
+        assert counts == [25, 15, 5]
+        assert cache._current_entry_count == 0
+        assert cache.expire_lag == 0
+
+        # 时间预算在开始时就已经用完，每一片仍然检查一个条目
+        for i in range(3):
+            key = "x%d" % i
+            cache.open(key, serializer, False, func, key)
+        time.sleep(0.1)
+        cache._expire_slice_time = -1
+        counts = []
+        while cache._expire():
+            counts.append(cache._current_entry_count)
+        assert counts == [2, 1]
+        assert cache._current_entry_count == 0
+    finally:
+        cache.stop()
+
+    # 绝对过期时间：窗口内返回旧的数据，由一个刷新线程在后台重新计算
+    versions = []
+
+    def versioned_func(key):
+        versions.append(key)
+        time.sleep(0.05)
+        return "%s-%d" % (key, len(versions))
+
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_ttl(0.1, 0.5) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        assert cache.open("v", serializer, False,
+                          versioned_func, "v") == "v-1"
+        time.sleep(0.15)
+        start_time = time.time()
+        for _ in range(10):
+            assert cache.open("v", serializer, False,
+                              versioned_func, "v") == "v-1"
+        assert time.time() - start_time < 0.05
+        time.sleep(0.1)
+        assert versions == ["v", "v"]
+        assert cache.open("v", serializer, False,
+                          versioned_func, "v") == "v-2"
+        assert cache._map["v"].ref_count == 0
+        assert cache._current_size == len("v-2")
+        # 超出窗口之后同步重新计算
+        time.sleep(0.65)
+        assert cache.open("v", serializer, False,
+                          versioned_func, "v") == "v-3"
+        assert cache._current_size == len("v-3")
+        # 刷新线程已经停止时不再提交，条目不会一直处于刷新中
+        cache._refreshers.stop()
+        time.sleep(0.15)
+        assert cache.open("v", serializer, False,
+                          versioned_func, "v") == "v-3"
+        entry = cache._map["v"]
+        assert not entry.refreshing and entry.ref_count == 0
+        assert len(versions) == 3
+    finally:
+        cache.stop()
+
+    # ttl 由计算结果决定，返回 None 表示不过期
+    del versions[:]
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_ttl(lambda result: 0.01 if result.startswith("x") else None) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        for key in ("x", "y"):
+            cache.open(key, serializer, False, versioned_func, key)
+        time.sleep(0.02)
+        for key in ("x", "y"):
+            cache.open(key, serializer, False, versioned_func, key)
+        assert versions == ["x", "y", "x"]
+    finally:
+        cache.stop()
+
+    # 提前刷新：热点条目在到期之前由刷新线程重新计算，冷条目正常过期
+    del versions[:]
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_ttl(0.3) \
+        .with_refresh_ahead(0.2) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        for key in ("h", "h", "h", "c"):
+            cache.open(key, serializer, False, versioned_func, key)
+        assert versions == ["h", "c"]
+        time.sleep(0.25)
+        assert versions == ["h", "c", "h"]
+        start_time = time.time()
+        assert cache.open("h", serializer, False,
+                          versioned_func, "h") == "h-3"
+        assert time.time() - start_time < 0.05
+        time.sleep(0.1)
+        assert cache.open("c", serializer, False,
+                          versioned_func, "c") == "c-4"
+        assert cache._map["h"].ref_count == 0
+
+        # 反复重新计划的条目在刷新堆中留下的无效元素会被清理
+        loader = (serializer, versioned_func, ("c", ), {})
+        with cache._lock:
+            entry = cache._map["c"]
+            for _ in range(1000):
+                cache._plan_refresh(entry, loader)
+            assert len(cache._refresh_heap) <= \
+                2 * len(cache._map) + cache.REFRESH_HEAP_COMPACT_THRESHOLD
+            assert len([item for item in cache._refresh_heap
+                        if item[2] is entry and
+                        cache._is_planned(item)]) == 1
+    finally:
+        cache.stop()
+
+    # 缓存回源失败，连续失败时 ttl 翻倍
+    failures = []
+
+    def failing_func(key):
+        failures.append(key)
+        if key == "none":
+            return None
+        time.sleep(0.05)
+        raise ValueError(key)
+
+    cache = MemoryLRUCacheBuilder() \
+        .with_max_entry_count(100) \
+        .with_max_size(1024) \
+        .with_negative_cache(0.1, 0.15, lambda result: result is None) \
+        .build()
+    cache.start()
+    assert cache.wait_for_usable(1)
+    try:
+        serializer = TestSerializer()
+        errors = []
+
+        def open_failing():
+            try:
+                cache.open("f", serializer, False, failing_func, "f")
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=open_failing)
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        open_failing()
+        assert failures == ["f"] and len(errors) == 5
+        time.sleep(0.1)
+        open_failing()
+        assert failures == ["f", "f"]
+        assert cache._map["f"].failure[1] == 2
+        # 缓存的失败不引用 traceback
+        assert len(cache._map["f"].failure[2]) == 2
+        # 第二次失败缓存 0.15 秒（0.2 秒被 negative_max_ttl 截断）
+        time.sleep(0.1)
+        open_failing()
+        assert failures == ["f", "f"]
+        time.sleep(0.05)
+        open_failing()
+        assert failures == ["f", "f", "f"]
+
+        for _ in range(3):
+            assert cache.open("none", serializer, False,
+                              failing_func, "none") is None
+        assert failures.count("none") == 1
+        assert "none" not in cache._data
+    finally:
+        cache.stop()
+
+    # 非阻塞的 deco_future：同一个 key 的并发调用共享一个 Future
+    from .abstract_lru_cache import ProxyCache
+    from .future import Executor
+
+    executor = Executor("test-executor", 4)
+    executor.start()
+    proxy = ProxyCache()
+    caches = [MemoryLRUCacheBuilder()
+              .with_max_entry_count(100)
+              .with_max_size(1024)
+              .build()
+              for _ in range(2)]
+    for cache in caches:
+        cache.start()
+        assert cache.wait_for_usable(1)
+        proxy.add_cache(cache)
+    proxy.set_key_func(lambda func, key: key)
+    proxy.set_call_func_when_failure(False)
+    proxy.set_serializer(TestSerializer())
+    proxy.set_executor(executor)
+    try:
+        del calls[:]
+
+        @proxy.deco_future
+        def slow_double(key):
+            calls.append(key)
+            time.sleep(0.05)
+            if key == "error":
+                raise ValueError(key)
+            return key * 2
+
+        start_time = time.time()
+        futures = [slow_double("fk") for _ in range(50)]
+        assert time.time() - start_time < 0.05
+        assert len(set(futures)) == 1
+        assert futures[0].result(1) == "fkfk"
+        assert slow_double("fk").result(1) == "fkfk"
+        assert calls == ["fk"]
+        try:
+            slow_double("error").result(1)
+        except ValueError:
+            pass
+        else:
+            assert False
+    finally:
+        for cache in caches:
+            cache.stop()
+        executor.stop()
+
+    # 一致性散列：增加、删除 Cache 时只有一部分 key 改变归属，
+    # 它们从原来的 Cache 迁移，不回源计算
+    def build_cache(name):
+        cache = MemoryLRUCacheBuilder() \
+            .with_name(name) \
+            .with_max_entry_count(1000) \
+            .with_max_size(100 * 1024) \
+            .build()
+        cache.start()
+        assert cache.wait_for_usable(1)
+        return cache
+
+    proxy = ProxyCache()
+    caches = [build_cache("ring-%d" % i) for i in range(3)]
+    proxy.add_cache(caches[0])
+    proxy.add_cache(caches[1])
+    proxy.set_key_func(lambda func, key: key)
+    proxy.set_call_func_when_failure(False)
+    proxy.set_serializer(TestSerializer())
+    try:
+        del calls[:]
+
+        @proxy.deco
+        def triple(key):
+            calls.append(key)
+            return key * 3
+
+        keys = ["ring-key-%d" % i for i in range(300)]
+        for key in keys:
+            assert triple(key) == key * 3
+        assert len(calls) == len(keys)
+        owners = dict((key, proxy._select_cache(triple, key)[1])
+                      for key in keys)
+
+        proxy.add_cache(caches[2])
+        moved = [key for key in keys
+                 if proxy._select_cache(triple, key)[1] is not owners[key]]
+        assert 50 < len(moved) < 150
+        assert all(proxy._select_cache(triple, key)[1] is caches[2]
+                   for key in moved)
+        del calls[:]
+        for key in keys:
+            assert triple(key) == key * 3
+        assert calls == []
+        # 已经迁移的 key 从原来的 Cache 中删除
+        for key in moved:
+            assert key not in owners[key]._data
+            assert key in caches[2]._data
+        proxy.finish_migration()
+
+        # 删除 Cache 时，只有它拥有的 key 改变归属
+        owners = dict((key, proxy._select_cache(triple, key)[1])
+                      for key in keys)
+        proxy.remove_cache(caches[0])
+        for key in keys:
+            owner = proxy._select_cache(triple, key)[1]
+            assert owner is owners[key] or owners[key] is caches[0]
+        # 迁移结束之前，清除缓存时也清除被删除的 Cache，旧的结果不会被迁移回来
+        purged = [key for key in keys if owners[key] is caches[0]][:2]
+        assert proxy.purge(purged[0]) & ReturnCode.OK
+        assert proxy.purge_prefix(purged[1]) >= 1
+        for key in keys:
+            assert triple(key) == key * 3
+        assert sorted(calls) == [key for key in sorted(keys)
+                                 if key == purged[0] or
+                                 key.startswith(purged[1])]
+        del calls[:]
+        proxy.finish_migration()
+        # purge_prefix 标记的条目由管理线程在后台删除
+        for _ in range(100):
+            if not caches[0]._data:
+                break
+            time.sleep(0.01)
+        assert not caches[0]._data
+    finally:
+        for cache in caches:
+            cache.stop()
+
+    # 批量接口：每个分片只查找一次，所有分片中需要计算的 key 只计算一次
+    proxy = ProxyCache()
+    caches = [build_cache("many-%d" % i) for i in range(3)]
+    proxy.add_cache(caches[0])
+    proxy.add_cache(caches[1])
+    proxy.set_call_func_when_failure(False)
+    proxy.set_serializer(TestSerializer())
+    batches = []
+
+    def func_many(keys):
+        batches.append(sorted(keys))
+        if "raise" in keys:
+            raise ValueError("raise")
+        return dict((key, key * 2) for key in keys if key != "absent")
+
+    try:
+        assert sorted(proxy.put_many([("p1", "v1"), ("p2", "v2")])) == \
+            ["p1", "p2"]
+        assert proxy.get_many(["p1", "p2", "p3"]) == \
+            {"p1": "v1", "p2": "v2"}
+
+        keys = ["p1", "m1", "m2", "m1", "absent", u"m3"]
+        results = proxy.open_many(keys, func_many)
+        assert results == {"p1": "v1", "m1": "m1m1",
+                           "m2": "m2m2", "m3": "m3m3"}
+        assert batches == [["absent", "m1", "m2", "m3"]]
+        del batches[:]
+        assert proxy.open_many(keys, func_many) == results
+        assert batches == [["absent"]]
+
+        # func_many 抛出异常时，条目被放弃，下一次重新计算
+        del batches[:]
+        try:
+            proxy.open_many(["raise", "m1"], func_many)
+        except ValueError:
+            pass
+        else:
+            assert False
+        try:
+            proxy.open_many(["raise"], func_many)
+        except ValueError:
+            pass
+        else:
+            assert False
+        assert batches == [["raise"], ["raise"]]
+
+        # 正在被其它线程计算的 key 等待它的结果，不再计算
+        started = threading.Event()
+
+        def slow_func(key):
+            started.set()
+            time.sleep(0.1)
+            return "slow"
+
+        owner = proxy._group(["w1"])[0][0]
+        thread = threading.Thread(
+            target=owner.open,
+            args=("w1", TestSerializer(), False, slow_func, "w1"))
+        thread.start()
+        started.wait(1)
+        del batches[:]
+        assert proxy.open_many(["w1", "w2"], func_many) == \
+            {"w1": "slow", "w2": "w2w2"}
+        assert batches == [["w2"]]
+        thread.join()
+
+        # 增加分片之后，改变归属的 key 从原来的 Cache 迁移
+        proxy.add_cache(caches[2])
+        del batches[:]
+        keys = ["p1", "p2", "m1", "m2", "m3", "w1", "w2"]
+        results = proxy.open_many(keys, func_many)
+        assert len(results) == len(keys)
+        assert batches == []
+        assert proxy.get_many(keys) == results
+    finally:
+        for cache in caches:
+            cache.stop()
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_memory_lru_cache()
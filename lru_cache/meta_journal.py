@@ -0,0 +1,335 @@
+# coding: utf8
+
+import errno
+import fcntl
+import logging
+import marshal
+import os
+import threading
+import uuid
+import zlib
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MetaJournal(object):
+    """
+    元数据的快照和日志，保存在一个目录中。快照是某一时刻所有可以使用的条目，
+    按最近一次访问的时间从早到晚排列；快照之后写入、删除的缓存文件追加到日志中。
+    日志按代编号：保存快照前先切换到新的一代，快照记录新一代的编号 G，
+    于是第 G 代及之后的日志都发生在快照之后。上一代（G - 1）的日志中可能有
+    收集快照时正在写入的文件，只用于恢复快照中没有的 key。
+    快照是一行文本的头部加上 marshal 序列化的记录，读取时不需要逐行解析；
+    日志是文本，一行一条记录，进程崩溃时最后一行可能不完整，读取时忽略
+    """
+    SNAPSHOT_NAME = "snapshot"
+    JOURNAL_PREFIX = "journal."
+    LEASE_NAME = "lease"
+    MAGIC = "lru-cache-snapshot"
+    VERSION = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._generation = 0
+        self._lease_fd = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def acquire_lease(self):
+        """
+        同一个目录只能由一个进程写日志，拿不到租约时返回 False
+        """
+        if self._lease_fd is not None:
+            return True
+        try:
+            os.makedirs(self._path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        fd = os.open(os.path.join(self._path, self.LEASE_NAME),
+                     os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as exc:
+            os.close(fd)
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        self._lease_fd = fd
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        if self._lease_fd is not None:
+            os.close(self._lease_fd)
+            self._lease_fd = None
+
+    def _journal_path(self, generation):
+        return os.path.join(self._path,
+                            "%s%d" % (self.JOURNAL_PREFIX, generation))
+
+    def _generations(self):
+        generations = []
+        for name in os.listdir(self._path):
+            if not name.startswith(self.JOURNAL_PREFIX):
+                continue
+            try:
+                generations.append(int(name[len(self.JOURNAL_PREFIX):]))
+            except ValueError:
+                continue
+        generations.sort()
+        return generations
+
+    def read(self, tag):
+        """
+        读取快照和之后的日志，返回按最近一次访问的时间从早到晚排列的
+        (key, size, used_count, accessed_at, deadline, cost) 列表。
+        快照不存在、不完整、tag 不一致，或者日志中有损坏的记录时返回 None
+        """
+        try:
+            with open(os.path.join(self._path, self.SNAPSHOT_NAME)) as fd:
+                data = fd.read()
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                LOGGER.error("fail to read snapshot in %s", self._path,
+                             exc_info=True)
+            return None
+        try:
+            generation, rows = self._parse_snapshot(data, tag)
+        except ValueError as exc:
+            LOGGER.error("invalid snapshot in %s: %s", self._path, exc)
+            return None
+        del data
+        self._generation = max(self._generation, generation)
+        index = None
+        for journal_generation in self._generations():
+            self._generation = max(self._generation, journal_generation)
+            if journal_generation < generation - 1:
+                continue
+            try:
+                with open(self._journal_path(journal_generation)) as fd:
+                    data = fd.read()
+                if not data:
+                    continue
+                if index is None:
+                    # key 到它在 rows 中的下标，日志中的记录把旧的行置为 None，
+                    # 新的行追加到最后
+                    index = dict(zip([row[0] for row in rows],
+                                     xrange(len(rows))))
+                    snapshot_keys = frozenset(index)
+                self._replay(data, rows, index,
+                             journal_generation < generation,
+                             snapshot_keys)
+            except (IOError, OSError, ValueError, IndexError):
+                LOGGER.error("invalid journal %d in %s",
+                             journal_generation, self._path, exc_info=True)
+                return None
+        if index is None:
+            return rows
+        return [row for row in rows if row is not None]
+
+    def _parse_snapshot(self, data, tag):
+        position = data.find("\n")
+        if position < 0:
+            raise ValueError("truncated")
+        header = data[:position].split(" ")
+        if len(header) != 6 or header[0] != self.MAGIC or \
+                header[1] != str(self.VERSION):
+            raise ValueError("unknown format")
+        if header[3] != tag:
+            raise ValueError("tag %s is not %s" % (header[3], tag))
+        body = data[position + 1:]
+        if int(header[4]) != len(body):
+            raise ValueError("truncated")
+        if int(header[5]) != zlib.crc32(body) & 0xffffffff:
+            raise ValueError("checksum mismatch")
+        try:
+            rows = marshal.loads(body)
+        except (EOFError, TypeError):
+            raise ValueError("invalid records")
+        if not isinstance(rows, list):
+            raise ValueError("invalid records")
+        return int(header[2]), rows
+
+    @staticmethod
+    def _replay(data, rows, index, previous, snapshot_keys):
+        """
+        previous 为 True 时，日志早于快照，只用于快照中没有的 key
+        """
+        lines = data.split("\n")
+        # 崩溃时没有写完的最后一行
+        lines.pop()
+        for line in lines:
+            fields = line.split(" ")
+            key = fields[1]
+            if previous and key in snapshot_keys:
+                continue
+            if fields[0] == "P" and len(fields) == 5:
+                i = index.pop(key, None)
+                used_count, cost = 0, None
+                if i is not None:
+                    used_count, cost = rows[i][2], rows[i][5]
+                    rows[i] = None
+                index[key] = len(rows)
+                rows.append((key, int(fields[2]), used_count,
+                             float(fields[3]), _parse_optional(fields[4]),
+                             cost))
+            elif fields[0] == "D" and len(fields) == 2:
+                i = index.pop(key, None)
+                if i is not None:
+                    rows[i] = None
+            else:
+                raise ValueError("invalid record %r" % line)
+
+    def start(self):
+        """
+        读取之后，开始写新一代的日志
+        """
+        generations = self._generations()
+        if generations:
+            self._generation = max(self._generation, generations[-1])
+        self.rotate()
+
+    def rotate(self):
+        """
+        切换到新一代的日志，返回新一代的编号
+        """
+        with self._lock:
+            generation = self._generation + 1
+            fd = os.open(self._journal_path(generation),
+                         os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = fd
+            self._generation = generation
+            return generation
+
+    def _append(self, lines):
+        data = "".join(lines)
+        with self._lock:
+            if self._fd is None:
+                return
+            os.write(self._fd, data)
+
+    def put_many(self, items, accessed_at, deadline):
+        """
+        记录写入的缓存文件，items 是 (key, size) 的序列
+        """
+        deadline = _format_optional(deadline)
+        self._append(["P %s %d %r %s\n" % (key, size, accessed_at, deadline)
+                      for key, size in items])
+
+    def remove(self, key):
+        self._append(["D %s\n" % key])
+
+    def save(self, generation, tag, records):
+        """
+        保存快照，generation 是收集 records 时切换到的新一代日志的编号。
+        records 是按最近一次访问的时间从早到晚排列的
+        (key, size, used_count, accessed_at, deadline, cost) 的序列。
+        写入临时文件后 rename，然后删除不再需要的日志
+        """
+        body = marshal.dumps(list(records))
+        header = "%s %d %d %s %d %d\n" % (
+            self.MAGIC, self.VERSION, generation, tag,
+            len(body), zlib.crc32(body) & 0xffffffff)
+        path = os.path.join(self._path, self.SNAPSHOT_NAME)
+        temp_path = "%s-%s" % (path, uuid.uuid1().hex)
+        with open(temp_path, "wb") as fd:
+            fd.write(header)
+            fd.write(body)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.rename(temp_path, path)
+        for journal_generation in self._generations():
+            if journal_generation < generation - 1:
+                try:
+                    os.remove(self._journal_path(journal_generation))
+                except OSError:
+                    LOGGER.error("fail to remove journal %d in %s",
+                                 journal_generation, self._path,
+                                 exc_info=True)
+
+
+def _parse_optional(field):
+    if field == "-":
+        return None
+    return float(field)
+
+
+def _format_optional(value):
+    if value is None:
+        return "-"
+    return repr(value)
+
+
+def test_meta_journal():
+    import shutil
+    import tempfile
+
+    base_path = tempfile.mkdtemp(prefix="test-meta-journal-")
+    path = os.path.join(base_path, "journal")
+    try:
+        journal = MetaJournal(path)
+        assert journal.acquire_lease()
+        assert journal.read("1:2") is None
+        journal.start()
+        journal.put_many([("a", 1)], 10.0, None)
+        generation = journal.rotate()
+        # 收集快照时 b 正在写入
+        journal.put_many([("b", 2)], 11.0, 20.0)
+        journal.save(generation, "1:2",
+                     [("c", 3, 5, 5.0, None, 0.5),
+                      ("a", 1, 2, 10.0, None, None)])
+        journal.put_many([("d", 4)], 12.0, None)
+        journal.put_many([("c", 6)], 13.0, None)
+        journal.remove("a")
+        os.write(journal._fd, "P e 5")
+
+        # 其它进程拿不到租约
+        other = MetaJournal(path)
+        assert not other.acquire_lease()
+
+        records = MetaJournal(path).read("1:2")
+        assert records == [("b", 2, 0, 11.0, 20.0, None),
+                           ("d", 4, 0, 12.0, None, None),
+                           ("c", 6, 5, 13.0, None, 0.5)], records
+        assert MetaJournal(path).read("2:2") is None
+        journal.close()
+
+        # 重新打开之后从更新的一代开始写
+        journal = MetaJournal(path)
+        assert journal.acquire_lease()
+        assert journal.read("1:2") is not None
+        journal.start()
+        assert journal.generation == generation + 1
+        generation = journal.rotate()
+        journal.save(generation, "1:2", [])
+        assert journal._generations() == [generation - 1, generation]
+        assert journal.read("1:2") == []
+
+        # 损坏的快照
+        snapshot_path = os.path.join(path, MetaJournal.SNAPSHOT_NAME)
+        with open(snapshot_path, "r+b") as fd:
+            fd.write("x")
+        assert journal.read("1:2") is None
+        journal.close()
+    finally:
+        shutil.rmtree(base_path)
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_meta_journal()
@@ -0,0 +1,503 @@
+# coding: utf8
+
+import errno
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+LOGGER = logging.getLogger(__name__)
+
+_MAGIC = "LRUIDX01"
+# magic, 槽位数, 总大小, 条目数, CLOCK 指针
+_HEADER = struct.Struct("<8sQqqQ")
+# 头部之后的一个字节：管理进程是否已经遍历目录加载了缓存
+_LOADED_OFFSET = _HEADER.size
+_HEADER_SIZE = 64
+# 状态, 访问位, key 的 crc32, 大小, key
+_SLOT = struct.Struct("<BBxxIQ64s")
+_EMPTY = 0
+_USED = 1
+_ZERO_CHUNK = 1024 * 1024
+
+
+class SharedIndex(object):
+    """
+    多个进程共享的缓存元数据表：mmap 映射的开放寻址散列表，
+    记录每个 key 的大小和 CLOCK 访问位，以及总大小、条目数。
+    所有访问都先获取线程锁，再对文件加 flock，所以在 fork 之后才能 open。
+    另外用一个租约文件选出唯一的管理进程，它退出时内核释放租约，由其它进程接替。
+    每个打开索引的进程都对用户文件持有共享的 flock，第一个打开的进程
+    （之前的进程都已经退出）把索引标记为没有加载，由管理进程重新加载
+    """
+    KEY_SIZE = 64
+
+    def __init__(self, path, slot_count):
+        self._path = path
+        self._lease_path = path + ".lease"
+        self._users_path = path + ".users"
+        self._slot_count = slot_count
+        self._lock = threading.Lock()
+        self._fd = None
+        self._mm = None
+        self._lease_fd = None
+        self._users_fd = None
+
+    @property
+    def paths(self):
+        return self._path, self._lease_path, self._users_path
+
+    def open(self):
+        """
+        打开或者创建索引。已经存在的索引的槽位数不同时抛出 RuntimeError：
+        其它进程可能已经映射了它，不能改变文件的大小
+        """
+        users_fd = os.open(self._users_path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            first = self._lock_first_user(users_fd)
+            self._fd = self._open_index(first)
+            if first:
+                fcntl.flock(users_fd, fcntl.LOCK_SH)
+        except:
+            os.close(users_fd)
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            raise
+        self._users_fd = users_fd
+
+    @staticmethod
+    def _lock_first_user(users_fd):
+        """
+        返回是否是第一个打开索引的进程，返回时持有用户文件的 flock
+        """
+        try:
+            fcntl.flock(users_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except IOError as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+        fcntl.flock(users_fd, fcntl.LOCK_SH)
+        return False
+
+    def _open_index(self, first):
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0644)
+        length = _HEADER_SIZE + self._slot_count * _SLOT.size
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                header = self._read_header(fd)
+                if header is None or header[0] != _MAGIC:
+                    # 第一次创建，或者上次初始化时崩溃了，没有进程映射它
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, length)
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.write(fd, _HEADER.pack(
+                        _MAGIC, self._slot_count, 0, 0, 0))
+                elif header[1] != self._slot_count or \
+                        os.fstat(fd).st_size != length:
+                    raise RuntimeError(
+                        "%s has %d slots, not %d" %
+                        (self._path, header[1], self._slot_count))
+                elif first:
+                    os.lseek(fd, _LOADED_OFFSET, os.SEEK_SET)
+                    os.write(fd, "\0")
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, length)
+        except:
+            os.close(fd)
+            raise
+        return fd
+
+    @staticmethod
+    def _read_header(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = os.read(fd, _HEADER.size)
+        if len(data) != _HEADER.size:
+            return None
+        return _HEADER.unpack(data)
+
+    def close(self):
+        self.release_lease()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._users_fd is not None:
+            os.close(self._users_fd)
+            self._users_fd = None
+
+    def acquire_lease(self):
+        """
+        不等待地获取管理租约，已经持有时直接返回 True
+        """
+        if self._lease_fd is not None:
+            return True
+        fd = os.open(self._lease_path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as exc:
+            os.close(fd)
+            if exc.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._lease_fd = fd
+        return True
+
+    def release_lease(self):
+        if self._lease_fd is not None:
+            os.close(self._lease_fd)
+            self._lease_fd = None
+
+    def holds_lease(self):
+        return self._lease_fd is not None
+
+    def _acquire(self):
+        self._lock.acquire()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except:
+            self._lock.release()
+            raise
+
+    def _release(self):
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def _header(self):
+        return _HEADER.unpack_from(self._mm, 0)
+
+    def _set_totals(self, size, count):
+        magic, slot_count, _, _, hand = self._header()
+        _HEADER.pack_into(self._mm, 0, magic, slot_count, size, count, hand)
+
+    def _offset(self, index):
+        return _HEADER_SIZE + index * _SLOT.size
+
+    def _find(self, key, key_hash):
+        """
+        调用时必须持有锁。返回 (下标, 是否找到)，没有找到时下标是可以插入的空槽位，
+        表满时为 None
+        """
+        mm = self._mm
+        index = key_hash % self._slot_count
+        for _ in xrange(self._slot_count):
+            state, _, slot_hash, _, slot_key = \
+                _SLOT.unpack_from(mm, self._offset(index))
+            if state == _EMPTY:
+                return index, False
+            if slot_hash == key_hash and slot_key.rstrip("\0") == key:
+                return index, True
+            index = (index + 1) % self._slot_count
+        return None, False
+
+    def _check_key(self, key):
+        if len(key) > self.KEY_SIZE:
+            raise ValueError("key is longer than %d bytes" % self.KEY_SIZE)
+
+    def is_loaded(self):
+        self._acquire()
+        try:
+            return self._mm[_LOADED_OFFSET] != "\0"
+        finally:
+            self._release()
+
+    def set_loaded(self):
+        """管理进程遍历目录加载完所有缓存文件之后调用"""
+        self._acquire()
+        try:
+            self._mm[_LOADED_OFFSET] = "\1"
+        finally:
+            self._release()
+
+    def totals(self):
+        """返回 (总大小, 条目数)"""
+        self._acquire()
+        try:
+            return self._header()[2:4]
+        finally:
+            self._release()
+
+    def get(self, key):
+        """返回 key 的大小，不存在时返回 None"""
+        if len(key) > self.KEY_SIZE:
+            return None
+        key_hash = zlib.crc32(key) & 0xffffffff
+        self._acquire()
+        try:
+            index, found = self._find(key, key_hash)
+            if not found:
+                return None
+            return _SLOT.unpack_from(self._mm, self._offset(index))[3]
+        finally:
+            self._release()
+
+    def touch_many(self, keys):
+        """设置一批 key 的访问位"""
+        hashed = [(key, zlib.crc32(key) & 0xffffffff)
+                  for key in keys if len(key) <= self.KEY_SIZE]
+        self._acquire()
+        try:
+            for key, key_hash in hashed:
+                index, found = self._find(key, key_hash)
+                if found:
+                    # 访问位在槽位的第二个字节
+                    self._mm[self._offset(index) + 1] = "\1"
+        finally:
+            self._release()
+
+    def put_many(self, items):
+        """
+        添加或者更新一批 (key, 大小)，返回因表满而没有添加的 key 的列表
+        """
+        rejected = []
+        hashed = []
+        for key, size in items:
+            self._check_key(key)
+            hashed.append((key, zlib.crc32(key) & 0xffffffff, size))
+        self._acquire()
+        try:
+            _, _, total_size, count, _ = self._header()
+            for key, key_hash, size in hashed:
+                index, found = self._find(key, key_hash)
+                if index is None:
+                    rejected.append(key)
+                    continue
+                offset = self._offset(index)
+                if found:
+                    total_size = total_size - \
+                        _SLOT.unpack_from(self._mm, offset)[3]
+                else:
+                    count = count + 1
+                total_size = total_size + size
+                _SLOT.pack_into(self._mm, offset,
+                                _USED, 1, key_hash, size, key)
+            self._set_totals(total_size, count)
+        finally:
+            self._release()
+        if rejected:
+            LOGGER.error("shared index %s is full", self._path)
+        return rejected
+
+    def put(self, key, size):
+        return not self.put_many([(key, size)])
+
+    def remove(self, key):
+        """删除 key，返回它的大小，不存在时返回 None"""
+        if len(key) > self.KEY_SIZE:
+            return None
+        key_hash = zlib.crc32(key) & 0xffffffff
+        self._acquire()
+        try:
+            index, found = self._find(key, key_hash)
+            if not found:
+                return None
+            return self._remove_at(index)
+        finally:
+            self._release()
+
+    def _remove_at(self, index):
+        """
+        调用时必须持有锁。删除槽位之后，把后面同一个探测序列上的槽位前移，
+        表中不需要墓碑
+        """
+        mm = self._mm
+        size = _SLOT.unpack_from(mm, self._offset(index))[3]
+        _, _, total_size, count, _ = self._header()
+        self._set_totals(total_size - size, count - 1)
+        hole = index
+        current = index
+        # 表满时没有空槽位，最多检查一圈
+        for _ in xrange(self._slot_count - 1):
+            current = (current + 1) % self._slot_count
+            offset = self._offset(current)
+            slot = _SLOT.unpack_from(mm, offset)
+            if slot[0] == _EMPTY:
+                break
+            home = slot[2] % self._slot_count
+            # home 不在 (hole, current] 之间时，这个槽位可以前移到 hole
+            if hole <= current:
+                movable = home <= hole or home > current
+            else:
+                movable = current < home <= hole
+            if movable:
+                _SLOT.pack_into(mm, self._offset(hole), *slot)
+                hole = current
+        _SLOT.pack_into(mm, self._offset(hole), _EMPTY, 0, 0, 0, "")
+        return size
+
+    def evict(self, max_count):
+        """
+        用 CLOCK 选出并删除最多 max_count 个条目：指针经过设置了访问位的条目时
+        清除访问位，经过没有设置访问位的条目时删除它。返回 [(key, 大小)]
+        """
+        evicted = []
+        self._acquire()
+        try:
+            mm = self._mm
+            hand = self._header()[4] % self._slot_count
+            # 每个条目最多被经过两次：第一次清除访问位，第二次删除
+            for _ in xrange(self._slot_count * 2):
+                if len(evicted) >= max_count or self._header()[3] == 0:
+                    break
+                offset = self._offset(hand)
+                state, referenced, _, size, key = \
+                    _SLOT.unpack_from(mm, offset)
+                if state == _EMPTY:
+                    hand = (hand + 1) % self._slot_count
+                elif referenced:
+                    mm[offset + 1] = "\0"
+                    hand = (hand + 1) % self._slot_count
+                else:
+                    # 删除之后后面的条目可能前移到当前槽位，指针不前进
+                    evicted.append((key.rstrip("\0"), size))
+                    self._remove_at(hand)
+            magic, slot_count, total_size, count, _ = self._header()
+            _HEADER.pack_into(mm, 0, magic, slot_count,
+                              total_size, count, hand)
+        finally:
+            self._release()
+        return evicted
+
+    def keys_with_prefix(self, prefix):
+        result = []
+        self._acquire()
+        try:
+            mm = self._mm
+            for index in xrange(self._slot_count):
+                state, _, _, _, key = \
+                    _SLOT.unpack_from(mm, self._offset(index))
+                if state != _EMPTY and key.startswith(prefix):
+                    result.append(key.rstrip("\0"))
+        finally:
+            self._release()
+        return result
+
+    def clear(self):
+        self._acquire()
+        try:
+            mm = self._mm
+            zeros = "\0" * _ZERO_CHUNK
+            for offset in xrange(_HEADER_SIZE, len(mm), _ZERO_CHUNK):
+                end = min(offset + _ZERO_CHUNK, len(mm))
+                mm[offset:end] = zeros[:end - offset]
+            _HEADER.pack_into(mm, 0, _MAGIC, self._slot_count, 0, 0, 0)
+            mm[_LOADED_OFFSET] = "\0"
+        finally:
+            self._release()
+
+
+def test_shared_index():
+    import shutil
+    import tempfile
+    import time
+
+    base_path = tempfile.mkdtemp(prefix="test-shared-index-")
+    path = os.path.join(base_path, "index")
+    try:
+        index = SharedIndex(path, 8)
+        index.open()
+        assert not index.is_loaded()
+        index.set_loaded()
+        assert index.put("a", 10) and index.put("b", 20)
+        assert index.put("a", 15)
+        assert index.get("a") == 15 and index.get("c") is None
+        assert index.totals() == (35, 2)
+        assert index.remove("a") == 15 and index.get("a") is None
+        assert index.get("b") == 20
+
+        # 已经被映射的索引不能改变槽位数
+        try:
+            SharedIndex(path, 16).open()
+        except RuntimeError:
+            pass
+        else:
+            assert False
+        # 其它进程还在使用时，加载的状态被保留
+        other = SharedIndex(path, 8)
+        other.open()
+        assert other.is_loaded() and other.get("b") == 20
+        other.close()
+
+        # 同一个探测序列上的条目在删除之后仍然能够找到
+        index.clear()
+        assert not index.is_loaded()
+        keys = ["k%d" % i for i in range(8)]
+        assert not index.put_many([(key, 1) for key in keys])
+        assert index.put_many([("full", 1)]) == ["full"]
+        for key in keys[::2]:
+            assert index.remove(key) == 1
+        for key in keys[1::2]:
+            assert index.get(key) == 1
+        assert index.totals() == (4, 4)
+
+        # CLOCK：被访问过的条目第一轮不被淘汰
+        index.clear()
+        index.put_many([("x", 1), ("y", 1), ("z", 1)])
+        # 第一轮清除所有访问位，然后淘汰一个
+        evicted = index.evict(1)
+        assert len(evicted) == 1
+        remaining = sorted(index.keys_with_prefix(""))
+        index.touch_many([remaining[0]])
+        assert index.evict(1) == [(remaining[1], 1)]
+        assert index.keys_with_prefix("") == [remaining[0]]
+        assert index.totals() == (1, 1)
+
+        # 其它进程看到同样的数据；租约只能被一个进程持有，进程退出时释放
+        assert index.acquire_lease()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                child = SharedIndex(path, 8)
+                child.open()
+                if child.get(remaining[0]) == 1 and \
+                        not child.acquire_lease():
+                    child.put("from-child", 5)
+                    code = 0
+                child.close()
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+        assert index.get("from-child") == 5
+        index.release_lease()
+
+        pid = os.fork()
+        if pid == 0:
+            child = SharedIndex(path, 8)
+            child.open()
+            child.acquire_lease()
+            time.sleep(0.2)
+            os._exit(0)
+        time.sleep(0.1)
+        assert not index.acquire_lease()
+        os.waitpid(pid, 0)
+        assert index.acquire_lease()
+        index.set_loaded()
+        index.close()
+
+        # 所有进程都退出之后，第一个打开的进程需要重新加载
+        index = SharedIndex(path, 8)
+        index.open()
+        assert not index.is_loaded()
+        index.close()
+    finally:
+        shutil.rmtree(base_path)
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_shared_index()
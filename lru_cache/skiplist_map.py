@@ -1,203 +1,260 @@
 # coding: utf8
 
+import math
 import random
+from operator import itemgetter
 
 P = 0.25
 MAX_LEVEL = 32
+DEFAULT_EXPECTED_SIZE = 1 << 16
 
 
-class Node(object):
-    def __init__(self,
-                 key=None,
-                 next=None,
-                 down=None):
-        self._key = key
-        self._next = next
-        self._down = down
-
-    @property
-    def key(self):
-        return self._key
-
-    @key.setter
-    def key(self, key):
-        self._key = key
-
-    @property
-    def next(self):
-        return self._next
-
-    @next.setter
-    def next(self, next):
-        self._next = next
-
-    @property
-    def down(self):
-        return self._down
-
-    @down.setter
-    def down(self, down):
-        self._down = down
-
+def max_level_for(expected_size):
+    """根据预期的元素个数计算层数上限：log(1/P)(n) + 1"""
+    if not expected_size or expected_size < 2:
+        return 1
+    level = int(math.ceil(math.log(expected_size, 1 / P))) + 1
+    return max(1, min(level, MAX_LEVEL))
 
-class DataNode(object):
-    def __init__(self,
-                 key=None,
-                 value=None,
-                 next=None):
-        self._key = key
-        self._value = value
-        self._next = next
 
-    @property
-    def key(self):
-        return self._key
-
-    @key.setter
-    def key(self, key):
-        self._key = key
-
-    @property
-    def value(self):
-        return self._value
-
-    @value.setter
-    def value(self, value):
-        self._value = value
-
-    @property
-    def next(self):
-        return self._next
+class Node(object):
+    """
+    跳表节点。一个节点就是一座“塔”，nexts[i] 是第 i 层的后继
+    """
+    __slots__ = ("key", "value", "nexts")
 
-    @next.setter
-    def next(self, next):
-        self._next = next
+    def __init__(self, key, value, level):
+        self.key = key
+        self.value = value
+        self.nexts = [None] * level
 
 
 class SkipListMap(object):
-    """基于跳表的映射"""
-    def __init__(self):
-        self._heads = [DataNode()]
+    """
+    基于跳表的映射
+
+    每次操作之后，都会把该 key 在各层的前驱保存在 _finger 中。
+    插入、删除时，如果 key 比上一次操作的大，就从 _finger 开始向上爬，
+    然后再向下查找（手指搜索），所以按顺序插入、删除，以及先查找再插入、
+    删除同一个 key 的代价接近 O(1)。随机查找从头节点开始，省去向上爬的开销
+    """
+    # 遍历时直接沿着节点前进，必须在持有缓存的锁时遍历
+    SNAPSHOT_ITERATION = False
+
+    def __init__(self, expected_size=DEFAULT_EXPECTED_SIZE):
+        self._max_level = max_level_for(expected_size)
+        self._head = Node(None, None, self._max_level)
+        self._level = 1
         self._size = 0
+        self._finger = [self._head] * self._max_level
+
+    def _random_level(self):
+        level = 1
+        max_level = self._max_level
+        # 每两个比特都为 0 的概率是 P
+        bits = random.getrandbits(2 * max_level)
+        while bits & 3 == 0 and level < max_level:
+            level = level + 1
+            bits = bits >> 2
+        return level
+
+    def _find(self, key, use_finger=True):
+        """
+        把 key 在各层的前驱写入 _finger，返回第 0 层的前驱
+        """
+        finger = self._finger
+        head = self._head
+        level = self._level - 1
+        node = finger[0]
+        if use_finger and (node is head or node.key < key):
+            # 向上爬，直到某一层的后继不小于 key，
+            # 该层及以上各层的前驱就是 _finger 中保存的节点
+            up = 0
+            while up <= level:
+                next_node = finger[up].nexts[up]
+                if next_node is None or not next_node.key < key:
+                    break
+                up = up + 1
+            if up == 0:
+                return node
+            level = up - 1
+            node = finger[level]
+        else:
+            node = head
+
+        while level >= 0:
+            next_node = node.nexts[level]
+            while next_node is not None and next_node.key < key:
+                node = next_node
+                next_node = node.nexts[level]
+            finger[level] = node
+            level = level - 1
+        return node
 
     def __setitem__(self, key, value):
-        # 判断在哪些层插入
-        k = 0
-        for level in range(1, len(self._heads)+1):
-            if random.random() < (1 - P):
-                break
-            k = level
-        else:
-            if len(self._heads) == MAX_LEVEL:
-                k = len(self._heads) - 1
-            else:
-                self._heads.append(Node(down=self._heads[k-1]))
-
-        node = self._heads[k]
-        prev_new_node = None
-        while True:
-            while node.next is not None and node.next.key < key:
-                node = node.next
-            if node.next is None or node.next.key > key:
-                # 插入新节点
-                is_zero_level = isinstance(node, DataNode)
-                if is_zero_level:
-                    new_node = DataNode(key, value)
-                else:
-                    new_node = Node(key)
-                new_node.next = node.next
-                node.next = new_node
-                if prev_new_node is not None:
-                    prev_new_node.down = new_node
-                prev_new_node = new_node
-                if is_zero_level:
-                    self._size = self._size + 1
-                    break
-                node = node.down
-            else:
-                node = node.next
-                if prev_new_node is not None:
-                    prev_new_node.down = node
-                while not isinstance(node, DataNode):
-                    node = node.down
-                node.value = value
-                break
+        prev = self._find(key)
+        node = prev.nexts[0]
+        if node is not None and node.key == key:
+            node.value = value
+            return
+
+        finger = self._finger
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                finger[i] = self._head
+            self._level = level
+
+        node = Node(key, value, level)
+        nexts = node.nexts
+        for i in range(level):
+            prev = finger[i]
+            nexts[i] = prev.nexts[i]
+            prev.nexts[i] = node
+            # 新节点是比它大的 key 在这一层的前驱
+            finger[i] = node
+        self._size = self._size + 1
 
     def __getitem__(self, key):
-        node = self._heads[-1]
-        while True:
-            while node.next is not None and node.next.key < key:
-                node = node.next
-            if node.next is None or node.next.key > key:
-                if isinstance(node, DataNode):
-                    break
-                node = node.down
-                continue
-            node = node.next
-            while not isinstance(node, DataNode):
-                node = node.down
+        node = self._find(key, False).nexts[0]
+        if node is not None and node.key == key:
             return node.value
         raise KeyError(key)
 
     def __delitem__(self, key):
-        exists = False
-        node = self._heads[-1]
-        while True:
-            while node.next is not None and node.next.key < key:
-                node = node.next
-            if node.next is not None and node.next.key == key:
-                exists = True
-                node.next = node.next.next
-            if isinstance(node, DataNode):
-                break
-            node = node.down
-        if exists:
-            self._size = self._size - 1
+        node = self._find(key).nexts[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
 
-            while len(self._heads) > 1:
-                if self._heads[-1].next is not None:
-                    break
-                self._heads.pop(-1)
+        finger = self._finger
+        nexts = node.nexts
+        for i in range(len(nexts)):
+            finger[i].nexts[i] = nexts[i]
+        self._size = self._size - 1
+
+        head_nexts = self._head.nexts
+        while self._level > 1 and \
+                head_nexts[self._level - 1] is None:
+            self._level = self._level - 1
+
+    def bulk_insert(self, items):
+        """
+        批量插入 (key, value)，key 相同时后面的覆盖前面的。先按 key 排序，
+        如果映射是空的，就按位置确定每座塔的高度（第 i 个节点的高度为
+        1 + i 的四进制末尾 0 的个数），在 O(n) 时间内直接建成跳表；
+        否则按顺序逐个插入，手指搜索使相邻的 key 的插入代价接近 O(1)
+        """
+        items = sorted(items, key=itemgetter(0))
+        if self._size > 0:
+            for key, value in items:
+                self[key] = value
+            return
+
+        head = self._head
+        max_level = self._max_level
+        last = [head] * max_level
+        level = 1
+        count = 0
+        for key, value in items:
+            prev = last[0]
+            if prev is not head and prev.key == key:
+                prev.value = value
+                continue
+            count = count + 1
+            node_level = 1
+            i = count
+            while i & 3 == 0 and node_level < max_level:
+                node_level = node_level + 1
+                i = i >> 2
+            node = Node(key, value, node_level)
+            for l in range(node_level):
+                last[l].nexts[l] = node
+                last[l] = node
+            if node_level > level:
+                level = node_level
+        self._level = level
+        self._size = count
+        # 最后一批节点是比最大的 key 更大的 key 的前驱
+        self._finger = last
+
+    def __contains__(self, key):
+        node = self._find(key, False).nexts[0]
+        return node is not None and node.key == key
+
+    def get(self, key, default=None):
+        node = self._find(key, False).nexts[0]
+        if node is not None and node.key == key:
+            return node.value
+        return default
+
+    def iteritems(self):
+        node = self._head.nexts[0]
+        while node is not None:
+            yield node.key, node.value
+            node = node.nexts[0]
+
+    def __iter__(self):
+        for key, _ in self.iteritems():
+            yield key
+
+    def iter_range(self, lo=None, hi=None):
+        """按顺序遍历 key 在 [lo, hi) 范围内的元素，lo、hi 为 None 表示不限"""
+        if lo is None:
+            node = self._head.nexts[0]
         else:
-            raise KeyError(key)
+            node = self._find(lo, False).nexts[0]
+        while node is not None:
+            if hi is not None and not node.key < hi:
+                break
+            yield node.key, node.value
+            node = node.nexts[0]
+
+    def iter_prefix(self, prefix):
+        """按顺序遍历 key 以 prefix 开头的元素"""
+        node = self._find(prefix, False).nexts[0]
+        while node is not None:
+            key = node.key
+            if not isinstance(key, str) or \
+                    not key.startswith(prefix):
+                break
+            yield key, node.value
+            node = node.nexts[0]
 
     def __len__(self):
         return self._size
 
     @property
-    def heads(self):
-        return self._heads
+    def head(self):
+        return self._head
 
     @property
     def level(self):
-        return len(self._heads)
+        return self._level
+
+    @property
+    def max_level(self):
+        return self._max_level
 
 
 def print_skip_list_map(slm):
     print("SkipListMap %r with %d elements is shown as below:" %
           (slm, len(slm)))
-    for level in range(len(slm.heads)-1, -1, -1):
+    for level in range(slm.level-1, -1, -1):
         print("\tlevel %d:" % level)
-        node = slm.heads[level]
-        while node.next is not None:
-            node = node.next
+        node = slm.head.nexts[level]
+        while node is not None:
             print("\t\tnode %r is shown as below:" % node)
             print("\t\t\tnode.key: %s" % node.key)
-            print("\t\t\tnode.next: %r" % node.next)
-            if isinstance(node, DataNode):
-                print("\t\t\tnode.value: %r" % node.value)
-            else:
-                print("\t\t\tnode.down: %r" % node.down)
+            print("\t\t\tnode.value: %r" % node.value)
+            print("\t\t\tnode.level: %d" % len(node.nexts))
+            node = node.nexts[level]
 
 
 def test_skip_list_map(map_obj, element_count, repeat_count):
     import time
-    import pprint
 
     elements = range(element_count) * repeat_count
     random.shuffle(elements)
-    print("elements are:")
-    # pprint.pprint(elements)
 
     start_time = time.time()
 
@@ -209,13 +266,59 @@ def test_skip_list_map(map_obj, element_count, repeat_count):
     for element in elements:
         assert map_obj[element] == element, \
             "there are some bugs in __getitem__(key)"
+    assert list(map_obj) == sorted(set(elements)), \
+        "there are some bugs in __iter__()"
     for element in set(elements):
         del map_obj[element]
-    assert len(map_obj) == 0, \
+    assert len(map_obj) == 0 and map_obj.level == 1, \
         "there are some bugs in __delitem__(key)"
 
+    # 批量构建和批量合并
+    odd = [(i, i) for i in range(1, element_count, 2)]
+    random.shuffle(odd)
+    map_obj.bulk_insert((i, i) for i in range(0, element_count, 2))
+    map_obj.bulk_insert(odd)
+    map_obj.bulk_insert([(2, -1), (2, 2)])
+    assert list(map_obj.iteritems()) == \
+        [(i, i) for i in range(element_count)], \
+        "there are some bugs in bulk_insert(items)"
+    for element in range(element_count):
+        assert map_obj[element] == element
+        del map_obj[element]
+    assert len(map_obj) == 0 and map_obj.level == 1
+
+    # 范围遍历和前缀遍历
+    for element in range(element_count):
+        map_obj["k%04d" % element] = element
+    assert [v for _, v in map_obj.iter_range("k0010", "k0020")] == \
+        range(10, 20), "there are some bugs in iter_range(lo, hi)"
+    assert [v for _, v in map_obj.iter_range(hi="k0003")] == \
+        range(3), "there are some bugs in iter_range(lo, hi)"
+    assert [v for _, v in map_obj.iter_prefix("k001")] == \
+        range(10, 20), "there are some bugs in iter_prefix(prefix)"
+    assert list(map_obj.iter_prefix("x")) == []
+    for element in range(element_count):
+        del map_obj["k%04d" % element]
+
+    # 顺序插入、删除走手指搜索
+    for element in range(element_count):
+        map_obj[element] = element
+    assert list(map_obj) == range(element_count)
+    for element in range(element_count):
+        assert element in map_obj
+        del map_obj[element]
+    assert len(map_obj) == 0
+    assert map_obj.get(0) is None
+    try:
+        del map_obj[0]
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError expected")
+
     print("time elapsed %.3fs" % (time.time() - start_time))
 
 
 if __name__ == "__main__":
     test_skip_list_map(SkipListMap(), 1000, 2)
+    test_skip_list_map(SkipListMap(expected_size=10), 1000, 2)
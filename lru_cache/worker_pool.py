@@ -0,0 +1,142 @@
+# coding: utf8
+
+import logging
+import threading
+from Queue import Queue, Empty, Full
+
+LOGGER = logging.getLogger(__name__)
+
+# 通知工作线程退出
+_STOP = object()
+
+
+class WorkerPool(object):
+    """
+    有界队列加上一组工作线程。工作线程每次从队列中取出最多 batch_size 个任务，
+    整批交给 handler 处理。队列满或者已经停止时 submit 不等待，
+    由调用者决定怎么处理
+    """
+    def __init__(self, name, thread_count, queue_size,
+                 batch_size, handler):
+        self._name = name
+        self._thread_count = thread_count
+        self._queue = Queue(queue_size)
+        self._batch_size = batch_size
+        self._handler = handler
+        self._threads = []
+        # stop 之后提交的任务排在 _STOP 后面，不会被处理，所以直接拒绝
+        self._stopped = False
+        self._submit_lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    def start(self):
+        for index in range(self._thread_count):
+            thread = threading.Thread(
+                target=self._main,
+                name="%s-%d" % (self._name, index))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, item):
+        """提交一个任务，队列满了或者已经停止时返回 False"""
+        with self._submit_lock:
+            if self._stopped:
+                return False
+            try:
+                self._queue.put_nowait(item)
+            except Full:
+                return False
+        return True
+
+    def stop(self, timeout=None):
+        """处理完已经提交的任务之后，工作线程退出"""
+        with self._submit_lock:
+            self._stopped = True
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+            if thread.isAlive():
+                LOGGER.error("%s is still running", thread.getName())
+        self._threads = []
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _main(self):
+        queue = self._queue
+        while True:
+            item = queue.get()
+            batch = []
+            stop = False
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self._batch_size:
+                    break
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    break
+            if batch:
+                try:
+                    self._handler(batch)
+                except:
+                    LOGGER.error("%s failed to handle %d tasks",
+                                 self._name, len(batch), exc_info=True)
+            if stop:
+                return
+
+
+def test_worker_pool():
+    import time
+
+    batches = []
+    lock = threading.Lock()
+
+    def handler(batch):
+        time.sleep(0.01)
+        with lock:
+            batches.append(batch)
+
+    pool = WorkerPool("test-pool", 2, 100, 10, handler)
+    for i in range(100):
+        assert pool.submit(i)
+    # 队列满了，不等待
+    assert not pool.submit(100)
+    pool.start()
+    pool.stop()
+    # 停止之后提交的任务被拒绝
+    assert not pool.submit(101)
+    items = sorted(item for batch in batches for item in batch)
+    assert items == list(range(100))
+    assert max(len(batch) for batch in batches) == 10
+    # 整批处理，批数远少于任务数
+    assert len(batches) < 50
+
+    # handler 抛出异常不影响后续的任务
+    handled = []
+
+    def failing_handler(batch):
+        handled.extend(batch)
+        raise ValueError("failed")
+
+    pool = WorkerPool("failing-pool", 1, 10, 1, failing_handler)
+    pool.start()
+    pool.submit(1)
+    pool.submit(2)
+    pool.stop()
+    assert handled == [1, 2]
+
+    print("all tests passed")
+
+
+if __name__ == "__main__":
+    test_worker_pool()
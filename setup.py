@@ -4,5 +4,5 @@ from setuptools import setup, find_packages
 setup(
     name="lru_cache",
     version="0.0.1",
-    packages=find_packages()
+    packages=find_packages(exclude=["benchmarks"])
 )
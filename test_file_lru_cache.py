@@ -2,9 +2,12 @@
 
 import logging
 import os.path
+import shutil
 import sys
+import time
 
-from lru_cache.file_lru_cache import FileLRUCacheBuilder
+from lru_cache.file_lru_cache import FileLRUCache, FileLRUCacheBuilder
+from lru_cache.shared_index import SharedIndex
 from lru_cache.abstract_lru_cache import (
     ProxyCache,
     Serializer,
@@ -63,6 +66,293 @@ def test():
             cache.stop()
 
 
+def test_shared_index():
+    """
+    两个进程共享一个索引：一个进程写入的缓存，另一个进程直接读取，不再计算
+    """
+    base_path = os.path.join(BASE_DIR, "shared")
+    os.mkdir(base_path)
+
+    def build(name):
+        return FileLRUCacheBuilder() \
+            .with_name(name) \
+            .with_base_path(base_path) \
+            .with_max_entry_count(100) \
+            .with_max_size(1024*1024) \
+            .with_shared_index() \
+            .build()
+
+    serializer = TestSerializer()
+    leader = build("shared-leader")
+    leader.start()
+    leader.wait_for_usable()
+    try:
+        leader.open("leaderkey", serializer, False, lambda: "from-leader")
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                follower = build("shared-follower")
+                follower.start()
+                follower.wait_for_usable()
+                ret = follower.open("leaderkey", serializer, False,
+                                    lambda: "recomputed")
+                follower.open("followerkey", serializer, False,
+                              lambda: "from-follower")
+                follower.stop()
+                if ret == "from-leader":
+                    code = 0
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+        ret = leader.open("followerkey", serializer, False,
+                          lambda: "recomputed")
+        LOGGER.info("ret = [[%s]]", ret)
+        assert ret == "from-follower"
+        assert leader.purge("followerkey") & ReturnCode.OK
+        assert leader.open("followerkey", serializer, False,
+                           lambda: "recomputed") == "recomputed"
+
+        # 管理进程淘汰了缓存文件，本地仍然有元数据的 key 当作普通的未命中，
+        # 重新计算并写回
+        for key in ("leaderkey", "followerkey"):
+            os.remove(leader._generate_path(key))
+            leader._shared_index.remove(key)
+        assert leader.open("leaderkey", serializer, False,
+                           lambda: "rewritten") == "rewritten"
+        assert leader.open_many(
+            ["followerkey"], serializer, False,
+            lambda keys: dict((key, "rewritten") for key in keys)) == \
+            {"followerkey": "rewritten"}
+        for key in ("leaderkey", "followerkey"):
+            assert os.path.isfile(leader._generate_path(key))
+            assert leader._shared_index.get(key) is not None
+            assert leader.open(key, serializer, False,
+                               lambda: "recomputed") == "rewritten"
+    finally:
+        leader.stop()
+        shutil.rmtree(base_path)
+
+    # 管理进程加载完成之前，其它进程不可用；它退出时由等待的进程接替加载
+    os.mkdir(base_path)
+    holder = SharedIndex(
+        os.path.join(base_path, FileLRUCache.SHARED_INDEX_NAME), 200)
+    holder.open()
+    assert holder.acquire_lease()
+    waiter = build("shared-waiter")
+    waiter.start()
+    try:
+        assert not waiter.wait_for_usable(0.3)
+        holder.close()
+        assert waiter.wait_for_usable(1)
+        assert waiter._shared_index.holds_lease()
+        assert waiter._shared_index.is_loaded()
+    finally:
+        waiter.stop()
+        shutil.rmtree(base_path)
+
+
+def _count_process_flight_calls(base_path, keys, process_count, cost):
+    """
+    process_count 个进程开启进程间 single-flight，各自从不同的位置开始，
+    依次访问 keys，返回所有进程调用计算函数的总次数
+    """
+    read_fd, write_fd = os.pipe()
+    pids = []
+    for index in range(process_count):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(read_fd)
+                cache = FileLRUCacheBuilder() \
+                    .with_name("process-flight-%d" % os.getpid()) \
+                    .with_base_path(base_path) \
+                    .with_max_entry_count(100) \
+                    .with_max_size(1024*1024) \
+                    .with_process_flight() \
+                    .build()
+                cache.start()
+                cache.wait_for_usable()
+
+                def compute(key):
+                    os.write(write_fd, "x")
+                    time.sleep(cost)
+                    return "computed-" + key
+
+                start = index * len(keys) // process_count
+                code = 0
+                for key in keys[start:] + keys[:start]:
+                    ret = cache.open(key, TestSerializer(), False,
+                                     compute, key)
+                    if ret != "computed-" + key:
+                        code = 1
+                cache.stop()
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    os.close(write_fd)
+    for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+    with os.fdopen(read_fd) as fd:
+        calls = fd.read()
+    LOGGER.info("calls = [[%d]]", len(calls))
+    return len(calls)
+
+
+def test_process_flight():
+    """
+    多个进程同时访问没有缓存的 key，每个 key 只有一个进程计算
+    """
+    base_path = os.path.join(BASE_DIR, "flight")
+    os.mkdir(base_path)
+    try:
+        assert _count_process_flight_calls(
+            base_path, ["flightkey"], 4, 0.2) == 1
+
+        # 多个 key：其它进程已经写入的文件在锁之前就存在，也直接使用
+        keys = ["flightkey%02d" % index for index in range(20)]
+        assert _count_process_flight_calls(
+            base_path, keys, 4, 0.02) == len(keys)
+
+        # 自己写入的文件过期之后重新计算，不会被当作其它进程的结果
+        cache = FileLRUCacheBuilder() \
+            .with_name("process-flight-ttl") \
+            .with_base_path(base_path) \
+            .with_max_entry_count(100) \
+            .with_max_size(1024*1024) \
+            .with_process_flight() \
+            .with_ttl(0.1) \
+            .build()
+        cache.start()
+        cache.wait_for_usable()
+        try:
+            results = iter(["first", "second"])
+            assert cache.open("ttlkey", TestSerializer(), False,
+                              lambda: next(results)) == "first"
+            time.sleep(0.2)
+            assert cache.open("ttlkey", TestSerializer(), False,
+                              lambda: next(results)) == "second"
+        finally:
+            cache.stop()
+    finally:
+        shutil.rmtree(base_path)
+
+
+def test_journal():
+    """
+    正常停止、崩溃之后都从快照和日志恢复元数据，快照损坏时遍历目录
+    """
+    base_path = os.path.join(BASE_DIR, "journal")
+    os.mkdir(base_path)
+    # 遍历目录时会被删除的文件，用来判断是否遍历了目录
+    stray_path = os.path.join(base_path, "stray")
+    serializer = TestSerializer()
+    keys = ["journalkey%d" % i for i in range(12)]
+
+    def build():
+        cache = FileLRUCacheBuilder() \
+            .with_name("journal") \
+            .with_base_path(base_path) \
+            .with_max_entry_count(100) \
+            .with_max_size(1024*1024) \
+            .with_journal() \
+            .build()
+        cache.start()
+        cache.wait_for_usable()
+        return cache
+
+    try:
+        cache = build()
+        for key in keys[:10]:
+            cache.open(key, serializer, False, lambda key: key, key)
+        # keys[0] 被再次访问，keys[1] 成为最久没有被访问的
+        cache.open(keys[0], serializer, False, lambda key: key, keys[0])
+        cache.stop()
+        open(stray_path, "w").close()
+
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                cache = build()
+                for key in keys[10:]:
+                    cache.open(key, serializer, False, lambda key: key, key)
+                code = 0
+            finally:
+                # 不调用 stop，模拟进程崩溃
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+
+        cache = build()
+        assert os.path.isfile(stray_path)
+        for key in keys:
+            assert cache.get(key, serializer) == key
+        assert cache._policy.victim().key == keys[1]
+        cache.stop()
+
+        snapshot_path = os.path.join(
+            base_path, cache.JOURNAL_NAME, "snapshot")
+        with open(snapshot_path, "r+b") as fd:
+            fd.write("x")
+        cache = build()
+        assert not os.path.isfile(stray_path)
+        for key in keys:
+            assert cache.get(key, serializer) == key
+        cache.stop()
+    finally:
+        shutil.rmtree(base_path)
+
+
+def test_parallel_load():
+    """
+    多个线程并行遍历目录，加载的速度不超过 I/O 预算
+    """
+    base_path = os.path.join(BASE_DIR, "parallel")
+    os.mkdir(base_path)
+    serializer = TestSerializer()
+    keys = ["parallelkey%02d" % i for i in range(50)]
+
+    def build(*budget):
+        cache = FileLRUCacheBuilder() \
+            .with_name("parallel-load") \
+            .with_base_path(base_path) \
+            .with_max_entry_count(100) \
+            .with_max_size(1024*1024) \
+            .with_load_threads(4, 2) \
+            .with_load_budget(*budget) \
+            .build()
+        cache.start()
+        cache.wait_for_usable()
+        return cache
+
+    try:
+        cache = build(10000, 0)
+        for key in keys:
+            cache.open(key, serializer, False, lambda key: key, key)
+        cache.stop()
+        # 不合法的文件和目录在加载时被删除
+        open(os.path.join(base_path, "stray"), "w").close()
+        os.mkdir(os.path.join(base_path, "invalid"))
+
+        # 每 0.1 秒最多 10 个文件，50 个文件至少需要 0.4 秒
+        start_time = time.time()
+        cache = build(10, 0.1)
+        time_used = time.time() - start_time
+        LOGGER.info("time used = [[%.3f]]", time_used)
+        assert time_used >= 0.4
+        for key in keys:
+            assert cache.get(key, serializer) == key
+        assert sorted(os.listdir(base_path)) == \
+            sorted(set(key[-1] for key in keys))
+        cache.stop()
+    finally:
+        shutil.rmtree(base_path)
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.DEBUG,
@@ -71,3 +361,7 @@ if __name__ == "__main__":
         datefmt="%Y-%m-%d %H:%M:%S")
 
     test()
+    test_shared_index()
+    test_process_flight()
+    test_journal()
+    test_parallel_load()